@@ -0,0 +1,108 @@
+"""Compare encoding a ClickHouse insert block from a DataFrame and from columns.
+
+Runs clickhouse_driver's own column writers into a socket that only counts
+bytes, so the numbers cover what happens on the client for one batch:
+"dataframe" is the former path (pandas.DataFrame with an event_moment2
+copy, use_numpy columns parsing the timestamp strings), "columnar" is
+ClickHouse._insert_columns with the generic columns. No server is needed.
+
+Run:
+    python benchmarks/bench_clickhouse_insert.py [--rows 20000] [--repeat 5]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+from clickhouse_driver.bufferedwriter import BufferedSocketWriter
+from clickhouse_driver.columns.service import get_column_by_spec
+from clickhouse_driver.context import Context
+
+from cloudreports import database
+from cloudreports.buffer import ColumnBuffer, as_columns
+from bench_ingest import make_rows
+
+ORDER = ['entity_href', 'entity_id', 'entity_type', 'entity_data', 'event_type', 'event_moment', 'event_moment2']
+SPECS = ['String'] * 5 + ['DateTime'] * 2
+
+
+class CountingSocket(object):
+
+    def __init__(self):
+        self.bytes = 0
+
+
+    def sendall(self, data):
+        self.bytes += len(data)
+
+
+def make_context():
+    context = Context()
+    context.settings = {}
+    context.client_settings = {'strings_as_bytes': False, 'strings_encoding': 'utf-8', 'use_numpy': False,
+                               'input_format_null_as_default': False}
+    context.server_info = type('ServerInfo', (), {'timezone': 'UTC', 'get_timezone': lambda self: 'UTC'})()
+    return context
+
+
+def encode(context, columns, use_numpy):
+    sock = CountingSocket()
+    writer = BufferedSocketWriter(sock, 1 << 20)
+    for spec, items in zip(SPECS, columns):
+        column = get_column_by_spec(spec, {'context': context, 'types_check': False}, use_numpy=use_numpy)
+        column.write_state_prefix(writer, items)
+        column.write_data(items, writer)
+    writer.flush()
+    return sock.bytes
+
+
+def dataframe_path(context, data):
+    import pandas
+    columns = dict(as_columns(data))
+    columns['event_moment2'] = columns['event_moment']
+    df = pandas.DataFrame(columns, copy=False)
+    return encode(context, [df[name].values for name in ORDER], True)
+
+
+def columnar_path(context, data):
+    ch = database.ClickHouse.__new__(database.ClickHouse)
+    return encode(context, ch._insert_columns(data), False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--fields', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    data = ColumnBuffer()
+    for entity_href, entity_id, entity_type, entity_data, event_moment in make_rows(args.rows, args.fields, 1, 5):
+        data.append(entity_href, str(entity_id), entity_type, json.dumps(entity_data), str(event_moment), 'update')
+    context = make_context()
+
+    paths = {'columnar': columnar_path}
+    try:
+        import pandas  # noqa: F401
+        paths = {'dataframe': dataframe_path, **paths}
+    except ImportError:
+        print('pandas is not installed, skipping the dataframe path')
+
+    print(f'{"path":<10} {"rows/s":>10} {"ms/batch":>9} {"peak MB":>8} {"block MB":>9}')
+    for name, path in paths.items():
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            size = path(context, data)
+            timings.append(time.perf_counter() - start)
+        tracemalloc.start()
+        path(context, data)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        best = min(timings)
+        print(f'{name:<10} {args.rows / best:>10,.0f} {best * 1000:>9,.1f} {peak / 2 ** 20:>8,.1f} {size / 2 ** 20:>9,.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Compare cold-start import time of cloudreports.database.
+
+Every measurement runs in a fresh interpreter, so nothing is cached in
+sys.modules. "eager" imports what the single database module used to load
+up front; the other rows import the package and touch one backend class.
+
+Run:
+    python benchmarks/bench_import.py [--repeat 5]
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+CASES = {
+    'eager (before)': 'import google.cloud.bigquery, google.oauth2.service_account, clickhouse_driver, pandas',
+    'import database': 'from cloudreports import database',
+    'ClickHouse': 'from cloudreports import database; database.ClickHouse',
+    'BigQuery': 'from cloudreports import database; database.BigQuery',
+}
+
+
+def measure(statement):
+    code = ('import time; start = time.perf_counter(); '
+            f'{statement}; print(time.perf_counter() - start)')
+    output = subprocess.run([sys.executable, '-c', code], check=True, capture_output=True, text=True).stdout
+    return float(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"case":<16} {"median ms":>10} {"min ms":>8}')
+    for name, statement in CASES.items():
+        try:
+            timings = [measure(statement) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError:
+            print(f'{name:<16} not installed')
+            continue
+        print(f'{name:<16} {statistics.median(timings) * 1000:>10,.1f} {min(timings) * 1000:>8,.1f}')
+
+
+if __name__ == '__main__':
+    main()
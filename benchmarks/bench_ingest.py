@@ -0,0 +1,202 @@
+"""Measure ingest throughput against in-memory fake backends.
+
+Drives Client.load_json_data -> finish_load_json_data ->
+database.load_json_data -> update_tables for each backend configuration
+with synthetic payloads, and reports rows/s, bytes/s, peak memory and
+backend calls per batch. Results can be appended to a JSON file and
+compared with the previous run stored there.
+
+Run:
+    python benchmarks/bench_ingest.py [--rows 50000] [--fields 20] [--depth 2]
+        [--entity-types 10] [--buffer-size 3000] [--output bench_ingest.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from cloudreports.client import Client
+from cloudreports import database
+from fakes import FakeBigQueryClient, FakeClickHouseClient
+
+BACKENDS = ('clickhouse', 'clickhouse-direct', 'clickhouse-mv', 'bigquery-json', 'bigquery-parquet')
+
+
+def make_backend(name, **options):
+    """Return (database, fake client) for a backend configuration name"""
+    if name.startswith('clickhouse'):
+        mode = {'clickhouse': 'temp_table', 'clickhouse-direct': 'direct',
+                'clickhouse-mv': 'materialized_view'}[name]
+        fake = FakeClickHouseClient()
+        return database.ClickHouse('localhost', 'bench', 'bench', 'bench', partition_mode=mode,
+                                   client=fake, **options), fake
+    fake = FakeBigQueryClient()
+    return database.BigQuery('bench', 'bench', load_format=name.split('-')[1], client=fake, **options), fake
+
+
+def make_value(rng, i, depth, width):
+    if depth > 0 and i % 4 == 0:
+        return {f'k{j}': make_value(rng, i + j + 1, depth - 1, width) for j in range(width)}
+    kind = i % 4
+    if kind == 1:
+        return rng.randint(0, 10 ** 6)
+    if kind == 2:
+        return rng.random() * 1000
+    if kind == 3:
+        return rng.random() < 0.5
+    return f'value-{rng.randint(0, 10 ** 6)}'
+
+
+def make_rows(rows, fields, depth, entity_types, seed=0):
+    """Return a list of (entity_href, entity_id, entity_type, entity_data, event_moment) tuples"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    result = []
+    for i in range(rows):
+        entity_type = f'type_{i % entity_types}'
+        entity_id = rng.randint(0, max(1, rows // 2))
+        data = {f'field_{j}': make_value(rng, j, depth, 3) for j in range(fields)}
+        data['id'] = entity_id
+        result.append((f'https://api.example.com/{entity_type}/{entity_id}', entity_id, entity_type, data,
+                       start + timedelta(seconds=i)))
+    return result
+
+
+def ingest(backend, rows, buffer_size, client_options, load_many=False):
+    db, fake = make_backend(backend)
+    batches = [0]
+    load_json_data = db.load_json_data
+
+    def counted(data):
+        batches[0] += 1
+        return load_json_data(data)
+
+    db.load_json_data = counted
+    client = Client(db, buffer_size=buffer_size, **client_options)
+    start = time.perf_counter()
+    if load_many:
+        client.load_many(rows)
+    else:
+        for entity_href, entity_id, entity_type, entity_data, event_moment in rows:
+            client.load_json_data(entity_href, entity_id, entity_type, entity_data, event_moment, 'update')
+    client.finish_load_json_data()
+    load_seconds = time.perf_counter() - start
+    load_calls = dict(fake.calls)
+    start = time.perf_counter()
+    summary = db.update_tables()
+    update_seconds = time.perf_counter() - start
+    client.close()
+    return {'load_seconds': load_seconds, 'update_tables_seconds': update_seconds,
+            'batches': batches[0], 'load_calls': load_calls,
+            'update_tables_calls': dict(fake.calls - Counter(load_calls)), 'views': len(summary['created'])}
+
+
+def run_backend(backend, rows, payload_bytes, args, client_options):
+    runs = [ingest(backend, rows, args.buffer_size, client_options, args.load_many) for _ in range(args.repeat)]
+    best = min(runs, key=lambda run: run['load_seconds'])
+
+    # a separate pass, tracemalloc slows down allocation heavy code
+    tracemalloc.start()
+    ingest(backend, rows, args.buffer_size, client_options, args.load_many)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    calls = sum(best['load_calls'].values())
+    return {
+        'rows_per_s': len(rows) / best['load_seconds'],
+        'bytes_per_s': payload_bytes / best['load_seconds'],
+        'load_seconds': best['load_seconds'],
+        'update_tables_seconds': best['update_tables_seconds'],
+        'peak_memory_mb': peak / 2 ** 20,
+        'batches': best['batches'],
+        'load_calls': best['load_calls'],
+        'update_tables_calls': best['update_tables_calls'],
+        'calls_per_batch': calls / max(1, best['batches']),
+        'views': best['views'],
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def load_history(path):
+    if path is None or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def print_results(results, previous=None):
+    print(f'{"backend":<18} {"rows/s":>10} {"MB/s":>7} {"peak MB":>8} {"calls/batch":>11} '
+          f'{"update_tables s":>15} {"vs previous":>11}')
+    for backend, result in results.items():
+        change = ''
+        if previous and backend in previous:
+            change = f'{result["rows_per_s"] / previous[backend]["rows_per_s"] - 1:+.1%}'
+        print(f'{backend:<18} {result["rows_per_s"]:>10,.0f} {result["bytes_per_s"] / 1e6:>7,.1f} '
+              f'{result["peak_memory_mb"]:>8,.1f} {result["calls_per_batch"]:>11,.1f} '
+              f'{result["update_tables_seconds"]:>15,.3f} {change:>11}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--fields', type=int, default=20, help='top-level fields per payload')
+    parser.add_argument('--depth', type=int, default=2, help='nesting depth of object fields')
+    parser.add_argument('--entity-types', type=int, default=10)
+    parser.add_argument('--buffer-size', type=int, default=3000)
+    parser.add_argument('--async-flush', action='store_true')
+    parser.add_argument('--load-many', action='store_true', help='send rows with Client.load_many')
+    parser.add_argument('--backend', nargs='+', choices=BACKENDS, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='JSON file to append the results to and compare with')
+    args = parser.parse_args()
+
+    backends = args.backend or [name for name in BACKENDS if name != 'bigquery-parquet']
+    if args.backend is None:
+        try:
+            import pyarrow  # noqa: F401
+            backends.append('bigquery-parquet')
+        except ImportError:
+            pass
+
+    rows = make_rows(args.rows, args.fields, args.depth, args.entity_types)
+    payload_bytes = sum(len(json.dumps(row[3])) for row in rows)
+    client_options = {'async_flush': args.async_flush}
+
+    results = {backend: run_backend(backend, rows, payload_bytes, args, client_options) for backend in backends}
+
+    history = load_history(args.output)
+    print_results(results, history[-1]['results'] if history else None)
+
+    if args.output:
+        history.append({
+            'time': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': sys.platform,
+            'params': {'rows': args.rows, 'fields': args.fields, 'depth': args.depth,
+                       'entity_types': args.entity_types, 'buffer_size': args.buffer_size,
+                       'async_flush': args.async_flush, 'load_many': args.load_many, 'repeat': args.repeat},
+            'payload_bytes': payload_bytes,
+            'results': results,
+        })
+        with open(args.output, 'w') as f:
+            json.dump(history, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
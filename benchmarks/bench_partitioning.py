@@ -0,0 +1,116 @@
+"""Compare brv_* view query cost under two brs_audit_partition layouts.
+
+Needs a live server, since only the server knows how many rows, bytes and
+slots a query costs. The same synthetic rows are loaded into two datasets:
+"legacy" keeps the original layout (4000 buckets, ClickHouse sorted by
+partition_entity_type, no BigQuery clustering) and "tuned" uses the
+options given on the command line, sorted (clustered) by entity_type,
+entity_href and event_moment. Every view is then read once per
+layout and the cost is printed side by side. The databases (datasets)
+<prefix>_legacy and <prefix>_tuned must exist; their br* tables are
+dropped and reloaded unless --skip-load is passed.
+
+Run:
+    python benchmarks/bench_partitioning.py clickhouse --host HOST --user USER --password PASSWORD
+        [--buckets 64] [--time-partition month] [--rows 200000] [--entity-types 5]
+    python benchmarks/bench_partitioning.py bigquery --project PROJECT --credentials key.json
+        [--buckets 64] [--time-partition day]
+"""
+
+import argparse
+import time
+
+from cloudreports import database
+from cloudreports.client import Client
+from bench_ingest import make_rows
+
+
+def make_databases(args):
+    """Return {'legacy': database, 'tuned': database}"""
+    tuned = {'partition_buckets': args.buckets, 'time_partition': args.time_partition}
+    if args.backend == 'clickhouse':
+        def make(name, **options):
+            return database.ClickHouse(args.host, name, args.user, args.password, port=args.port,
+                                       secure=args.secure, partition_mode='direct', **options)
+        return {
+            'legacy': make(f'{args.prefix}_legacy', order_by=('partition_entity_type',)),
+            'tuned': make(f'{args.prefix}_tuned', order_by=('entity_type', 'entity_href', 'event_moment'), **tuned),
+        }
+
+    def make(name, **options):
+        return database.BigQuery(args.project, name, credentials_file_path=args.credentials, **options)
+    return {
+        'legacy': make(f'{args.prefix}_legacy', cluster_by=()),
+        'tuned': make(f'{args.prefix}_tuned', cluster_by=('entity_type', 'entity_href', 'event_moment'), **tuned),
+    }
+
+
+def load(db, rows):
+    db.delete_tables()
+    client = Client(db, buffer_size=20000)
+    for entity_href, entity_id, entity_type, entity_data, event_moment in rows:
+        client.load_json_data(entity_href, entity_id, entity_type, entity_data, event_moment, 'update')
+    client.close()
+    db.update_tables()
+
+
+def view_cost(backend, db, key):
+    """Return {'seconds', 'rows', 'bytes'} for reading brv_<key> once"""
+    if backend == 'clickhouse':
+        start = time.perf_counter()
+        db.client.execute(f"SELECT count(), sum(length(entity_id)) FROM {db._database}.brv_{key}")
+        progress = db.client.last_query.progress
+        return {'seconds': time.perf_counter() - start, 'rows': progress.rows, 'bytes': progress.bytes}
+
+    from google.cloud import bigquery
+    start = time.perf_counter()
+    job = db.client.query(f"SELECT COUNT(*), SUM(LENGTH(entity_id)) FROM `{db._project}.{db._dataset}.brv_{key}`",
+                          job_config=bigquery.QueryJobConfig(use_query_cache=False))
+    job.result()
+    return {'seconds': time.perf_counter() - start, 'rows': job.slot_millis, 'bytes': job.total_bytes_processed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('backend', choices=('clickhouse', 'bigquery'))
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int, default=9440)
+    parser.add_argument('--insecure', dest='secure', action='store_false')
+    parser.add_argument('--user')
+    parser.add_argument('--password')
+    parser.add_argument('--project')
+    parser.add_argument('--credentials', help='service account key file')
+    parser.add_argument('--prefix', default='cloudreports_bench', help='database or dataset name prefix')
+    parser.add_argument('--buckets', type=int, default=64)
+    parser.add_argument('--time-partition', default=None)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--fields', type=int, default=10)
+    parser.add_argument('--entity-types', type=int, default=5)
+    parser.add_argument('--skip-load', action='store_true', help='query datasets loaded by an earlier run')
+    args = parser.parse_args()
+
+    databases = make_databases(args)
+    if not args.skip_load:
+        rows = make_rows(args.rows, args.fields, 1, args.entity_types)
+        for name, db in databases.items():
+            start = time.perf_counter()
+            load(db, rows)
+            print(f'loaded {name} in {time.perf_counter() - start:,.1f} s')
+
+    # ClickHouse reports rows read, BigQuery slot milliseconds
+    work = 'rows read' if args.backend == 'clickhouse' else 'slot ms'
+    print(f'{"view":<12} {"layout":<8} {"seconds":>8} {work:>12} {"bytes":>14}')
+    totals = {name: {'seconds': 0, 'rows': 0, 'bytes': 0} for name in databases}
+    for i in range(args.entity_types):
+        key = f'type_{i}'
+        for name, db in databases.items():
+            cost = view_cost(args.backend, db, key)
+            for metric in totals[name]:
+                totals[name][metric] += cost[metric] or 0
+            print(f'brv_{key:<8} {name:<8} {cost["seconds"]:>8,.3f} {cost["rows"] or 0:>12,} {cost["bytes"] or 0:>14,}')
+    for name, total in totals.items():
+        print(f'{"total":<12} {name:<8} {total["seconds"]:>8,.3f} {total["rows"]:>12,} {total["bytes"]:>14,}')
+
+
+if __name__ == '__main__':
+    main()
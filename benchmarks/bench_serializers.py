@@ -0,0 +1,83 @@
+"""Compare entity_data serializers on nested API payloads.
+
+Run:
+    python benchmarks/bench_serializers.py [--rows 20000]
+"""
+
+import argparse
+import random
+import timeit
+
+from cloudreports.serializer import SERIALIZERS
+
+
+def make_payload(i):
+    """A row shaped like the api.nasa.gov NeoWs feed used in tests/test.py"""
+    return {
+        'id': str(3542519 + i),
+        'neo_reference_id': str(3542519 + i),
+        'name': f'(2010 PK{i % 100})',
+        'nasa_jpl_url': f'http://ssd.jpl.nasa.gov/sbdb.cgi?sstr={3542519 + i}',
+        'absolute_magnitude_h': random.uniform(15, 30),
+        'estimated_diameter': {
+            unit: {
+                'estimated_diameter_min': random.random() * 1000,
+                'estimated_diameter_max': random.random() * 1000,
+            } for unit in ('kilometers', 'meters', 'miles', 'feet')
+        },
+        'is_potentially_hazardous_asteroid': bool(i % 7 == 0),
+        'close_approach_data': [{
+            'close_approach_date': '2015-09-08',
+            'close_approach_date_full': '2015-Sep-08 20:28',
+            'epoch_date_close_approach': 1441744080000,
+            'relative_velocity': {
+                'kilometers_per_second': str(random.uniform(1, 30)),
+                'kilometers_per_hour': str(random.uniform(1e4, 1e5)),
+                'miles_per_hour': str(random.uniform(1e4, 1e5)),
+            },
+            'miss_distance': {
+                'astronomical': str(random.random()),
+                'lunar': str(random.random() * 100),
+                'kilometers': str(random.random() * 1e7),
+                'miles': str(random.random() * 1e7),
+            },
+            'orbiting_body': 'Earth',
+        } for _ in range(1 + i % 3)],
+        'is_sentry_object': False,
+        'comment': 'Объект сближения',
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    payloads = [make_payload(i) for i in range(args.rows)]
+
+    print(f'{"serializer":<10} {"dumps rows/s":>14} {"dumps_many rows/s":>18} '
+          f'{"ndjson MB/s":>12} {"loads rows/s":>14}')
+    for name, cls in SERIALIZERS.items():
+        try:
+            serializer = cls()
+        except ImportError:
+            print(f'{name:<10} not installed')
+            continue
+
+        dumps = serializer.dumps
+        t_dumps = min(timeit.repeat(lambda: [dumps(p) for p in payloads], number=1, repeat=args.repeat))
+        t_many = min(timeit.repeat(lambda: serializer.dumps_many(payloads), number=1, repeat=args.repeat))
+        body = serializer.dumps_ndjson(payloads)
+        t_ndjson = min(timeit.repeat(lambda: serializer.dumps_ndjson(payloads), number=1, repeat=args.repeat))
+        texts = serializer.dumps_many(payloads)
+        loads = serializer.loads
+        t_loads = min(timeit.repeat(lambda: [loads(t) for t in texts], number=1, repeat=args.repeat))
+
+        print(f'{name:<10} {args.rows / t_dumps:>14,.0f} {args.rows / t_many:>18,.0f} '
+              f'{len(body) / t_ndjson / 1e6:>12,.1f} {args.rows / t_loads:>14,.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""In-memory stand-ins for clickhouse_driver.Client and bigquery.Client.
+
+They answer the queries the backends send with just enough data for
+load_json_data and update_tables to run, keep rows only as counts, and
+count every call, so benchmarks measure the library rather than a server.
+Pass them to the backends with client=.
+"""
+
+import io
+import json
+from collections import Counter
+from datetime import datetime, timezone
+
+
+class FakeClickHouseClient(object):
+    """Define FakeClickHouseClient."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.rows = Counter()
+        self.schema = {}
+        # the layout stored for brs_audit_partition
+        self.layout = None
+        # table_name of the brs_watermark rows inserted with params
+        self.watermarks = set()
+
+
+    def execute(self, query, params=None, **kwargs):
+        self.calls['execute'] += 1
+        query = ' '.join(query.split())
+        table = _insert_target(query)
+        if table is not None and params is not None:
+            if kwargs.get('columnar'):
+                rows = len(params[0]) if params else 0
+            else:
+                params = list(params)
+                rows = len(params)
+            self.rows[table] += rows
+            if table.endswith('brs_schema'):
+                self._add_schema(zip(*params) if kwargs.get('columnar') else params)
+            if table.endswith('brs_watermark'):
+                for row in params:
+                    self.watermarks.add(row[0])
+                    if row[0] == 'brs_audit_partition_layout':
+                        self.layout = row[-1]
+            return rows
+        if query.startswith('SELECT count() FROM') and 'brs_watermark' in query:
+            # brs_audit_partition always has a watermark, so it is never rebuilt
+            stored = {'brs_audit_partition'} | self.watermarks
+            return [(int(any(f"'{name}'" in query for name in stored)),)]
+        if 'argMax(layout, updated)' in query:
+            return [(self.layout,)] if self.layout else []
+        if 'groupUniqArray(type)' in query:
+            return [(entity_type, field, sorted(types))
+                    for entity_type, fields in self.schema.items() for field, types in fields.items()]
+        return []
+
+
+    def disconnect(self):
+        self.calls['disconnect'] += 1
+
+
+    def _add_schema(self, rows):
+        for row in rows:
+            if isinstance(row, dict):
+                row = (row['entity_type'], row['field'], row.get('type', ''))
+            self.schema.setdefault(row[0], {}).setdefault(row[1], set()).add(row[2] if len(row) > 2 else '')
+
+
+class FakeBigQueryClient(object):
+    """Define FakeBigQueryClient."""
+
+    def __init__(self, project='bench'):
+        self.project = project
+        self.calls = Counter()
+        self.rows = Counter()
+        self.bytes = Counter()
+        self.schema = {}
+        # the layout stored for brs_audit_partition
+        self.layout = None
+        # table_name of the brs_watermark rows loaded
+        self.watermarks = set()
+
+
+    def dataset(self, dataset_id):
+        from google.cloud import bigquery
+        return bigquery.DatasetReference(self.project, dataset_id)
+
+
+    def query(self, query, job_config=None, **kwargs):
+        self.calls['query'] += 1
+        query = ' '.join(query.split())
+        if 'FARM_FINGERPRINT(entity_type)' in query and 'UNNEST(@entity_types)' in query:
+            entity_types = job_config.query_parameters[0].values
+            return _FakeJob([{'entity_type': entity_type, 'partition_entity_type': hash(entity_type) % 4000}
+                             for entity_type in entity_types])
+        if query.startswith('SELECT COUNT(*) discovered'):
+            return _FakeJob([{'discovered': int('brs_schema_discovery' in self.watermarks)}])
+        if query.startswith('SELECT layout FROM'):
+            return _FakeJob([{'layout': self.layout}] if self.layout else [])
+        if query.startswith('SELECT MAX(watermark)'):
+            return _FakeJob([{'watermark': datetime(2020, 1, 1, tzinfo=timezone.utc)}])
+        if 'FROM `' in query and 'brs_schema`' in query and 'GROUP BY entity_type, field' in query:
+            return _FakeJob([{'entity_type': entity_type, 'field': field, 'types': sorted(types)}
+                             for entity_type, fields in self.schema.items() for field, types in fields.items()])
+        return _FakeJob([])
+
+
+    def load_table_from_file(self, file_obj, destination, size=None, job_config=None, **kwargs):
+        self.calls['load_table_from_file'] += 1
+        body = file_obj.read()
+        table = destination.table_id
+        self.bytes[table] += len(body)
+        if body[:4] == b'PAR1':
+            import pyarrow.parquet
+            self.rows[table] += pyarrow.parquet.read_metadata(io.BytesIO(body)).num_rows
+        else:
+            lines = body.splitlines()
+            self.rows[table] += len(lines)
+            if table == 'brs_schema':
+                for line in lines:
+                    row = json.loads(line)
+                    self.schema.setdefault(row['entity_type'], {}).setdefault(row['field'], set()).add(row.get('type') or '')
+            if table == 'brs_watermark':
+                for line in lines:
+                    row = json.loads(line)
+                    self.watermarks.add(row['table_name'])
+                    if row['table_name'] == 'brs_audit_partition_layout':
+                        self.layout = row['layout']
+        return _FakeJob([])
+
+
+    def get_table(self, table):
+        from google.cloud import bigquery
+        self.calls['get_table'] += 1
+        return bigquery.Table(table)
+
+
+    def create_table(self, table, **kwargs):
+        self.calls['create_table'] += 1
+        return table
+
+
+    def update_table(self, table, fields, **kwargs):
+        self.calls['update_table'] += 1
+        return table
+
+
+    def delete_table(self, table, not_found_ok=False, **kwargs):
+        self.calls['delete_table'] += 1
+
+
+    def list_tables(self, dataset, **kwargs):
+        self.calls['list_tables'] += 1
+        return []
+
+
+class _FakeJob(object):
+
+    def __init__(self, rows):
+        self._rows = rows
+
+
+    def result(self):
+        return self._rows
+
+
+def _insert_target(query):
+    if not query.upper().startswith('INSERT INTO '):
+        return None
+    return query.split()[2].split('(')[0]
@@ -0,0 +1,106 @@
+"""Columnar buffer for rows waiting to be sent to the database."""
+
+import sys
+from datetime import datetime, timezone
+
+COLUMNS = ('entity_href', 'entity_id', 'entity_type', 'entity_data', 'event_moment', 'event_type')
+
+
+class ColumnBuffer(object):
+    """Define ColumnBuffer.
+
+    Keeps one list per column instead of one dict per row, so a buffered row
+    costs six list slots rather than a dict, and the backends get their
+    columns without pivoting rows. entity_type and event_type repeat across
+    rows and are interned unless intern_strings is False.
+    """
+
+    __slots__ = COLUMNS + ('_intern',)
+
+    def __init__(self, intern_strings=True):
+        self.entity_href = []
+        self.entity_id = []
+        self.entity_type = []
+        self.entity_data = []
+        self.event_moment = []
+        self.event_type = []
+        self._intern = intern_strings
+
+
+    def append(self, entity_href, entity_id, entity_type, entity_data, event_moment, event_type):
+        if self._intern:
+            entity_type = sys.intern(entity_type)
+            event_type = sys.intern(event_type)
+        self.entity_href.append(entity_href)
+        self.entity_id.append(entity_id)
+        self.entity_type.append(entity_type)
+        self.entity_data.append(entity_data)
+        self.event_moment.append(event_moment)
+        self.event_type.append(event_type)
+
+
+    def extend(self, other):
+        """Append the rows of another ColumnBuffer"""
+        for name in COLUMNS:
+            getattr(self, name).extend(getattr(other, name))
+
+
+    def __len__(self):
+        return len(self.entity_href)
+
+
+    def __iter__(self):
+        return self.rows()
+
+
+    def columns(self):
+        """Return a dict of column name to list of values"""
+        return {name: getattr(self, name) for name in COLUMNS}
+
+
+    def rows(self):
+        """Yield rows as dicts, for APIs that only accept records"""
+        for values in zip(self.entity_href, self.entity_id, self.entity_type,
+                          self.entity_data, self.event_moment, self.event_type):
+            yield dict(zip(COLUMNS, values))
+
+
+def as_columns(data):
+    """Return columns for a ColumnBuffer or a list of row dicts"""
+    if isinstance(data, ColumnBuffer):
+        return data.columns()
+    columns = {name: [] for name in COLUMNS}
+    for row in data:
+        for name in COLUMNS:
+            columns[name].append(row[name])
+    return columns
+
+
+def utf8_len(value):
+    """Return the UTF-8 size of a string in bytes"""
+    # isascii() reads a flag CPython keeps, so most values are not encoded
+    return len(value) if value.isascii() else len(value.encode('utf-8'))
+
+
+def parse_datetime(value):
+    """Return event_moment as a datetime, naive if it has no offset.
+
+    Accepts datetimes and the ISO strings Client stores (str(datetime)).
+    """
+    if isinstance(value, datetime):
+        return value
+    value = str(value)
+    if value.endswith('Z'):
+        value = value[:-1] + '+00:00'
+    return datetime.fromisoformat(value)
+
+
+def to_datetime(value):
+    """Return event_moment as an aware UTC datetime.
+
+    Naive values are taken as UTC, as BigQuery does.
+    """
+    value = parse_datetime(value)
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
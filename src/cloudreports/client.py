@@ -1,45 +1,562 @@
 """Client for interacting with the database."""
 
+import asyncio
 import json
-import requests
+import queue
+import threading
+import time
 from datetime import datetime
+from cloudreports.buffer import ColumnBuffer, utf8_len
+from cloudreports.serializer import get_serializer
+from cloudreports.integration import make_session, ProgressReporter
+from cloudreports.metrics import NULL_METRICS
+from cloudreports.dedup import Deduplicator
+from cloudreports.prefetch import prefetch as prefetch_items, aprefetch
+from cloudreports.schema import infer_fields, merge_fields
 
 class Client(object):
     """Define Client """
 
-    def __init__(self, database, buffer_size=3000, cr_api_url=None, cr_api_token=None, cr_integration_id=None):
+    def __init__(self, database, buffer_size=3000, cr_api_url=None, cr_api_token=None, cr_integration_id=None,
+                 async_flush=False, max_pending_buffers=2, buffer_bytes=None,
+                 adaptive_batch=False, min_buffer_size=100, max_buffer_size=100000, intern_strings=True,
+                 serializer=None, spool=None, cr_api_timeout=10, cr_api_retries=3, progress_interval=None,
+                 metrics=None, dedup=None, dedup_cache_size=100000, shard_by_entity_type=False,
+                 shard_buffer_sizes=None, shard_max_age=None, max_buffered_bytes=None, schema_depth=1,
+                 infer_types=False):
         if not isinstance(database, object):
             raise ValueError("Pass a object for database")        
+        if not isinstance(max_pending_buffers, int) or max_pending_buffers < 1:
+            raise ValueError("Pass a positive int for max_pending_buffers")
+        if buffer_bytes is not None and (not isinstance(buffer_bytes, int) or buffer_bytes < 1):
+            raise ValueError("Pass a positive int for buffer_bytes")
+        if progress_interval is not None and (not isinstance(progress_interval, (int, float)) or progress_interval < 0):
+            raise ValueError("Pass a non-negative number for progress_interval")
+        if shard_max_age is not None and (not isinstance(shard_max_age, (int, float)) or shard_max_age <= 0):
+            raise ValueError("Pass a positive number for shard_max_age")
+        if shard_max_age is not None and async_flush is not True:
+            # the timer flushes too, so all loads must go through the one worker thread
+            raise ValueError("Pass async_flush=True with shard_max_age")
+        if max_buffered_bytes is not None and (not isinstance(max_buffered_bytes, int) or max_buffered_bytes < 1):
+            raise ValueError("Pass a positive int for max_buffered_bytes")
+        if shard_buffer_sizes is not None and not isinstance(shard_buffer_sizes, dict):
+            raise ValueError("Pass a dict of entity_type to buffer size for shard_buffer_sizes")
+        if not isinstance(schema_depth, int) or schema_depth < 1:
+            raise ValueError("Pass a positive int for schema_depth")
         self._database = database        
         self._buffer_size = buffer_size
-        self.data = []
+        # flush also once the serialized rows reach buffer_bytes (UTF-8)
+        self._buffer_bytes = buffer_bytes
+        self._data_bytes = 0
+        self._intern_strings = intern_strings
+        self.data = ColumnBuffer(intern_strings)
+        # orjson or ujson when installed, stdlib json otherwise
+        self._serializer = get_serializer(serializer)
         self.cr_api_url = cr_api_url
         self.cr_api_token = cr_api_token
         self.cr_integration_id = cr_integration_id
+        self.cr_api_timeout = cr_api_timeout
+        self._cr_api_retries = cr_api_retries
+        # one pooled session for all integration API calls, created on first use
+        self._session = None
+        # with progress_interval, load_rows is reported after every flush,
+        # merged by a background ProgressReporter into one PUT per interval
+        self._progress_interval = progress_interval
+        self._progress = None
+        self._progress_lock = threading.Lock()
+        self.loaded_rows = 0
+
+        # running {field: type} of entity_data per entity_type (cloudreports.schema);
+        # fields and widened types not yet sent to the database's schema
+        # registry wait in _new_fields. schema_depth > 1 flattens nested
+        # objects into fields, infer_types=True types them for typed views
+        self.schema = {}
+        self._new_fields = {}
+        self._schema_depth = schema_depth
+        self._infer_types = infer_types
+
+        # background flushing: full buffers are handed to a worker thread
+        # through a bounded queue, so the caller blocks only when
+        # max_pending_buffers batches are already waiting for the database
+        self._async_flush = async_flush
+        self._flush_queue = queue.Queue(maxsize=max_pending_buffers)
+        self._flush_thread = None
+        self._flush_error = None
+
+        self._batch_tuner = None
+        if adaptive_batch:
+            self._batch_tuner = _AdaptiveBatchSize(buffer_size, min_buffer_size, max_buffer_size, buffer_bytes)
+            self._buffer_size = self._batch_tuner.size
+
+        # stage timers and counters (cloudreports.metrics.Metrics), shared with
+        # a database that has none of its own
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        if metrics is not None and getattr(database, 'metrics', None) is NULL_METRICS:
+            database.metrics = metrics
+        self._serialize_seconds = 0.0
+
+        # dedup='latest' keeps the latest row per (entity_type, entity_href) of a buffer,
+        # dedup='content' drops rows unchanged since the last one sent
+        self._dedup = None
+        if dedup is not None:
+            self._dedup = Deduplicator(dedup, dedup_cache_size, intern_strings)
+
+        # shard_by_entity_type keeps one buffer per entity_type, so a batch fills
+        # a single brs_audit_partition bucket. A shard is flushed at buffer_size
+        # rows (or its shard_buffer_sizes entry) or buffer_bytes, after
+        # shard_max_age seconds, and largest first once all shards together
+        # reach max_buffered_bytes. _data_bytes then counts all shards.
+        self._shards = {} if shard_by_entity_type else None
+        self._shard_buffer_sizes = shard_buffer_sizes or {}
+        self._shard_max_age = shard_max_age
+        self._max_buffered_bytes = max_buffered_bytes
+        self._shard_lock = threading.RLock()
+        # spool segment -> shards whose rows in it are not loaded yet
+        self._segment_refs = {}
+        self._submit_lock = threading.Lock()
+        self._shard_timer = None
+        self._shard_timer_stop = threading.Event()
+
+        # optional crash-safe copy of the buffer on disk (cloudreports.spool.Spool)
+        self._spool = spool
+        if spool is not None:
+            self.replay_spool()
+
+        if shard_by_entity_type and shard_max_age is not None:
+            self._shard_timer = threading.Thread(
+                target=self._flush_old_shards, name='cloudreports-shard-timer', daemon=True)
+            self._shard_timer.start()
 
 
     def load_json_data(self, entity_href, entity_id, entity_type, entity_data, event_moment, event_type=None):
         """Send data to Database"""
 
-        item_dic = {
-            'entity_href': str(entity_href),
-            'entity_id': str(entity_id),
-            'entity_type': str(entity_type),
-            'entity_data': json.dumps(entity_data),
-            'event_moment': str(event_moment),
-            'event_type': str(event_type)
-        }
-        self.data.append(item_dic)
+        self._raise_flush_error()
+        due = self._buffer_row(entity_href, entity_id, entity_type, entity_data, event_moment, event_type)
+        if due:
+            self._submit_due(due)
+
+
+    def load_many(self, records, mapper=None, prefetch=0):
+        """Send many rows to Database, return the number of rows buffered.
+
+        records is any iterable; mapper(record) returns a row, a list of rows
+        (e.g. for a page of results) or None to skip the record. Without
+        mapper records are rows themselves. A row is a tuple (entity_href,
+        entity_id, entity_type, entity_data, event_moment[, event_type]) or a
+        dict with those keys. With prefetch > 0 up to prefetch records are
+        read ahead in a thread, so fetching pages overlaps with serialization
+        and flushes. Like load_json_data, rows stay buffered until the
+        buffer fills or flush() is called.
+        """
+
+        self._raise_flush_error()
+        if prefetch:
+            records = prefetch_items(records, prefetch)
+        count = 0
+        buffer_row = self._buffer_row
+        for row in _rows(records, mapper):
+            count += 1
+            due = buffer_row(*row)
+            if due:
+                self._submit_due(due)
+                self._raise_flush_error()
+        return count
+
+
+    async def aload_many(self, records, mapper=None, prefetch=0):
+        """Async version of load_many for async iterables.
+
+        Full buffers and shards are submitted in the default executor, so the
+        event loop, and the prefetch task, keep running while a batch is sent.
+        """
+
+        self._raise_flush_error()
+        if prefetch:
+            records = aprefetch(records, prefetch)
+        loop = asyncio.get_running_loop()
+        count = 0
+        buffer_row = self._buffer_row
+        async for record in records:
+            for row in _rows((record,), mapper):
+                count += 1
+                due = buffer_row(*row)
+                if due:
+                    await loop.run_in_executor(None, self._submit_due, due)
+                    self._raise_flush_error()
+        return count
+
+
+    def _buffer_row(self, entity_href, entity_id, entity_type, entity_data, event_moment, event_type=None):
+        """Append a row to the buffer; return what the caller submits with _submit_due.
+
+        That is True once the buffer is full or, with shard_by_entity_type,
+        the entity types of the shards due.
+        """
+        if self._shards is not None:
+            with self._shard_lock:
+                return self._buffer_shard_row(entity_href, entity_id, entity_type, entity_data, event_moment,
+                                              event_type)
+
+        entity_href = str(entity_href)
+        entity_id = str(entity_id)
+        entity_type = str(entity_type)
+        self._track_fields(entity_type, entity_data)
+        if self.metrics.enabled:
+            start = time.perf_counter()
+            entity_data = self._serializer.dumps(entity_data)
+            self._serialize_seconds += time.perf_counter() - start
+        else:
+            entity_data = self._serializer.dumps(entity_data)
+        event_moment = str(event_moment)
+        event_type = str(event_type)
+        self.data.append(entity_href, entity_id, entity_type, entity_data, event_moment, event_type)
+        if self._spool is not None:
+            self._spool.append((entity_href, entity_id, entity_type, entity_data, event_moment, event_type))
+        self._data_bytes += (utf8_len(entity_href) + utf8_len(entity_id) + utf8_len(entity_type)
+                             + utf8_len(entity_data) + utf8_len(event_moment) + utf8_len(event_type))
+
+        return len(self.data) > self._buffer_size or (
+            self._buffer_bytes is not None and self._data_bytes >= self._buffer_bytes)
+
+
+    def _submit_due(self, due):
+        """Submit the buffer, or the shards of the entity types in due"""
+        if self._shards is None:
+            self._submit_buffer()
+            return
+        for entity_type in due:
+            self._submit_shard(entity_type)
 
-        if len(self.data) > self._buffer_size:
-            self.finish_load_json_data()
+
+    def _buffer_shard_row(self, entity_href, entity_id, entity_type, entity_data, event_moment, event_type):
+        """Append a row to its entity_type shard; return the entity types to submit"""
+        entity_type = str(entity_type)
+        self._track_fields(entity_type, entity_data)
+        if self.metrics.enabled:
+            start = time.perf_counter()
+            entity_data = self._serializer.dumps(entity_data)
+            self._serialize_seconds += time.perf_counter() - start
+        else:
+            entity_data = self._serializer.dumps(entity_data)
+        row = (str(entity_href), str(entity_id), entity_type, entity_data, str(event_moment), str(event_type))
+        shard = self._shards.get(entity_type)
+        if shard is None:
+            shard = self._shards[entity_type] = _Shard(self._intern_strings)
+        shard.data.append(*row)
+        if self._spool is not None:
+            path = self._spool.append(row)
+            if path not in shard.segments:
+                shard.segments.add(path)
+                self._segment_refs[path] = self._segment_refs.get(path, 0) + 1
+        size = sum(map(utf8_len, row))
+        shard.bytes += size
+        self._data_bytes += size
+
+        if len(shard.data) > self._shard_buffer_sizes.get(entity_type, self._buffer_size) or (
+                self._buffer_bytes is not None and shard.bytes >= self._buffer_bytes):
+            return [entity_type]
+        due = []
+        if self._max_buffered_bytes is not None and self._data_bytes >= self._max_buffered_bytes:
+            # flush the largest shards until half of the cap is free
+            excess = self._data_bytes - self._max_buffered_bytes // 2
+            for key, other in sorted(self._shards.items(), key=lambda item: item[1].bytes, reverse=True):
+                if excess <= 0:
+                    break
+                due.append(key)
+                excess -= other.bytes
+        return due
 
 
     def finish_load_json_data(self):
         """Must be called before completion"""
         
-        self._database.load_json_data(self.data)
-        self.data = []
+        self.flush()
+
+
+    def flush(self):
+        """Send buffered data and wait until every pending batch is loaded.
+
+        The load_rows progress report, if any, is sent before returning.
+        """
+
+        self._raise_flush_error()
+        self._submit_buffer()
+        if self._flush_thread is not None:
+            self._flush_queue.join()
+        if self._progress is not None:
+            self._progress.flush()
+        self._raise_flush_error()
+
+
+    def close(self):
+        """Flush buffered data and stop the background worker"""
+
+        try:
+            self.flush()
+        finally:
+            if self._shard_timer is not None:
+                self._shard_timer_stop.set()
+                self._shard_timer.join()
+                self._shard_timer = None
+            if self._flush_thread is not None:
+                self._flush_queue.put(None)
+                self._flush_thread.join()
+                self._flush_thread = None
+            if self._spool is not None:
+                self._spool.close()
+            if self._progress is not None:
+                self._progress.close()
+                self._progress = None
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+
+    def report_progress(self, **fields):
+        """Queue set_integration fields (load_rows, load_percent, ...) without waiting for the API"""
+
+        # the flush worker reports too, so create the reporter only once
+        with self._progress_lock:
+            if self._progress is None:
+                interval = self._progress_interval if self._progress_interval is not None else 5.0
+                self._progress = ProgressReporter(self._put_progress, interval)
+        self._progress.update(**fields)
+
+
+    @property
+    def dedup_stats(self):
+        """Return {'rows_in', 'rows_out', 'rows_saved', 'bytes_saved'} of dedup, None without it"""
+        if self._dedup is None:
+            return None
+        return dict(self._dedup.stats)
+
+
+    def replay_spool(self):
+        """Load rows left in the spool by a previous run, one segment per batch.
+
+        Their fields are registered first, as for rows loaded live.
+        """
+
+        for path in self._spool.pending():
+            data = self._spool.read(path, self._intern_strings)
+            loads = self._serializer.loads
+            for entity_type, entity_data in zip(data.entity_type, data.entity_data):
+                self._track_fields(entity_type, loads(entity_data))
+            new_fields = self._new_fields
+            self._new_fields = {}
+            try:
+                if new_fields and hasattr(self._database, 'update_schema'):
+                    self._database.update_schema(new_fields)
+                if data:
+                    self._database.load_json_data(data)
+            except Exception:
+                self._restore_fields(new_fields)
+                raise
+            self._spool.ack([path])
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _track_fields(self, entity_type, entity_data):
+        fields = self.schema.get(entity_type)
+        if fields is None:
+            fields = self.schema[entity_type] = {}
+            # registered even without fields, so update_tables need not scan for entity types
+            self._new_fields.setdefault(entity_type, {})
+        if not isinstance(entity_data, dict):
+            return
+        if self._schema_depth == 1 and not self._infer_types:
+            # untyped top-level keys: a subset check per row
+            if fields.keys() >= entity_data.keys():
+                return
+            new_fields = dict.fromkeys(entity_data.keys() - fields.keys())
+            fields.update(new_fields)
+        else:
+            new_fields = merge_fields(fields, infer_fields(entity_data, self._schema_depth, self._infer_types))
+            if not new_fields:
+                return
+        self._new_fields.setdefault(entity_type, {}).update(new_fields)
+
+
+    def _submit_buffer(self):
+        if self._shards is not None:
+            with self._shard_lock:
+                entity_types = list(self._shards)
+            for entity_type in entity_types:
+                self._submit_shard(entity_type)
+            return
+        if not self.data:
+            return
+        data = self.data
+        self.data = ColumnBuffer(self._intern_strings)
+        data_bytes = self._data_bytes
+        self._data_bytes = 0
+        new_fields = self._new_fields
+        self._new_fields = {}
+        segments = self._spool.seal() if self._spool is not None else None
+        try:
+            self._submit_data(data, data_bytes, new_fields, segments)
+        except Exception:
+            # only a synchronous load raises here; keep the rows for the next flush
+            data.extend(self.data)
+            self.data = data
+            self._data_bytes += data_bytes
+            self._restore_fields(new_fields)
+            if segments:
+                self._spool.unseal(segments)
+            raise
+
+
+    def _submit_shard(self, entity_type):
+        with self._shard_lock:
+            shard = self._shards.pop(entity_type, None)
+            if shard is None:
+                return
+            self._data_bytes -= shard.bytes
+            new_fields = {}
+            if entity_type in self._new_fields:
+                new_fields[entity_type] = self._new_fields.pop(entity_type)
+            if self._spool is not None:
+                # rows of other shards may share these segments, see _release_segments
+                self._spool.seal()
+        try:
+            self._submit_data(shard.data, shard.bytes, new_fields, sorted(shard.segments))
+        except Exception:
+            self._restore_shard(entity_type, shard, new_fields)
+            raise
+
+
+    def _restore_shard(self, entity_type, shard, new_fields):
+        # a synchronous load failed: put the shard back, in front of rows buffered since
+        with self._shard_lock:
+            self._data_bytes += shard.bytes
+            current = self._shards.get(entity_type)
+            if current is not None:
+                shard.data.extend(current.data)
+                shard.bytes += current.bytes
+                for path in current.segments:
+                    if path in shard.segments:
+                        self._segment_refs[path] -= 1
+                    else:
+                        shard.segments.add(path)
+            self._shards[entity_type] = shard
+            self._restore_fields(new_fields)
+
+
+    def _restore_fields(self, new_fields):
+        # fields of a failed batch go out with the next one; newer types win
+        for entity_type, fields in new_fields.items():
+            pending = self._new_fields.get(entity_type)
+            self._new_fields[entity_type] = {**fields, **pending} if pending else fields
+
+
+    def _flush_old_shards(self):
+        interval = max(0.05, min(1.0, self._shard_max_age / 4))
+        while not self._shard_timer_stop.wait(interval):
+            now = time.monotonic()
+            with self._shard_lock:
+                due = [entity_type for entity_type, shard in self._shards.items()
+                       if now - shard.started >= self._shard_max_age]
+            for entity_type in due:
+                self._submit_shard(entity_type)
+
+
+    def _submit_data(self, data, data_bytes, new_fields, segments):
+        # the shard timer submits too
+        with self._submit_lock:
+            digests = None
+            # the tuner sizes the buffer, so it sees the batch before dedup
+            buffered = (len(data), data_bytes)
+            if self._dedup is not None:
+                rows = len(data)
+                data, saved_bytes, digests = self._dedup.collapse(data)
+                data_bytes -= saved_bytes
+                self.metrics.count('client.dedup_rows_saved', rows - len(data))
+                self.metrics.count('client.dedup_bytes_saved', saved_bytes)
+            if self.metrics.enabled:
+                # serialization is timed per row but reported once per batch
+                self.metrics.observe('client.serialize', self._serialize_seconds)
+                self.metrics.count('client.rows', len(data))
+                self.metrics.count('client.bytes', data_bytes)
+                self.metrics.count('client.batches')
+                self._serialize_seconds = 0.0
+        if not self._async_flush:
+            self._load_batch(data, data_bytes, new_fields, segments, digests, buffered)
+            return
+
+        with self._submit_lock:
+            if self._flush_thread is None:
+                self._flush_thread = threading.Thread(
+                    target=self._flush_worker, name='cloudreports-flush', daemon=True)
+                self._flush_thread.start()
+        # blocks while the queue is full (backpressure)
+        with self.metrics.timer('client.backpressure'):
+            self._flush_queue.put((data, data_bytes, new_fields, segments, digests, buffered))
+
+
+    def _flush_worker(self):
+        while True:
+            batch = self._flush_queue.get()
+            try:
+                if batch is None:
+                    return
+                self._load_batch(*batch)
+            except Exception as e:
+                if self._flush_error is None:
+                    self._flush_error = e
+            finally:
+                self._flush_queue.task_done()
+
+
+    def _load_batch(self, data, data_bytes, new_fields, segments=None, digests=None, buffered=None):
+        # fields go first: a registered field without rows only yields an empty column
+        if new_fields and hasattr(self._database, 'update_schema'):
+            with self.metrics.timer('client.update_schema'):
+                self._database.update_schema(new_fields)
+        start = time.perf_counter()
+        # a batch emptied by dedup still carries its schema and spool segments
+        if data:
+            with self.metrics.timer('client.load'):
+                self._database.load_json_data(data)
+        if digests:
+            # only now may unchanged rows of these entities be dropped
+            self._dedup.commit(digests)
+        if segments:
+            self._release_segments(segments)
+        self.loaded_rows += len(data)
+        if self._progress_interval is not None and self.cr_api_url is not None:
+            self.report_progress(load_rows=self.loaded_rows)
+        if self._batch_tuner is not None and data:
+            rows, data_bytes = buffered or (len(data), data_bytes)
+            self._buffer_size = self._batch_tuner.update(rows, time.perf_counter() - start, data_bytes)
+
+
+    def _release_segments(self, segments):
+        if self._shards is None:
+            self._spool.ack(segments)
+            return
+        done = []
+        with self._shard_lock:
+            for path in segments:
+                self._segment_refs[path] -= 1
+                if not self._segment_refs[path]:
+                    del self._segment_refs[path]
+                    done.append(path)
+        self._spool.ack(done)
+
+
+    def _raise_flush_error(self):
+        if self._flush_error is not None:
+            error = self._flush_error
+            self._flush_error = None
+            raise error
 
 
     def get_integration(self):
@@ -55,7 +572,8 @@ class Client(object):
         headers = {
                 'Authorization': f'cr_api_token {self.cr_api_token}'
             }
-        r = requests.get(f'{self.cr_api_url}/{self.cr_integration_id}', headers=headers)
+        r = self._http().get(f'{self.cr_api_url}/{self.cr_integration_id}', headers=headers,
+            timeout=self.cr_api_timeout)
         return json.loads(r.content)
 
 
@@ -86,8 +604,124 @@ class Client(object):
         headers = {
                 'Authorization': f'cr_api_token {self.cr_api_token}'
             }
-        r = requests.put(f'{self.cr_api_url}/{self.cr_integration_id}', headers=headers, 
-            json=data)
+        r = self._http().put(f'{self.cr_api_url}/{self.cr_integration_id}', headers=headers,
+            json=data, timeout=self.cr_api_timeout)
         return r
 
 
+    def _http(self):
+        if self._session is None:
+            self._session = make_session(retries=self._cr_api_retries)
+        return self._session
+
+
+    def _put_progress(self, **fields):
+        r = self.set_integration(**fields)
+        if isinstance(r, dict):
+            raise RuntimeError(r['info'])
+        r.raise_for_status()
+
+
+
+
+def _rows(records, mapper):
+    """Yield row tuples from records through mapper, see Client.load_many"""
+    for record in records:
+        if mapper is not None:
+            record = mapper(record)
+            if record is None:
+                continue
+            if isinstance(record, list):
+                for row in record:
+                    yield _row(row)
+                continue
+        yield _row(record)
+
+
+def _row(row):
+    if isinstance(row, dict):
+        return (row['entity_href'], row['entity_id'], row['entity_type'], row['entity_data'],
+                row['event_moment'], row.get('event_type'))
+    return row
+
+
+class _Shard(object):
+    """Buffer of one entity_type"""
+
+    __slots__ = ('data', 'bytes', 'started', 'segments')
+
+    def __init__(self, intern_strings):
+        self.data = ColumnBuffer(intern_strings)
+        self.bytes = 0
+        self.started = time.monotonic()
+        # spool segments holding rows of this shard
+        self.segments = set()
+
+
+class _AdaptiveBatchSize(object):
+    """Hill-climb the batch size on measured backend throughput.
+
+    Every full flush reports its row count, bytes and duration. The size
+    keeps moving by step in the same direction while rows per second improve
+    by more than tolerance and turns around once when they drop by more. It
+    settles for good when a move gains less than tolerance (on the smaller
+    of the two sizes), on a second drop (on the better size) or once the
+    byte budget max_bytes (Client's buffer_bytes) limits batches, and never
+    exceeds the rows that fit in max_bytes at the measured row size.
+    """
+
+    def __init__(self, size, min_size, max_size, max_bytes=None, step=1.5, tolerance=0.05):
+        if min_size < 1 or max_size < min_size:
+            raise ValueError("Pass 1 <= min_buffer_size <= max_buffer_size")
+        self.size = min(max(size, min_size), max_size)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.step = step
+        self.tolerance = tolerance
+        self.settled = False
+        self._direction = 1
+        self._turned = False
+        self._last_size = None
+        self._last_throughput = None
+
+    def update(self, rows, seconds, data_bytes=0):
+        if self.settled or seconds <= 0:
+            return self.size
+        by_bytes = self.max_bytes is not None and data_bytes >= self.max_bytes
+        # partial batches (e.g. the final flush) say nothing about the size
+        if rows < self.size and not by_bytes:
+            return self.size
+
+        max_size = self.max_size
+        if self.max_bytes is not None and data_bytes:
+            max_size = min(max_size, max(self.min_size, self.max_bytes * rows // data_bytes))
+
+        throughput = rows / seconds
+        last_size, last_throughput = self._last_size, self._last_throughput
+        self._last_size, self._last_throughput = self.size, throughput
+        if last_throughput is not None:
+            gain = throughput / last_throughput - 1
+            if abs(gain) <= self.tolerance:
+                # not worth the memory of the larger size
+                return self._settle(min(self.size, last_size), max_size)
+            if gain < 0:
+                if self._turned:
+                    return self._settle(last_size, max_size)
+                self._direction = -self._direction
+                self._turned = True
+        if by_bytes and self._direction > 0:
+            # buffer_bytes flushes before a larger size is reached
+            return self._settle(self.size, max_size)
+
+        if self._direction > 0:
+            size = int(self.size * self.step)
+        else:
+            size = int(self.size / self.step)
+        self.size = min(max(size, self.min_size), max_size)
+        return self.size
+
+    def _settle(self, size, max_size):
+        self.settled = True
+        self.size = min(max(size, self.min_size), max_size)
+        return self.size
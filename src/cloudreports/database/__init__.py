@@ -0,0 +1,37 @@
+"""Define Database.
+
+Backends are imported on first access, so a job that uses one backend does
+not pay for importing the other one's client libraries:
+
+    from cloudreports import database
+    db = database.ClickHouse(...)   # imports clickhouse_driver only now
+"""
+
+import importlib
+
+# backend class -> (module, pip extra)
+_BACKENDS = {
+    'ClickHouse': ('cloudreports.database.clickhouse', 'clickhouse'),
+    'BigQuery': ('cloudreports.database.bigquery', 'bigquery'),
+    'LocalFiles': ('cloudreports.database.localfiles', 'parquet'),
+}
+
+__all__ = list(_BACKENDS)
+
+
+def __getattr__(name):
+    if name not in _BACKENDS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, extra = _BACKENDS[name]
+    try:
+        module = importlib.import_module(module_name)
+    except ImportError as e:
+        raise ImportError(f"{name} requires extra dependencies, run pip install cloudreports[{extra}] ({e})") from e
+    backend = getattr(module, name)
+    # cache, so later lookups skip __getattr__
+    globals()[name] = backend
+    return backend
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
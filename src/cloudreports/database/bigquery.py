@@ -0,0 +1,884 @@
+"""Define Google BigQuery database."""
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud import bigquery
+from google.oauth2 import service_account
+import json
+import base64
+import io
+import time
+from datetime import datetime, timezone
+from cloudreports.buffer import as_columns, to_datetime
+from cloudreports.serializer import get_serializer
+from cloudreports.database.common import (SchemaRegistry, check_layout, import_pyarrow, merge_view_fields,
+                                          refresh_schema, update_views, view_needs_update)
+from cloudreports.metrics import NULL_METRICS
+from cloudreports.schema import merge_types, typed_fields, view_column
+
+class BigQuery(SchemaRegistry):
+    """Define Google BigQuery.
+    
+    See 
+    https://cloud.google.com/bigquery
+    """
+
+    LOAD_FORMATS = ('json', 'parquet')
+    # brs_audit_partition columns, in the order of _partition_select
+    PARTITION_COLUMNS = ('entity_href, entity_id, entity_type, entity_data, event_type, event_moment, '
+                         'partition_entity_type, load_moment')
+    TIME_PARTITIONS = ('hour', 'day', 'month', 'year')
+    # brv_* column type per inferred field type; fields of unknown type stay JSON_EXTRACT_SCALAR strings
+    VIEW_TYPES = {'int': 'INT64', 'float': 'FLOAT64', 'bool': 'BOOL', 'timestamp': 'TIMESTAMP',
+                  'string': 'STRING', 'json': 'STRING'}
+    # merge_latest_state re-reads rows loaded this long before its watermark,
+    # for loads still running (or on a slower clock) when it last ran
+    LOAD_OVERLAP_SECONDS = 3600
+    # brs_watermark row holding the layout brs_audit_partition was built with
+    LAYOUT_ROW = 'brs_audit_partition_layout'
+    # brs_watermark row recording that discover_schema seeded brs_schema
+    DISCOVERY_ROW = 'brs_schema_discovery'
+    # layout of a brs_audit_partition created before layouts were stored
+    LEGACY_LAYOUT = {'partition_buckets': 4000, 'time_partition': None, 'cluster_by': []}
+
+    def __init__(self, project, dataset, credentials_file_path=None, credentials_service_account_info=None,
+                 serializer=None, load_format='json', client=None, latest_state=False,
+                 metrics=None, partition_buckets=4000, time_partition=None, cluster_by=()):
+        if client is None and not (isinstance(credentials_file_path, str) or isinstance(credentials_service_account_info, str)):
+            raise ValueError("Pass a string for credentials_file_path or credentials_service_account_info")
+        if not isinstance(project, str):
+            raise ValueError("Pass a string for project")
+        if not isinstance(dataset, str):
+            raise ValueError("Pass a string for dataset")
+        if load_format not in self.LOAD_FORMATS:
+            raise ValueError(f"Pass one of {self.LOAD_FORMATS} for load_format")
+        if not isinstance(partition_buckets, int) or not 1 <= partition_buckets <= 10000:
+            raise ValueError("Pass an int from 1 to 10000 for partition_buckets")
+        if time_partition is not None and time_partition not in self.TIME_PARTITIONS:
+            raise ValueError(f"Pass None or one of {self.TIME_PARTITIONS} for time_partition")
+        if isinstance(cluster_by, str) or len(cluster_by) > 4 or not all(isinstance(key, str) for key in cluster_by):
+            raise ValueError("Pass a list of up to 4 column names for cluster_by")
+        if time_partition is not None and len([key for key in cluster_by if key != 'partition_entity_type']) > 3:
+            # partition_entity_type takes the first of the 4 clustering columns
+            raise ValueError("Pass a list of up to 3 column names for cluster_by with time_partition")
+
+        self._project = project
+        self._dataset = dataset        
+        self.serializer = get_serializer(serializer)
+        # json - NDJSON loads through brs_audit_temp
+        # parquet - one Parquet load per table, no temp table and no DML per batch
+        self.load_format = load_format
+        # brv_* views read brl_* tables merged by update_tables instead of
+        # window functions, so they lag brs_audit until the next update_tables;
+        # drop_latest_state() removes the tables once views are back
+        self.latest_state = latest_state
+        # stage timers and counters (cloudreports.metrics.Metrics)
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+        # layout of brs_audit_partition: range partitions over partition_buckets
+        # buckets by entity_type, or time partitions of event_moment with the
+        # bucket as first clustering column, clustered by cluster_by. Changing
+        # any of them for existing tables needs migrate_partitioning()
+        self.partition_buckets = partition_buckets
+        self.time_partition = time_partition
+        self.cluster_by = tuple(cluster_by)
+
+        if client is not None:
+            # e.g. a preconfigured bigquery.Client or a local fake
+            self.client = client
+        else:
+            if isinstance(credentials_file_path, str):
+                credentials = service_account.Credentials.from_service_account_file(
+                    credentials_file_path, scopes=["https://www.googleapis.com/auth/cloud-platform"],
+                )
+            elif isinstance(credentials_service_account_info, str):
+                credentials = service_account.Credentials.from_service_account_info(json.loads(base64.b64decode(credentials_service_account_info)))   
+
+            self.client = bigquery.Client(project=self._project, credentials=credentials) 
+        self.dataset_ref = self.client.dataset(dataset_id=self._dataset)
+        self.table_audit = self.dataset_ref.table('brs_audit')  
+        self.table_audit_partition = self.dataset_ref.table('brs_audit_partition') 
+        self.table_temp = self.dataset_ref.table('brs_audit_temp')  
+        self.table_schema = self.dataset_ref.table('brs_schema')
+        self.table_watermark = self.dataset_ref.table('brs_watermark')
+        self.sandbox_mode = False
+        self.tables_created = False
+        # entity_type -> ABS(MOD(FARM_FINGERPRINT(entity_type), partition_buckets))
+        self.partition_ids = {}
+    
+
+    def load_json_data(self, data):        
+        metrics = self.metrics
+        if not self.tables_created:            
+            with metrics.timer('bigquery.ddl'):
+                self.client.delete_table(self.table_temp, not_found_ok=True)
+                self.create_tables()
+                self.open_audit_partition()
+                self.check_layout()
+            self.tables_created = True            
+        metrics.count('bigquery.rows', len(data))
+
+        if self.load_format == 'parquet':
+            self.load_parquet_data(data)
+            return
+
+        job_config = bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("entity_href", "STRING"),
+                bigquery.SchemaField("entity_id", "STRING"),
+                bigquery.SchemaField("entity_type", "STRING"),
+                bigquery.SchemaField("entity_data", "STRING"),
+                bigquery.SchemaField("event_type", "STRING"),
+                bigquery.SchemaField("event_moment", "TIMESTAMP"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        )
+        # serialize the batch once and upload the same bytes to every table
+        with metrics.timer('bigquery.serialize'):
+            body = self.serializer.dumps_ndjson(data)
+        metrics.count('bigquery.bytes', len(body))
+
+        with metrics.timer('bigquery.load_audit'):
+            self.load_ndjson(body, self.table_audit, job_config)
+        
+        if not self.sandbox_mode:
+            with metrics.timer('bigquery.load_temp'):
+                self.load_ndjson(body, self.table_temp, job_config)
+            with metrics.timer('bigquery.fill_audit_partition'):
+                self.fill_audit_partition('brs_audit_temp')
+            with metrics.timer('bigquery.ddl'):
+                self.client.delete_table(self.table_temp, not_found_ok=True)
+        
+
+    def load_ndjson(self, body, table, job_config):
+        self.client.load_table_from_file(
+            io.BytesIO(body), table, size=len(body), job_config=job_config).result()
+
+
+    def load_parquet_data(self, data):
+        """Load a batch as Parquet into brs_audit and brs_audit_partition.
+
+        The batch is written to Parquet once, with partition_entity_type
+        filled from the cached fingerprints, and the same bytes are loaded
+        into both tables (brs_audit, created by create_tables, ignores the
+        extra columns), so brs_audit_partition gets a load job of its own
+        instead of brs_audit_temp plus INSERT...SELECT. A failed load raises: sandbox
+        mode is detected from the view in load_json_data, not from errors.
+        """
+        pa, pq = import_pyarrow("load_format='parquet'")
+        metrics = self.metrics
+
+        columns = as_columns(data)
+        partition_ids = None
+        if not self.sandbox_mode:
+            with metrics.timer('bigquery.partition_ids'):
+                partition_ids = self.get_partition_ids(columns['entity_type'])
+        with metrics.timer('bigquery.arrow'):
+            arrays = {
+                'entity_href': pa.array(columns['entity_href'], pa.string()),
+                'entity_id': pa.array(columns['entity_id'], pa.string()),
+                'entity_type': pa.array(columns['entity_type'], pa.string()),
+                'entity_data': pa.array(columns['entity_data'], pa.string()),
+                'event_type': pa.array(columns['event_type'], pa.string()),
+                'event_moment': pa.array([to_datetime(value) for value in columns['event_moment']],
+                                         pa.timestamp('us', tz='UTC')),
+            }
+            if partition_ids is not None:
+                arrays['partition_entity_type'] = pa.array(
+                    [partition_ids[entity_type] for entity_type in columns['entity_type']], pa.int64())
+                arrays['load_moment'] = pa.array(
+                    [datetime.now(timezone.utc)] * len(data), pa.timestamp('us', tz='UTC'))
+            sink = io.BytesIO()
+            pq.write_table(pa.table(arrays), sink, compression='snappy')
+            body = sink.getvalue()
+        metrics.count('bigquery.bytes', len(body))
+
+        with metrics.timer('bigquery.load_audit'):
+            self.load_parquet(body, self.table_audit, ignore_unknown_values=True)
+        if partition_ids is not None:
+            with metrics.timer('bigquery.load_partition'):
+                self.load_parquet(body, self.table_audit_partition)
+
+
+    def load_parquet(self, body, destination, ignore_unknown_values=False):
+        # ignore_unknown_values skips Parquet columns the table does not have
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.PARQUET, ignore_unknown_values=ignore_unknown_values)
+        self.client.load_table_from_file(
+            io.BytesIO(body), destination, size=len(body), job_config=job_config).result()
+
+
+    def get_partition_ids(self, entity_types):
+        """Return partition_entity_type for entity_types, querying only unseen ones"""
+        new_types = sorted(set(entity_types) - self.partition_ids.keys())
+        if new_types:
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ArrayQueryParameter('entity_types', 'STRING', new_types)])
+            rows = self.client.query(
+                f"""SELECT entity_type, {self._bucket('entity_type')} partition_entity_type
+                FROM UNNEST(@entity_types) entity_type""", job_config=job_config).result()
+            for row in rows:
+                self.partition_ids[row['entity_type']] = row['partition_entity_type']
+        return self.partition_ids
+
+
+    def create_tables(self):
+        # brs_audit, created here rather than by the first load job, which
+        # would take the extra columns of a Parquet batch
+        query_job = self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self._project}.{self._dataset}.brs_audit` (
+                    entity_href STRING,
+                    entity_id STRING,
+                    entity_type STRING,
+                    entity_data STRING,
+                    event_type STRING,
+                    event_moment TIMESTAMP)"""
+        )
+        query_job.result()
+
+        # brs_audit_partition        
+        query_job = self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self._project}.{self._dataset}.brs_audit_partition` (
+                    entity_href STRING,
+                    entity_id STRING,
+                    entity_type STRING,
+                    entity_data STRING,
+                    event_type STRING,
+                    event_moment TIMESTAMP,	
+                    partition_entity_type INT64,
+                    load_moment TIMESTAMP)
+            {self._partition_clause()}"""
+        )
+        query_job.result()
+
+        # brs_watermark
+        query_job = self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self._project}.{self._dataset}.brs_watermark` (
+                    table_name STRING,
+                    watermark TIMESTAMP,
+                    updated TIMESTAMP,
+                    layout STRING)"""
+        )
+        query_job.result()
+
+
+    def _partition_clause(self):
+        if self.time_partition is None:
+            clause = f"""PARTITION BY
+            RANGE_BUCKET(partition_entity_type, GENERATE_ARRAY(0, {self.partition_buckets}, 1))"""
+        else:
+            clause = f"""PARTITION BY
+            TIMESTAMP_TRUNC(event_moment, {self.time_partition.upper()})"""
+        cluster_by = self._cluster_keys()
+        if cluster_by:
+            clause += f"""
+            CLUSTER BY {', '.join(cluster_by)}"""
+        return clause
+
+
+    def _cluster_keys(self):
+        if self.time_partition is None:
+            return list(self.cluster_by)
+        # views filter on the bucket, let clustering prune it instead
+        return ['partition_entity_type'] + [key for key in self.cluster_by if key != 'partition_entity_type']
+
+
+    def partition_layout(self):
+        """Return the configured layout of brs_audit_partition"""
+        if self.sandbox_mode:
+            # the sandbox view only computes the buckets
+            return {'partition_buckets': self.partition_buckets}
+        return {'partition_buckets': self.partition_buckets, 'time_partition': self.time_partition,
+                'cluster_by': self._cluster_keys()}
+
+
+    def get_layout(self):
+        """Return the layout stored for brs_audit_partition, or None"""
+        rows = self.client.query(f"""SELECT layout
+                FROM `{self._project}.{self._dataset}.brs_watermark`
+                WHERE table_name = '{self.LAYOUT_ROW}'
+                ORDER BY updated DESC LIMIT 1""").result()
+        for row in rows:
+            return self.serializer.loads(row['layout'])
+        return None
+
+
+    def set_layout(self, layout):
+        self.load_watermark_row({'table_name': self.LAYOUT_ROW, 'layout': self.serializer.dumps(layout)})
+
+
+    def load_watermark_row(self, row):
+        """Append row to brs_watermark, stamped with the current time"""
+        job_config = bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("table_name", "STRING"),
+                bigquery.SchemaField("updated", "TIMESTAMP"),
+                bigquery.SchemaField("layout", "STRING"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        )
+        row = dict(row, updated=datetime.now(timezone.utc).isoformat())
+        # a load job rather than DML, so it also works in sandbox mode
+        self.load_ndjson(self.serializer.dumps_ndjson([row]), self.table_watermark, job_config)
+
+
+    def check_layout(self):
+        """Raise ValueError if brs_audit_partition has another layout than configured.
+
+        The layout (partition_buckets, time_partition, cluster_by) is stored
+        in brs_watermark. Loads and update_tables refuse another one until
+        migrate_partitioning() rebuilt the table, as the views would look
+        for rows in the wrong buckets. A filled table from before layouts
+        were stored has LEGACY_LAYOUT, which the default options keep.
+        """
+        def has_rows():
+            # the sandbox view has no rows of its own
+            table = self.table_audit if self.sandbox_mode else self.table_audit_partition
+            try:
+                return bool(self.client.get_table(table).num_rows)
+            except Exception:
+                return False
+        legacy = self.LEGACY_LAYOUT
+        if self.sandbox_mode:
+            legacy = {'partition_buckets': legacy['partition_buckets']}
+        check_layout(self, has_rows, legacy)
+
+
+    def _bucket(self, entity_type):
+        return f"ABS(MOD(FARM_FINGERPRINT({entity_type}), {self.partition_buckets}))"
+            
+       
+    def create_tables_for_sandbox(self):
+        # brs_audit_partition
+        if self.table_exists(self.table_audit):
+            sql_query = f"""
+            SELECT 	
+                entity_href,
+                entity_id,
+                entity_type,
+                entity_data,
+                event_type,
+                event_moment,	
+                {self._bucket('entity_type')} partition_entity_type            
+            FROM `{self._project}.{self._dataset}.brs_audit`"""
+
+            view_id = f"{self._project}.{self._dataset}.brs_audit_partition"
+            view = bigquery.Table(view_id)
+            view.view_query = sql_query
+            view = self.client.create_table(view)
+
+  
+    def partition_is_view(self):
+        """Return True if brs_audit_partition is the sandbox view"""
+        try:
+            return self.client.get_table(self.table_audit_partition).table_type == 'VIEW'
+        except Exception:
+            return False
+
+
+    def open_audit_partition(self):
+        """Detect a dataset switched to sandbox mode by an earlier run, and add load_moment to older tables"""
+        try:
+            table = self.client.get_table(self.table_audit_partition)
+        except Exception:
+            return
+        if table.table_type == 'VIEW':
+            self.sandbox_mode = True
+        elif not any(field.name == 'load_moment' for field in getattr(table, 'schema', None) or ()):
+            self.client.query(f"""ALTER TABLE `{self._project}.{self._dataset}.brs_audit_partition`
+                ADD COLUMN IF NOT EXISTS load_moment TIMESTAMP""").result()
+
+
+    def table_exists(self, table):
+        try:
+            self.client.get_table(table)
+            return True
+        except:
+            return False
+
+
+    def fill_audit_partition(self, basic_table):        
+            try:
+                query_job = self.client.query(
+                    f"""
+                    INSERT INTO `{self._project}.{self._dataset}.brs_audit_partition` ({self.PARTITION_COLUMNS})
+                    ( 
+                        SELECT
+                            entity_href, 	
+                            entity_id,
+                            entity_type,
+                            entity_data,
+                            event_type,
+                            event_moment,	
+                            {self._bucket('entity_type')},
+                            CURRENT_TIMESTAMP()
+                        FROM `{self._project}.{self._dataset}.{basic_table}`) 
+                    """
+                )
+
+                query_job.result()
+
+            except google_exceptions.Forbidden as e:
+                if not _is_sandbox_error(e):
+                    raise
+                self.switch_to_sandbox()
+
+
+    def switch_to_sandbox(self):
+        # DML is not available, brs_audit_partition becomes a view over brs_audit
+        self.sandbox_mode = True
+        self.client.delete_table(self.table_audit_partition, not_found_ok=True)
+        self.client.delete_table(self.table_temp, not_found_ok=True)
+        self.create_tables_for_sandbox()
+        self.set_layout(self.partition_layout())
+
+
+    def _partition_select(self):
+        return f"""SELECT
+                            entity_href, 	
+                            entity_id,
+                            entity_type,
+                            entity_data,
+                            event_type,
+                            event_moment,	
+                            {self._bucket('entity_type')} partition_entity_type,
+                            CURRENT_TIMESTAMP() load_moment
+                        FROM `{self._project}.{self._dataset}.brs_audit`"""
+
+
+    def get_watermark(self):
+        rows = self.client.query(f"""SELECT MAX(watermark) watermark
+                FROM `{self._project}.{self._dataset}.brs_watermark`
+                WHERE table_name = 'brs_audit_partition'""").result()
+        for row in rows:
+            return row['watermark']
+        return None
+
+
+    def sync_audit_partition(self, full_rebuild=False):
+        """Copy rows of brs_audit after the watermark missing from brs_audit_partition.
+
+        The copy is one script. The watermark in brs_watermark is the
+        greatest event_moment copied, a business time rather than the insert
+        time, so a late row at or before it that the load path failed to copy
+        is not repaired here. full_rebuild=True, or a missing watermark,
+        rebuilds the table with rebuild_audit_partition first, which repairs
+        such rows; it sets the watermark before it copies, so rows loaded
+        meanwhile are synced after. Only the error BigQuery raises for DML in a sandbox
+        project switches to sandbox mode; any other error is raised.
+        """
+        if self.sandbox_mode:
+            # brs_audit_partition is a view, always current
+            return
+        try:
+            if full_rebuild or self.get_watermark() is None:
+                self.rebuild_audit_partition()
+
+            query_job = self.client.query(
+                f"""
+                DECLARE watermark TIMESTAMP DEFAULT (
+                    SELECT MAX(watermark) FROM `{self._project}.{self._dataset}.brs_watermark`
+                    WHERE table_name = 'brs_audit_partition');
+
+                INSERT INTO `{self._project}.{self._dataset}.brs_audit_partition` ({self.PARTITION_COLUMNS})
+                ( 
+                    SELECT * FROM ({self._partition_select()}) a
+                    WHERE a.event_moment > watermark
+                        AND NOT EXISTS (
+                            SELECT 1 FROM `{self._project}.{self._dataset}.brs_audit_partition` p
+                            WHERE p.event_moment > watermark
+                                AND p.partition_entity_type = a.partition_entity_type
+                                AND p.entity_type = a.entity_type
+                                AND p.entity_href = a.entity_href
+                                AND p.event_moment = a.event_moment));
+
+                {self._watermark_insert()};
+                """
+            )
+            query_job.result()
+
+        except google_exceptions.Forbidden as e:
+            if not _is_sandbox_error(e):
+                raise
+            self.switch_to_sandbox()
+
+
+    def _watermark_insert(self):
+        return f"""INSERT INTO `{self._project}.{self._dataset}.brs_watermark` (table_name, watermark, updated)
+                SELECT 'brs_audit_partition',
+                    COALESCE(MAX(event_moment), TIMESTAMP '1970-01-01'),
+                    CURRENT_TIMESTAMP()
+                FROM `{self._project}.{self._dataset}.brs_audit`"""
+
+
+    def rebuild_audit_partition(self):
+        """Rebuild brs_audit_partition from brs_audit.
+
+        CREATE OR REPLACE TABLE swaps the table atomically, so readers never
+        see it empty. It cannot change the partitioning, which check_layout
+        keeps as configured; migrate_partitioning changes it.
+        """
+        query_job = self.client.query(
+            f"""
+            {self._watermark_insert()};
+
+            CREATE OR REPLACE TABLE `{self._project}.{self._dataset}.brs_audit_partition`
+            {self._partition_clause()}
+            AS {self._partition_select()};
+            """
+        )
+        query_job.result()
+    
+
+    def update_schema(self, fields):
+        # field '' registers an entity type without fields
+        rows = [{'entity_type': entity_type, 'field': field, 'type': field_type}
+                for entity_type, names in fields.items() for field, field_type in (typed_fields(names) or {'': None}).items()]
+        if not rows:
+            return
+        job_config = bigquery.LoadJobConfig(
+            schema=[
+                bigquery.SchemaField("entity_type", "STRING"),
+                bigquery.SchemaField("field", "STRING"),
+                bigquery.SchemaField("type", "STRING"),
+            ],
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        )
+        # a load job rather than DML, so it also works in sandbox mode
+        self.load_ndjson(self.serializer.dumps_ndjson(rows), self.table_schema, job_config)
+
+
+    def schema_discovered(self):
+        rows = self.client.query(f"""SELECT COUNT(*) discovered
+                FROM `{self._project}.{self._dataset}.brs_watermark`
+                WHERE table_name = '{self.DISCOVERY_ROW}'""").result()
+        return any(row['discovered'] for row in rows)
+
+
+    def set_schema_discovered(self):
+        self.load_watermark_row({'table_name': self.DISCOVERY_ROW})
+
+
+    def get_schema(self):
+        try:
+            self.client.get_table(self.table_schema)
+        except Exception:
+            return {}
+        rows = self.client.query(f"""SELECT entity_type, field, ARRAY_AGG(DISTINCT IFNULL(type, "")) types
+                FROM `{self._project}.{self._dataset}.brs_schema`
+                GROUP BY entity_type, field""").result()
+        schema = {}
+        for row in rows:
+            fields = schema.setdefault(row['entity_type'], {})
+            if not row['field']:
+                continue
+            field_type = None
+            for name in row['types']:
+                field_type = merge_types(field_type, name or None)
+            fields[row['field']] = field_type
+        return schema
+
+
+    def discover_schema(self, entity_types=None):
+        # the widest of the last 1000 documents per entity type
+        where = ''
+        job_config = None
+        if entity_types is not None:
+            where = 'WHERE entity_type IN UNNEST(@entity_types)'
+            job_config = bigquery.QueryJobConfig(query_parameters=[
+                bigquery.ArrayQueryParameter('entity_types', 'STRING', list(entity_types))])
+        query_bq = f"""SELECT distinct(entity_type),
+                FIRST_VALUE(entity_data) OVER(
+                PARTITION BY entity_type
+                ORDER BY (ARRAY_LENGTH(REGEXP_EXTRACT_ALL(entity_data, r'["\\']([^"]*)["\\'](?:\:)')))  desc 
+                ) AS entity_data
+                FROM (
+                    SELECT * from (
+                            SELECT entity_type, entity_data,
+                            ROW_NUMBER() OVER (PARTITION BY entity_type ORDER BY event_moment desc) rn
+                            FROM `{self._project}.{self._dataset}.brs_audit_partition`
+                            {where}
+                        ) t1
+                        WHERE t1.rn < 1000
+                ) t2"""
+
+        query_job = self.client.query(query_bq, job_config=job_config)
+        rows = query_job.result()
+
+        result_query = []
+        for row in rows:
+            for key, value in row.items():
+                result_query.append(value)
+        
+        result_query = dict(zip(result_query[::2], result_query[1::2]))
+        return {key: set(self.serializer.loads(value)) for key, value in result_query.items()}
+
+
+    def get_catalog(self):
+        """Return {name: {column: type}} for the brv_* views and brl_* tables"""
+        rows = self.client.query(f"""SELECT table_name, ARRAY_AGG(STRUCT(column_name, data_type)) columns
+                FROM `{self._project}.{self._dataset}.INFORMATION_SCHEMA.COLUMNS`
+                WHERE STARTS_WITH(table_name, 'brv_') OR STARTS_WITH(table_name, 'brl_')
+                GROUP BY table_name""").result()
+        return {row['table_name']: {column['column_name']: column['data_type'] for column in row['columns']}
+                for row in rows}
+
+
+    def migrate_partitioning(self, max_workers=8):
+        """Move existing tables to the configured partition_buckets, time_partition and cluster_by.
+
+        BigQuery cannot replace a table with another partitioning, so
+        brs_audit_partition is rebuilt in brs_audit_partition_shadow, dropped,
+        and the shadow table renamed in its place; loads must wait for it.
+        In sandbox mode the view is re-created instead. Errors are raised,
+        never switching to sandbox mode. The new layout is stored, then every
+        view is re-created, as the views embed the bucket count. Run it after
+        changing any of these options for a filled brs_audit_partition, see
+        check_layout. Returns the update_tables summary.
+        """
+        self.create_tables()
+        self.open_audit_partition()
+        if self.sandbox_mode:
+            self.client.delete_table(self.table_audit_partition, not_found_ok=True)
+            self.create_tables_for_sandbox()
+        else:
+            shadow = f"`{self._project}.{self._dataset}.brs_audit_partition_shadow`"
+            query_job = self.client.query(
+                f"""
+                DROP TABLE IF EXISTS {shadow};
+
+                {self._watermark_insert()};
+
+                CREATE TABLE {shadow}
+                {self._partition_clause()}
+                AS {self._partition_select()};
+
+                DROP TABLE `{self._project}.{self._dataset}.brs_audit_partition`;
+
+                ALTER TABLE {shadow} RENAME TO brs_audit_partition;
+                """
+            )
+            query_job.result()
+        self.set_layout(self.partition_layout())
+        return self.update_tables(rebuild_views=True, max_workers=max_workers)
+
+
+    def update_tables(self, rediscover=False, full_rebuild=False, max_workers=8, rebuild_views=False):        
+        """Adding views for new entity types, see cloudreports.database.common.
+
+        brs_audit_partition is first brought up to date by
+        sync_audit_partition. The catalog is read with one INFORMATION_SCHEMA
+        query. With latest_state, brl_<type> is merged before its view is
+        updated.
+        """
+        timings = {}
+        start = time.perf_counter()
+        
+        # update brs_audit_partition
+        self.create_tables()
+        self.open_audit_partition()
+        self.check_layout()
+        self.sync_audit_partition(full_rebuild)
+        timings['audit_partition'] = time.perf_counter() - start
+
+        stage = time.perf_counter()
+        schema = refresh_schema(self, rediscover)
+        timings['schema'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        catalog = self.get_catalog()
+        latest_views = self.get_latest_views()
+        schema = merge_view_fields(schema, catalog, self.VIEW_TYPES)
+        timings['catalog'] = time.perf_counter() - stage
+
+        # build views  
+        stage = time.perf_counter()
+        summary = update_views(
+            schema, lambda key: self._update_view(key, schema[key], catalog, latest_views, rebuild_views, full_rebuild),
+            max_workers)
+        timings['views'] = time.perf_counter() - stage
+        timings['total'] = time.perf_counter() - start
+        summary['timings'].update(timings)
+        for name, seconds in timings.items():
+            self.metrics.observe(f'bigquery.update_tables.{name}', seconds)
+        return summary
+
+
+    def _update_view(self, key, fields, catalog, latest_views, rebuild=False, full_rebuild=False):
+        """Create or update brv_<key> for {field: type} fields"""
+        view_id = f"{self._project}.{self._dataset}.brv_{key}"
+        # MERGE is DML, which sandbox mode does not allow
+        latest_state = self.latest_state and not self.sandbox_mode
+
+        if latest_state:
+            created = f"brl_{key}" not in catalog
+            if created:
+                self.create_latest_state(key)
+            # a new brl_<key> has no rows yet, whatever its watermark says
+            self.merge_latest_state(key, full_rebuild or created)
+        source_changed = latest_state != (f"brv_{key}" in latest_views)
+
+        view = bigquery.Table(view_id)
+        view.view_query = self._view_query(key, fields, latest_state)
+        if f"brv_{key}" not in catalog:
+            self.client.create_table(view)
+            return 'created'
+        columns = {view_column(field): self.VIEW_TYPES.get(field_type) for field, field_type in fields.items()}
+        if view_needs_update(catalog[f"brv_{key}"], columns, rebuild, source_changed):
+            self.client.update_table(view, ['view_query'])
+            return 'updated'
+        return 'skipped'
+
+
+    def _view_query(self, key, fields, latest_state):
+        sql_query = """-- Use JSON functions to extract values.
+-- See https://cloud.google.com/bigquery/docs/reference/standard-sql/json_functions
+SELECT\n    entity_href,\n    entity_id,\n    event_moment,\n"""
+
+        for keys in sorted(fields):
+    
+            sql_query += '    {} as `{}`'.format(self._view_expression(keys, fields[keys]), view_column(keys)) + ",\n"
+
+        if latest_state:
+            sql_query += f"FROM `{self._project}.{self._dataset}.brl_{key}`\n"
+            return sql_query
+                    
+        sql_query += f"""FROM (
+        SELECT entity_href, entity_type, entity_id, entity_data, event_moment FROM
+            (SELECT entity_href, entity_type,  
+                FIRST_VALUE(entity_id) OVER(
+                    PARTITION BY entity_href
+                    ORDER BY event_moment DESC
+                ) AS entity_id,                   
+                FIRST_VALUE(entity_data) OVER(
+                    PARTITION BY entity_href
+                    ORDER BY event_moment DESC
+                ) AS entity_data,
+                FIRST_VALUE(event_moment) OVER(
+                    PARTITION BY entity_href
+                    ORDER BY event_moment DESC
+                ) AS event_moment
+
+            FROM `{self._project}.{self._dataset}.brs_audit_partition` 
+            WHERE partition_entity_type = {self._bucket(f"'{key}'")}
+                AND entity_type = '{key}' 
+            ORDER BY  entity_href, event_moment DESC)    
+        GROUP BY entity_href, entity_type, entity_id, entity_data, event_moment
+    )
+                """            
+        return sql_query
+
+
+    def _view_expression(self, field, field_type):
+        if field_type == 'json':
+            return f'JSON_EXTRACT(entity_data, "$.{field}")'
+        expression = f'JSON_EXTRACT_SCALAR(entity_data, "$.{field}")'
+        if field_type is None or field_type == 'string':
+            return expression
+        return f'SAFE_CAST({expression} AS {self.VIEW_TYPES[field_type]})'
+
+
+    def get_latest_views(self):
+        """Return the names of the brv_* views reading a brl_* table"""
+        rows = self.client.query(f"""SELECT table_name
+                FROM `{self._project}.{self._dataset}.INFORMATION_SCHEMA.VIEWS`
+                WHERE STARTS_WITH(table_name, 'brv_') AND STRPOS(view_definition, '.brl_') > 0""").result()
+        return {row['table_name'] for row in rows}
+
+
+    def create_latest_state(self, key):
+        """Create brl_<key>, one row per entity_href, clustered for key lookups"""
+        query_job = self.client.query(
+            f"""
+            CREATE TABLE IF NOT EXISTS `{self._project}.{self._dataset}.brl_{key}` (
+                    entity_href STRING,
+                    entity_id STRING,
+                    entity_data STRING,
+                    event_moment TIMESTAMP)
+            CLUSTER BY entity_href"""
+        )
+        query_job.result()
+
+
+    def merge_latest_state(self, key, full_rebuild=False):
+        """Upsert the latest row per entity_href of brs_audit_partition into brl_<key>.
+
+        Only rows loaded after the brl_<key> watermark in brs_watermark (less
+        LOAD_OVERLAP_SECONDS) are read, so the cost follows new data;
+        full_rebuild=True reads the whole history. The watermark is the
+        greatest load_moment, not event_moment, so a backfill or a late
+        source is merged too: the MERGE keeps the row with the greater
+        event_moment, so rows read twice change nothing. brl_<key>, and the
+        brv_<key> view over it, are only as current as the last update_tables run.
+        """
+        partition = f"""partition_entity_type = {self._bucket(f"'{key}'")}
+                    AND entity_type = '{key}'"""
+        watermark = 'NULL' if full_rebuild else f"""(
+                SELECT MAX(watermark) FROM `{self._project}.{self._dataset}.brs_watermark`
+                WHERE table_name = 'brl_{key}')"""
+        query_job = self.client.query(
+            f"""
+            DECLARE watermark TIMESTAMP DEFAULT {watermark};
+            -- rows loaded while the MERGE runs wait for the next run
+            DECLARE upper_bound TIMESTAMP DEFAULT (
+                SELECT MAX(load_moment) FROM `{self._project}.{self._dataset}.brs_audit_partition`
+                WHERE {partition});
+
+            MERGE `{self._project}.{self._dataset}.brl_{key}` T
+            USING (
+                SELECT latest.* FROM (
+                    SELECT ARRAY_AGG(t ORDER BY t.event_moment DESC LIMIT 1)[OFFSET(0)] latest
+                    FROM (
+                        SELECT entity_href, entity_id, entity_data, event_moment
+                        FROM `{self._project}.{self._dataset}.brs_audit_partition`
+                        WHERE {partition}
+                            -- rows loaded before load_moment existed have none
+                            AND (watermark IS NULL OR load_moment >
+                                TIMESTAMP_SUB(watermark, INTERVAL {self.LOAD_OVERLAP_SECONDS} SECOND))
+                            AND (load_moment IS NULL OR load_moment <= upper_bound)) t
+                    GROUP BY t.entity_href)
+            ) S
+            ON T.entity_href = S.entity_href
+            WHEN MATCHED AND S.event_moment > T.event_moment THEN
+                UPDATE SET entity_id = S.entity_id, entity_data = S.entity_data, event_moment = S.event_moment
+            WHEN NOT MATCHED THEN
+                INSERT (entity_href, entity_id, entity_data, event_moment)
+                VALUES (S.entity_href, S.entity_id, S.entity_data, S.event_moment);
+
+            IF upper_bound IS NOT NULL THEN
+                INSERT INTO `{self._project}.{self._dataset}.brs_watermark` (table_name, watermark, updated)
+                VALUES ('brl_{key}', upper_bound, CURRENT_TIMESTAMP());
+            END IF;"""
+        )
+        query_job.result()
+
+
+    def drop_latest_state(self, key=None):
+        """Drop brl_<key>, or every brl_* table without key.
+
+        Run update_tables with latest_state=False first, so no brv_* view reads them.
+        """
+        if key is not None:
+            self.client.delete_table(self.dataset_ref.table(f"brl_{key}"), not_found_ok=True)
+            return
+        for table in self.client.list_tables(self.dataset_ref):
+            if table.table_id[:4] == 'brl_':
+                self.client.delete_table(table, not_found_ok=True)
+
+
+    def delete_tables(self, full_delete = True):
+        tables = self.client.list_tables(self.dataset_ref)  
+        for table in tables:
+            if table.table_id[:3] in ('brv', 'brl') or (table.table_id[:3] == 'brs' and full_delete):
+                self.client.delete_table(table, not_found_ok=True)
+
+
+    def run_sql(self, query):
+        query_job = self.client.query(query)
+        query_job.result()
+
+
+def _is_sandbox_error(error):
+    # "... DML queries are not allowed in the free tier. Set up a billing account ..."
+    return 'not allowed in the free tier' in str(error)
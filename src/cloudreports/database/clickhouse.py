@@ -0,0 +1,671 @@
+"""Define ClickHouse database."""
+
+import clickhouse_driver
+import pytz
+import queue
+import time
+from cloudreports.buffer import as_columns, parse_datetime
+from cloudreports.serializer import get_serializer
+from cloudreports.database.common import (SchemaRegistry, check_layout, merge_view_fields, refresh_schema, update_views,
+                                          view_needs_update)
+from cloudreports.metrics import NULL_METRICS
+from cloudreports.schema import merge_types, split_field, typed_fields, view_column
+
+class ClickHouse(SchemaRegistry):
+    """Define ClickHouse.
+
+    See
+    https://clickhouse.com/
+    """
+
+    PARTITION_MODES = ('temp_table', 'direct', 'materialized_view')
+    TIME_PARTITIONS = {'day': 'toYYYYMMDD', 'month': 'toYYYYMM', 'year': 'toYear'}
+    # brs_audit and brs_audit_temp columns, in the order of _insert_columns
+    AUDIT_COLUMNS = 'entity_href, entity_id, entity_type, entity_data, event_type, event_moment, event_moment2'
+    # brv_* column type per inferred field type; fields of unknown type stay JSON_VALUE strings
+    VIEW_TYPES = {'int': 'Nullable(Int64)', 'float': 'Nullable(Float64)', 'bool': 'Nullable(Bool)',
+                  'timestamp': "Nullable(DateTime64(3, 'UTC'))", 'string': 'String', 'json': 'String'}
+    # brs_watermark row holding the layout brs_audit_partition was built with
+    LAYOUT_ROW = 'brs_audit_partition_layout'
+    # brs_watermark row recording that discover_schema seeded brs_schema
+    DISCOVERY_ROW = 'brs_schema_discovery'
+    # layout of a brs_audit_partition created before layouts were stored
+    LEGACY_LAYOUT = {'partition_buckets': 4000, 'time_partition': None, 'order_by': ['partition_entity_type']}
+
+    def __init__(self, host, database, user, password, verify=None, port=9440, secure=True, serializer=None,
+                 partition_mode='temp_table', latest_state=False, client=None, metrics=None,
+                 partition_buckets=4000, time_partition=None, order_by=('partition_entity_type',),
+                 compression=False):
+        if not isinstance(host, str):
+            raise ValueError("Pass a string for host")
+        if not isinstance(database, str):
+            raise ValueError("Pass a string for database")
+        if not isinstance(user, str):
+            raise ValueError("Pass a string for user")
+        if not isinstance(password, str):
+            raise ValueError("Pass a string for password")
+        if partition_mode not in self.PARTITION_MODES:
+            raise ValueError(f"Pass one of {self.PARTITION_MODES} for partition_mode")
+        if not isinstance(partition_buckets, int) or partition_buckets < 1:
+            raise ValueError("Pass a positive int for partition_buckets")
+        if time_partition is not None and time_partition not in self.TIME_PARTITIONS:
+            raise ValueError(f"Pass None or one of {tuple(self.TIME_PARTITIONS)} for time_partition")
+        if isinstance(order_by, str) or not order_by or not all(isinstance(key, str) for key in order_by):
+            raise ValueError("Pass a non-empty list of column names for order_by")
+
+        self._host = host
+        self._database = database
+        self._user = user
+        self._password = password
+        # certificate
+        self._verify = verify
+        self.serializer = get_serializer(serializer)
+
+        # compression - True or 'lz4', 'lz4hc', 'zstd' compresses inserted blocks on
+        # the wire, needs pip install clickhouse-driver[lz4] (or [zstd])
+        self._connect_kwargs = dict(
+            host=self._host, port=port, database=self._database, user=self._user,
+            password=self._password,  ca_certs=self._verify,
+            secure=secure, compression=compression)
+        # an injected client (e.g. a fake) cannot be cloned, so update_tables
+        # then creates views one at a time on it
+        self._own_client = client is None
+        self.client = self.connect() if client is None else client
+
+        self.table_audit = 'brs_audit'
+        self.table_audit_partition = 'brs_audit_partition'
+        self.table_temp = 'brs_audit_temp'
+        self.view_audit_partition = 'brs_audit_partition_mv'
+        self.table_schema = 'brs_schema'
+        self.table_watermark = 'brs_watermark'
+        self.table_latest = 'brs_latest'
+        self.view_latest = 'brs_latest_mv'
+        # how brs_audit_partition is kept current on load:
+        #   temp_table - copy each batch through brs_audit_temp
+        #   direct - insert the batch into brs_audit_partition via input()
+        #   materialized_view - the server copies inserts into brs_audit
+        self.partition_mode = partition_mode
+        # brv_* views read brs_latest, the latest row per entity, instead of
+        # window functions; drop_latest_state() removes it once views are back
+        self.latest_state = latest_state
+        # layout of brs_audit_partition: rows go to partition_buckets buckets
+        # by entity_type, optionally split by time_partition of event_moment,
+        # and are sorted by order_by within a part. Changing any of them for
+        # existing tables needs migrate_partitioning()
+        self.partition_buckets = partition_buckets
+        self.time_partition = time_partition
+        self.order_by = tuple(order_by)
+        self.tables_created = False
+        # server timezone, read on the first load
+        self._timezone = None
+        # stage timers and counters (cloudreports.metrics.Metrics)
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+
+
+    def connect(self):
+        """Open a new connection; a clickhouse_driver.Client must not be shared between threads"""
+        return clickhouse_driver.Client(**self._connect_kwargs)
+
+
+    def load_json_data(self, data):
+        metrics = self.metrics
+        if not self.tables_created:
+            with metrics.timer('clickhouse.ddl'):
+                self.create_tables()
+                self.check_layout()
+            self.tables_created = True
+
+        with metrics.timer('clickhouse.columns'):
+            columns = self._insert_columns(data, self.server_timezone())
+        metrics.count('clickhouse.rows', len(columns[0]))
+
+        with metrics.timer('clickhouse.insert_audit'):
+            self.client.execute(f'INSERT INTO {self._database}.{self.table_audit} ({self.AUDIT_COLUMNS}) VALUES',
+                                columns, columnar=True)
+
+        if self.partition_mode == 'materialized_view':
+            return
+        if self.partition_mode == 'direct':
+            with metrics.timer('clickhouse.insert_partition'):
+                self.client.execute(f"""
+                    INSERT INTO {self._database}.{self.table_audit_partition}
+                    SELECT {self._partition_columns()}
+                    FROM input('entity_href String, entity_id String, entity_type String, entity_data String,
+                                event_type String, event_moment DateTime, event_moment2 DateTime')""",
+                    columns, columnar=True)
+            return
+
+        # brs_audit_temp
+        query = f"""
+                    CREATE TABLE IF NOT EXISTS {self._database}.brs_audit_temp (
+                            entity_href String,
+                            entity_id String,
+                            entity_type String,
+                            entity_data String,
+                            event_type String,
+                            event_moment DateTime,	
+                            event_moment2 DateTime
+                    ) ENGINE = MergeTree()
+                    order by event_moment"""
+        with metrics.timer('clickhouse.ddl'):
+            self.client.execute(query)
+        with metrics.timer('clickhouse.insert_temp'):
+            self.client.execute(f'INSERT INTO {self._database}.{self.table_temp} ({self.AUDIT_COLUMNS}) VALUES',
+                                columns, columnar=True)
+        with metrics.timer('clickhouse.fill_audit_partition'):
+            self.fill_audit_partition('brs_audit_temp')
+        with metrics.timer('clickhouse.ddl'):
+            self.client.execute(f"drop table if exists {self.table_temp}")
+
+
+    def server_timezone(self):
+        """Return the server's timezone (pytz), which naive event_moment values are taken in"""
+        if self._timezone is None:
+            connection = getattr(self.client, 'connection', None)
+            if connection is None:
+                # an injected fake has no connection
+                return pytz.utc
+            connection.force_connect()
+            self._timezone = pytz.timezone(connection.server_info.get_timezone())
+        return self._timezone
+
+
+    def _insert_columns(self, data, timezone=pytz.utc):
+        """Return the columns of a batch in AUDIT_COLUMNS order for a columnar insert.
+
+        event_moment is sent as epoch seconds, which clickhouse_driver writes
+        without conversion; each distinct string is parsed once. Naive values
+        are taken in timezone (the server's in load_json_data), as the driver
+        does for datetimes, so they land next to rows loaded by earlier
+        versions. event_moment2 (for ORDER BY event_moment2 in the views) is
+        the same list, not a copy.
+        """
+        columns = as_columns(data)
+        epochs = {}
+        moments = []
+        for value in columns['event_moment']:
+            epoch = epochs.get(value)
+            if epoch is None:
+                moment = parse_datetime(value)
+                if moment.tzinfo is None:
+                    moment = timezone.localize(moment)
+                epoch = epochs[value] = int(moment.timestamp())
+            moments.append(epoch)
+        return [columns['entity_href'], columns['entity_id'], columns['entity_type'], columns['entity_data'],
+                columns['event_type'], moments, moments]
+
+
+    def create_tables(self):
+	    # brs_audit
+        query = f"""
+                    CREATE TABLE IF NOT EXISTS {self._database}.brs_audit (
+                            entity_href String,
+                            entity_id String,
+                            entity_type String,
+                            entity_data String,
+                            event_type String,
+                            event_moment DateTime,	
+                            event_moment2 DateTime
+                    ) ENGINE = MergeTree()
+                    order by event_moment"""
+        self.client.execute(query)
+
+        # brs_audit_partition
+        self.client.execute(self._audit_partition_ddl(f"{self._database}.{self.table_audit_partition}"))
+
+        # brs_audit_partition_mv
+        if self.partition_mode == 'materialized_view':
+            query = f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {self._database}.{self.view_audit_partition}
+                TO {self._database}.{self.table_audit_partition}
+                AS SELECT {self._partition_columns()}
+                FROM {self._database}.{self.table_audit}"""
+        else:
+            # other modes copy batches themselves, a leftover view would duplicate them
+            query = f"DROP VIEW IF EXISTS {self._database}.{self.view_audit_partition}"
+        self.client.execute(query)
+
+        # brs_schema, one row per type seen for a field ('' unknown)
+        query = f"""
+                CREATE TABLE IF NOT EXISTS {self._database}.{self.table_schema} (
+                        entity_type String,
+                        field String,
+                        type String DEFAULT '',
+                        updated DateTime DEFAULT now()) ENGINE = ReplacingMergeTree(updated)
+                order by (entity_type, field, type)"""
+        self.client.execute(query)
+
+        # brs_watermark
+        query = f"""
+                CREATE TABLE IF NOT EXISTS {self._database}.{self.table_watermark} (
+                        table_name String,
+                        watermark DateTime,
+                        updated DateTime DEFAULT now(),
+                        layout String DEFAULT '') ENGINE = ReplacingMergeTree(updated)
+                order by table_name"""
+        self.client.execute(query)
+
+
+    def table_exists(self, table):
+        if self.client.execute(
+                f"SELECT name FROM system.tables WHERE name = '{table}' and database = '{self._database}'"):
+            return True
+        else:
+            return False
+
+
+    def _audit_partition_ddl(self, table):
+        partition_by = 'partition_entity_type'
+        if self.time_partition is not None:
+            partition_by = f"(partition_entity_type, {self.TIME_PARTITIONS[self.time_partition]}(event_moment))"
+        return f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                        entity_href String,
+                        entity_id String,
+                        entity_type String,
+                        entity_data String,	
+                        event_type String,
+                        event_moment DateTime,	
+                        event_moment2 DateTime,
+                        partition_entity_type Int64) ENGINE = MergeTree
+                PARTITION BY {partition_by}
+                order by ({', '.join(self.order_by)})"""
+
+
+    def partition_layout(self):
+        """Return the configured layout of brs_audit_partition"""
+        return {'partition_buckets': self.partition_buckets, 'time_partition': self.time_partition,
+                'order_by': list(self.order_by)}
+
+
+    def get_layout(self):
+        """Return the layout stored for brs_audit_partition, or None"""
+        rows = self.client.execute(f"""SELECT argMax(layout, updated) FROM {self._database}.{self.table_watermark}
+                WHERE table_name = '{self.LAYOUT_ROW}'""")
+        if rows and rows[0][0]:
+            return self.serializer.loads(rows[0][0])
+        return None
+
+
+    def set_layout(self, layout):
+        self.client.execute(f'INSERT INTO {self._database}.{self.table_watermark} (table_name, layout) VALUES',
+                            [(self.LAYOUT_ROW, self.serializer.dumps(layout))])
+
+
+    def check_layout(self):
+        """Raise ValueError if brs_audit_partition has another layout than configured.
+
+        The layout (partition_buckets, time_partition, order_by) is stored in
+        brs_watermark. Loads and update_tables refuse another one until
+        migrate_partitioning() rebuilt the table, as the views would look
+        for rows in the wrong buckets. A filled table from before layouts
+        were stored has LEGACY_LAYOUT, which the default options keep.
+        """
+        def has_rows():
+            rows = self.client.execute(f"SELECT count() FROM {self._database}.{self.table_audit_partition}")
+            return bool(rows and rows[0][0])
+        check_layout(self, has_rows, self.LEGACY_LAYOUT)
+
+
+    def _bucket(self, entity_type):
+        return f"abs(farmFingerprint64({entity_type}) % {self.partition_buckets})"
+
+
+    def _partition_columns(self):
+        return f"""
+                    entity_href,
+                    entity_id,
+                    entity_type,
+                    entity_data,
+                    event_type,
+                    event_moment,
+                    event_moment2,
+                    {self._bucket('entity_type')} AS partition_entity_type"""
+
+
+    def fill_audit_partition(self, basic_table):
+        query = f"""
+            INSERT INTO {self._database}.brs_audit_partition
+            SELECT {self._partition_columns()}
+            FROM {self._database}.{basic_table}
+            """
+        self.client.execute(query)
+
+
+    def sync_audit_partition(self, full_rebuild=False):
+        """Copy rows of brs_audit after the watermark missing from brs_audit_partition.
+
+        Rows are matched on (entity_href, entity_type, event_moment). The
+        watermark in brs_watermark is the greatest event_moment copied, a
+        business time rather than the insert time, so a late row at or before
+        it that the load path failed to copy is not repaired here.
+        full_rebuild=True, or a missing watermark, rebuilds the table with
+        rebuild_audit_partition first, which repairs such rows; it sets the
+        watermark before it copies, so rows loaded meanwhile are synced after.
+        """
+        rows = self.client.execute(f"""SELECT count() FROM {self._database}.{self.table_watermark}
+                WHERE table_name = '{self.table_audit_partition}'""")
+        if full_rebuild or not rows[0][0]:
+            self.rebuild_audit_partition()
+
+        watermark = f"""(SELECT max(watermark) FROM {self._database}.{self.table_watermark}
+                    WHERE table_name = '{self.table_audit_partition}')"""
+        query = f"""
+            INSERT INTO {self._database}.{self.table_audit_partition}
+            SELECT {self._partition_columns()}
+            FROM {self._database}.{self.table_audit}
+            WHERE event_moment > {watermark}
+            AND (entity_href, entity_type, event_moment) NOT IN (
+                SELECT entity_href, entity_type, event_moment
+                FROM {self._database}.{self.table_audit_partition}
+                WHERE event_moment > {watermark})
+            """
+        self.client.execute(query)
+        self.set_watermark()
+
+
+    def set_watermark(self):
+        query = f"""
+            INSERT INTO {self._database}.{self.table_watermark} (table_name, watermark)
+            SELECT '{self.table_audit_partition}', max(event_moment)
+            FROM {self._database}.{self.table_audit}"""
+        self.client.execute(query)
+
+
+    def rebuild_audit_partition(self):
+        """Rebuild brs_audit_partition from brs_audit in a shadow table and swap it in.
+
+        Readers keep the old table until EXCHANGE TABLES. The shadow table is
+        created with the configured partitioning.
+        """
+        shadow = f"{self._database}.{self.table_audit_partition}_shadow"
+        self.client.execute(f"DROP TABLE IF EXISTS {shadow}")
+        # the configured layout, which may differ from the table being replaced
+        self.client.execute(self._audit_partition_ddl(shadow))
+        self.set_watermark()
+        self.client.execute(f"""
+            INSERT INTO {shadow}
+            SELECT {self._partition_columns()}
+            FROM {self._database}.{self.table_audit}
+            """)
+        if self.partition_mode == 'materialized_view':
+            # the view is bound to the table it was created for, re-create it after the swap
+            self.client.execute(f"DROP VIEW IF EXISTS {self._database}.{self.view_audit_partition}")
+        self.client.execute(f"EXCHANGE TABLES {self._database}.{self.table_audit_partition} AND {shadow}")
+        self.client.execute(f"DROP TABLE IF EXISTS {shadow}")
+        if self.partition_mode == 'materialized_view':
+            self.create_tables()
+
+
+    def update_schema(self, fields):
+        # field '' registers an entity type without fields
+        rows = [(entity_type, field, field_type or '')
+                for entity_type, names in fields.items() for field, field_type in (typed_fields(names) or {'': None}).items()]
+        if not rows:
+            return
+        if not self.tables_created:
+            self.create_tables()
+            self.check_layout()
+            self.tables_created = True
+
+        self.client.execute(f'INSERT INTO {self._database}.{self.table_schema} (entity_type, field, type) VALUES', rows)
+
+
+    def schema_discovered(self):
+        rows = self.client.execute(f"""SELECT count() FROM {self._database}.{self.table_watermark}
+                WHERE table_name = '{self.DISCOVERY_ROW}'""")
+        return bool(rows and rows[0][0])
+
+
+    def set_schema_discovered(self):
+        self.client.execute(f'INSERT INTO {self._database}.{self.table_watermark} (table_name) VALUES',
+                            [(self.DISCOVERY_ROW,)])
+
+
+    def get_schema(self):
+        rows = self.client.execute(f"""SELECT entity_type, field, groupUniqArray(type)
+                FROM {self._database}.{self.table_schema}
+                GROUP BY entity_type, field""")
+        schema = {}
+        for entity_type, field, types in rows:
+            fields = schema.setdefault(entity_type, {})
+            if not field:
+                continue
+            field_type = None
+            for name in types:
+                field_type = merge_types(field_type, name or None)
+            fields[field] = field_type
+        return schema
+
+
+    def discover_schema(self, entity_types=None):
+        # the widest of the last 1000 documents per entity type
+        where = ''
+        if entity_types is not None:
+            where = f"WHERE entity_type IN ({', '.join(_quote(name) for name in entity_types) or 'NULL'})"
+        query = f"""SELECT distinct(entity_type),
+                FIRST_VALUE(entity_data) OVER( PARTITION BY entity_type ORDER BY (length(extractAll(ifNull(entity_data,''), '"([^"]*)":')))  desc ) AS entity_data
+                FROM (
+                    SELECT * from (
+                            SELECT entity_type, entity_data,
+                            ROW_NUMBER() OVER (PARTITION BY entity_type ORDER BY event_moment desc) rn
+                            FROM {self._database}.brs_audit_partition
+                            {where}
+                        ) t1
+                        WHERE t1.rn < 1000
+                ) t2"""
+
+        rows = self.client.execute(query)
+        result_query = []
+        for row in rows:
+            for item in row:
+                result_query.append(item)
+        result_query = dict(zip(result_query[::2], result_query[1::2]))
+        return {key: set(self.serializer.loads(value)) for key, value in result_query.items()}
+
+
+    def get_catalog(self):
+        """Return {name: {column: type}} for the brv_* views"""
+        rows = self.client.execute(f"""SELECT table, groupArray(name), groupArray(type) FROM system.columns
+                WHERE database = '{self._database}' AND startsWith(table, 'brv_')
+                GROUP BY table""")
+        return {table: dict(zip(columns, types)) for table, columns, types in rows}
+
+
+    def migrate_partitioning(self, max_workers=8):
+        """Move existing tables to the configured partition_buckets, time_partition and order_by.
+
+        brs_audit_partition is rebuilt in a shadow table and swapped in, the
+        new layout is stored, then every view is re-created, as the views
+        embed the bucket count. Run it after changing any of these options
+        for a filled brs_audit_partition, see check_layout. Returns the
+        update_tables summary.
+        """
+        self.create_tables()
+        self.rebuild_audit_partition()
+        self.set_layout(self.partition_layout())
+        return self.update_tables(rebuild_views=True, max_workers=max_workers)
+
+
+    def update_tables(self, rediscover=False, full_rebuild=False, max_workers=8, rebuild_views=False):
+        """Adding views for new entity types, see cloudreports.database.common.
+
+        brs_audit_partition is first brought up to date by
+        sync_audit_partition. The catalog is read from system.columns once,
+        and each view thread opens a connection of its own (an injected
+        client is used by one thread only).
+        """
+        timings = {}
+        start = time.perf_counter()
+
+        # update brs_audit_partition
+        self.create_tables()
+        self.check_layout()
+        self.sync_audit_partition(full_rebuild)
+        timings['audit_partition'] = time.perf_counter() - start
+
+        stage = time.perf_counter()
+        schema = refresh_schema(self, rediscover)
+        timings['schema'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        if self.latest_state:
+            self.create_latest_state()
+        timings['latest_state'] = time.perf_counter() - stage
+
+        stage = time.perf_counter()
+        catalog = self.get_catalog()
+        latest_views = self.get_latest_views()
+        schema = merge_view_fields(schema, catalog, self.VIEW_TYPES)
+        timings['catalog'] = time.perf_counter() - stage
+
+        # build views
+        stage = time.perf_counter()
+        if not self._own_client:
+            max_workers = 1
+        clients = queue.Queue()
+        opened = []
+
+        def update_view(key):
+            try:
+                client = clients.get_nowait()
+            except queue.Empty:
+                client = self.connect() if self._own_client else self.client
+                opened.append(client)
+            try:
+                return self._update_view(client, key, schema[key], catalog, latest_views, rebuild_views)
+            finally:
+                clients.put(client)
+
+        try:
+            summary = update_views(schema, update_view, max_workers)
+        finally:
+            for client in opened:
+                if client is not self.client:
+                    client.disconnect()
+        timings['views'] = time.perf_counter() - stage
+        timings['total'] = time.perf_counter() - start
+        summary['timings'].update(timings)
+        for name, seconds in timings.items():
+            self.metrics.observe(f'clickhouse.update_tables.{name}', seconds)
+        return summary
+
+
+    def _update_view(self, client, key, fields, catalog, latest_views, rebuild=False):
+        """Create or update brv_<key> for {field: type} fields"""
+        view_id = f"brv_{key}"
+        columns = {view_column(field): self.VIEW_TYPES.get(field_type) for field, field_type in fields.items()}
+        source_changed = self.latest_state != (view_id in latest_views)
+
+        if view_id not in catalog:
+            client.execute(self._view_query(key, fields))
+            return 'created'
+        if view_needs_update(catalog[view_id], columns, rebuild, source_changed):
+            client.execute(self._view_query(key, fields))
+            return 'updated'
+        return 'skipped'
+
+
+    def _view_query(self, key, fields):
+        sql_query = f"""create or replace view {self._database}.brv_{key}\nas\nSELECT\nentity_href,\nentity_id,\nevent_moment\n"""
+
+        for keys in sorted(fields):
+            sql_query += ",{} as `{}`".format(self._view_expression(keys, fields[keys]), view_column(keys)) + "\n"
+
+        if self.latest_state:
+            sql_query += f"FROM {self._database}.{self.table_latest} FINAL\nWHERE entity_type = '{key}'"
+            return sql_query
+
+        sql_query += f"""FROM ( SELECT entity_type, entity_href, entity_id, entity_data, event_moment FROM 
+                    (SELECT entity_type, entity_href, 
+                    FIRST_VALUE(entity_id) OVER(PARTITION BY entity_href ORDER BY event_moment2 DESC) AS entity_id,
+                    FIRST_VALUE(entity_data) OVER(PARTITION BY entity_href ORDER BY event_moment2 DESC) AS entity_data,
+                    FIRST_VALUE(event_moment) OVER(PARTITION BY entity_href ORDER BY event_moment2 DESC) AS event_moment
+                    FROM {self._database}.brs_audit_partition
+                    WHERE partition_entity_type = {self._bucket(f"'{key}'")} 
+                    AND entity_type = '{key}' 
+                    ORDER BY  entity_href, event_moment DESC)
+                    GROUP BY entity_type, entity_href, entity_id, entity_data, event_moment )"""
+        return sql_query
+
+
+    def _view_expression(self, field, field_type):
+        if field_type is None or field_type == 'string':
+            return f"JSON_VALUE(entity_data, '$.{field}')"
+        path = ', '.join(_quote(key) for key in split_field(field))
+        if field_type == 'json':
+            return f"JSONExtractRaw(entity_data, {path})"
+        if field_type == 'timestamp':
+            return f"parseDateTime64BestEffortOrNull(JSONExtractString(entity_data, {path}), 3, 'UTC')"
+        return f"JSONExtract(entity_data, {path}, '{self.VIEW_TYPES[field_type]}')"
+
+
+    def get_latest_views(self):
+        """Return the names of the brv_* views reading brs_latest"""
+        rows = self.client.execute(f"""SELECT name FROM system.tables
+                WHERE database = '{self._database}' AND startsWith(name, 'brv_')
+                AND position(create_table_query, '{self._database}.{self.table_latest} ') > 0""")
+        return {row[0] for row in rows}
+
+
+    def create_latest_state(self):
+        """Create brs_latest with the latest row per (entity_type, entity_href).
+
+        ReplacingMergeTree keeps the row with the greatest event_moment2, and
+        the one brs_latest_mv materialized view feeds it from every insert
+        into brs_audit, whatever the number of entity types. A new brs_latest
+        is filled from brs_audit after the view exists; duplicates collapse on merge.
+        """
+        existed = self.table_exists(self.table_latest)
+        query = f"""
+                CREATE TABLE IF NOT EXISTS {self._database}.{self.table_latest} (
+                        entity_type String,
+                        entity_href String,
+                        entity_id String,
+                        entity_data String,
+                        event_moment DateTime,
+                        event_moment2 DateTime
+                ) ENGINE = ReplacingMergeTree(event_moment2)
+                order by (entity_type, entity_href)"""
+        self.client.execute(query)
+
+        query = f"""
+                CREATE MATERIALIZED VIEW IF NOT EXISTS {self._database}.{self.view_latest}
+                TO {self._database}.{self.table_latest}
+                AS SELECT entity_type, entity_href, entity_id, entity_data, event_moment, event_moment2
+                FROM {self._database}.{self.table_audit}"""
+        self.client.execute(query)
+
+        if not existed:
+            query = f"""
+                    INSERT INTO {self._database}.{self.table_latest}
+                    SELECT entity_type, entity_href, entity_id, entity_data, event_moment, event_moment2
+                    FROM {self._database}.{self.table_audit}"""
+            self.client.execute(query)
+
+
+    def drop_latest_state(self):
+        """Drop brs_latest and its view.
+
+        Run update_tables with latest_state=False first, so no brv_* view reads it.
+        """
+        self.client.execute(f"DROP VIEW IF EXISTS {self._database}.{self.view_latest}")
+        self.client.execute(f"DROP TABLE IF EXISTS {self._database}.{self.table_latest}")
+
+
+    def delete_tables(self, full_delete = True):
+        # materialized views first, so no insert hits a dropped target table
+        query = f"""SELECT name FROM system.tables WHERE database = '{self._database}'
+                ORDER BY engine = 'MaterializedView' DESC"""
+        tables = self.client.execute(query)
+        for table in tables:
+            if table[0][:3] == 'brv' or (table[0][:3] == 'brs' and full_delete):
+                self.client.execute(f"drop table if exists {self._database}.{table[0]}")
+
+
+    def run_sql(self, query):
+        self.client.execute(query)        
+
+
+def _quote(value):
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
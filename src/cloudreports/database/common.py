@@ -0,0 +1,148 @@
+"""Helpers shared by the database backends.
+
+Every backend has update_tables(rediscover=False, full_rebuild=False,
+max_workers=8, rebuild_views=False). It builds a brv_<type> view (for
+LocalFiles, files) per entity type of the schema registry on up to
+max_workers threads, re-creates a view that lacks fields or types of the
+registry (or every view, with rebuild_views=True), and returns
+{'created': [...], 'updated': [...], 'skipped': [...], 'timings': {...}}.
+"""
+
+import abc
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cloudreports.schema import VIEW_BASE_COLUMNS, merge_fields, view_field
+
+
+class SchemaRegistry(abc.ABC):
+    """Define SchemaRegistry.
+
+    The brs_schema registry every backend keeps: {entity_type: {field: type}}
+    of the entity_data fields seen (see cloudreports.schema), from which the
+    brv_* views get their columns. Client sends the fields of a batch with
+    update_schema before loading it, and registers every entity type it
+    loads, with no fields if its entity_data are not objects.
+    """
+
+    @abc.abstractmethod
+    def update_schema(self, fields):
+        """Add {entity_type: {field: type}} (or {entity_type: fields}) to the schema registry.
+
+        An entity type with no fields is registered too.
+        """
+
+
+    @abc.abstractmethod
+    def get_schema(self):
+        """Return {entity_type: {field: type}} from the schema registry, widened over all types seen"""
+
+
+    @abc.abstractmethod
+    def discover_schema(self, entity_types=None):
+        """Return {entity_type: fields} of loaded rows, of every entity type or of entity_types.
+
+        Used to seed the schema registry with data loaded before it existed,
+        see refresh_schema.
+        """
+
+
+    @abc.abstractmethod
+    def schema_discovered(self):
+        """Return True once the schema registry was seeded by discover_schema"""
+
+
+    @abc.abstractmethod
+    def set_schema_discovered(self):
+        """Record that the schema registry was seeded by discover_schema"""
+
+
+def import_pyarrow(option):
+    """Return (pyarrow, pyarrow.parquet), or raise ImportError naming the option that needs them"""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"{option} requires pyarrow, run pip install cloudreports[parquet]")
+    return pyarrow, pyarrow.parquet
+
+
+def check_layout(database, has_rows, legacy):
+    """Raise ValueError if brs_audit_partition of database was built with another layout than configured.
+
+    A table from before layouts were stored is taken to have the legacy
+    layout of that version if has_rows() finds rows in it, and the
+    configured layout if it is empty; that layout is then stored.
+    """
+    configured = database.partition_layout()
+    stored = database.get_layout()
+    if stored is None:
+        stored = legacy if has_rows() else configured
+        database.set_layout(stored)
+    if stored != configured:
+        raise ValueError(f"brs_audit_partition was built with layout {stored}, not the configured {configured}; "
+                         "run migrate_partitioning() to rebuild it")
+
+
+def refresh_schema(database, rediscover=False):
+    """Return the schema registry of database, seeded by a scan the first time.
+
+    The registry holds every entity type a Client loaded, so entity types
+    are not listed from the loaded rows, which would scan all of them. Data
+    loaded before the registry existed is only found by discover_schema,
+    which runs once per database (a marker records it, as clients fill the
+    registry before the first update_tables), and again with
+    rediscover=True, e.g. for types loaded by clients that did not register
+    them.
+    """
+    if not rediscover and database.schema_discovered():
+        return database.get_schema()
+    database.update_schema(database.discover_schema())
+    database.set_schema_discovered()
+    return database.get_schema()
+
+
+def merge_view_fields(schema, catalog, view_types):
+    """Return schema with the columns of the existing brv_* views in catalog merged in.
+
+    A view is then never re-created with fewer columns than it has, even if
+    the registry lacks some of its fields. view_types maps field types to
+    the column types of the backend.
+    """
+    column_types = {column_type: field_type for field_type, column_type in view_types.items()
+                    if list(view_types.values()).count(column_type) == 1}
+    merged = {}
+    for key, fields in schema.items():
+        fields = merged[key] = dict(fields)
+        columns = catalog.get(f"brv_{key}", {})
+        merge_fields(fields, {view_field(column): column_types.get(column_type)
+                              for column, column_type in columns.items() if column not in VIEW_BASE_COLUMNS})
+    return merged
+
+
+def view_needs_update(current, columns, rebuild, source_changed):
+    """Return True if a view with {column: type} current must be re-created for {column: type} columns.
+
+    Typed columns must also have their type, so a widened field rebuilds the
+    view; a column of type None matches any type. A view switching source
+    is re-created even if its columns match, and any view with rebuild.
+    """
+    return rebuild or source_changed or any(
+        column not in current or (column_type is not None and current[column] != column_type)
+        for column, column_type in columns.items())
+
+
+def update_views(keys, update_view, max_workers):
+    """Call update_view(key) for every key on a bounded thread pool and collect the summary"""
+    summary = {'created': [], 'updated': [], 'skipped': [], 'timings': {}}
+
+    def run(key):
+        start = time.perf_counter()
+        status = update_view(key)
+        return key, status, time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        for key, status, seconds in pool.map(run, sorted(keys)):
+            summary[status].append(f"brv_{key}")
+            summary['timings'][f"brv_{key}"] = seconds
+    return summary
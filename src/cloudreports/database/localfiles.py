@@ -0,0 +1,407 @@
+"""Define local files database."""
+
+import gzip
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import datetime
+from urllib.parse import quote, unquote
+from cloudreports.buffer import as_columns, to_datetime
+from cloudreports.serializer import get_serializer
+from cloudreports.database.common import SchemaRegistry, import_pyarrow, refresh_schema, update_views
+from cloudreports.metrics import NULL_METRICS
+from cloudreports.schema import merge_fields, split_field, typed_fields, view_column
+
+class LocalFiles(SchemaRegistry):
+    """Define LocalFiles.
+
+    Writes every batch as files under directory instead of loading it into a
+    warehouse, at disk speed and without network access. The files can be
+    bulk-loaded later in a few large jobs (e.g. bq load, or ClickHouse
+    INSERT ... FROM INFILE), or serve as a target for benchmarks.
+
+    directory/
+        brs_audit/entity_type=<type>/date=<YYYY-MM-DD>/part-*.parquet
+        brs_schema.json
+        brl_<type>/  latest row per entity_href, with entity_data
+        brv_<type>/  latest row per entity_href, one typed column per field
+
+    file_format - 'parquet' (needs pip install cloudreports[parquet]) or 'ndjson'
+    compression - parquet: 'snappy' (default), 'zstd', 'gzip' or 'none';
+        ndjson: 'gzip' (default) or 'none'
+
+    Directory names are percent-encoded, Hive style; the files hold all
+    columns, so they load without Hive partitioning options too.
+    """
+
+    FILE_FORMATS = {'parquet': ('snappy', 'zstd', 'gzip', 'none'), 'ndjson': ('gzip', 'none')}
+    # brs_audit columns, in the order BigQuery creates them
+    AUDIT_COLUMNS = ('entity_href', 'entity_id', 'entity_type', 'entity_data', 'event_type', 'event_moment')
+    LATEST_COLUMNS = ('entity_href', 'entity_id', 'entity_data', 'event_moment')
+
+    def __init__(self, directory, file_format='parquet', compression=None, serializer=None, metrics=None):
+        if not isinstance(directory, str):
+            raise ValueError("Pass a string for directory")
+        if file_format not in self.FILE_FORMATS:
+            raise ValueError(f"Pass one of {tuple(self.FILE_FORMATS)} for file_format")
+        if compression is None:
+            compression = self.FILE_FORMATS[file_format][0]
+        if compression not in self.FILE_FORMATS[file_format]:
+            raise ValueError(f"Pass one of {self.FILE_FORMATS[file_format]} for compression")
+        if file_format == 'parquet':
+            # fail here rather than on the first flush
+            import_pyarrow("file_format='parquet'")
+
+        self._directory = directory
+        self.file_format = file_format
+        self.compression = compression
+        self.serializer = get_serializer(serializer)
+        # stage timers and counters (cloudreports.metrics.Metrics)
+        self.metrics = metrics if metrics is not None else NULL_METRICS
+
+        self.table_audit = os.path.join(directory, 'brs_audit')
+        self.table_schema = os.path.join(directory, 'brs_schema.json')
+        # empty file recording that discover_schema seeded brs_schema.json
+        self.schema_discovery = os.path.join(directory, 'brs_schema_discovery')
+        self._schema_lock = threading.Lock()
+        self._seq = 0
+        # event_moment string -> date directory name
+        self._dates = {}
+        self.tables_created = False
+
+
+    def load_json_data(self, data):
+        """Write a batch as one file per entity_type and event date"""
+        metrics = self.metrics
+        if not self.tables_created:
+            self.create_tables()
+            self.tables_created = True
+        metrics.count('localfiles.rows', len(data))
+
+        columns = as_columns(data)
+        groups = {}
+        dates = self._dates
+        for i, (entity_type, event_moment) in enumerate(zip(columns['entity_type'], columns['event_moment'])):
+            date = dates.get(event_moment)
+            if date is None:
+                if len(dates) > 100000:
+                    dates.clear()
+                date = dates[event_moment] = to_datetime(event_moment).date().isoformat()
+            groups.setdefault((entity_type, date), []).append(i)
+
+        with metrics.timer('localfiles.write'):
+            for (entity_type, date), rows in groups.items():
+                part = {name: [columns[name][i] for i in rows] for name in self.AUDIT_COLUMNS}
+                directory = os.path.join(self.table_audit, f'entity_type={quote(entity_type, safe="")}',
+                                         f'date={date}')
+                metrics.count('localfiles.bytes', self._write(directory, self._part_name(), part))
+
+
+    def create_tables(self):
+        os.makedirs(self.table_audit, exist_ok=True)
+
+
+    def update_schema(self, fields):
+        if not fields:
+            return
+        with self._schema_lock:
+            schema = self.get_schema()
+            for entity_type, names in fields.items():
+                merge_fields(schema.setdefault(entity_type, {}), typed_fields(names))
+            os.makedirs(self._directory, exist_ok=True)
+            _replace(self.table_schema, json.dumps(
+                {entity_type: dict(sorted(names.items())) for entity_type, names in schema.items()}).encode('utf-8'))
+
+
+    def schema_discovered(self):
+        return os.path.exists(self.schema_discovery)
+
+
+    def set_schema_discovered(self):
+        os.makedirs(self._directory, exist_ok=True)
+        _replace(self.schema_discovery, b'')
+
+
+    def get_schema(self):
+        try:
+            with open(self.table_schema, 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+
+    def discover_schema(self, entity_types=None):
+        # every document in brs_audit, there is no index to sample from
+        schema = {}
+        if entity_types is None:
+            entity_types = self.get_entity_types()
+        for entity_type in entity_types:
+            fields = schema[entity_type] = set()
+            for path in self._audit_parts(entity_type):
+                for entity_data in self._read(path, ('entity_data',))['entity_data']:
+                    document = self.serializer.loads(entity_data)
+                    if isinstance(document, dict):
+                        fields.update(document)
+        return schema
+
+
+    def get_entity_types(self):
+        """Return the entity types of brs_audit, from its directory names"""
+        try:
+            names = os.listdir(self.table_audit)
+        except FileNotFoundError:
+            return []
+        return sorted(unquote(name[len('entity_type='):]) for name in names if name.startswith('entity_type='))
+
+
+    def update_tables(self, rediscover=False, full_rebuild=False, max_workers=8, rebuild_views=False):
+        """Write the latest-state datasets brl_<type> and brv_<type>, see cloudreports.database.common.
+
+        brl_<type> is brought up to date from the brs_audit files written
+        since the last run (listed in its _state.json), or rebuilt from all of
+        them with full_rebuild=True; brv_<type> is then rewritten from it with
+        a column per field of the schema registry, typed like the ClickHouse
+        and BigQuery views (a value not fitting the type is null).
+        """
+        timings = {}
+        start = time.perf_counter()
+        self.create_tables()
+
+        schema = refresh_schema(self, rediscover)
+        timings['schema'] = time.perf_counter() - start
+
+        stage = time.perf_counter()
+        summary = update_views(
+            schema, lambda key: self._update_view(key, schema[key], full_rebuild, rebuild_views), max_workers)
+        timings['views'] = time.perf_counter() - stage
+        timings['total'] = time.perf_counter() - start
+        summary['timings'].update(timings)
+        for name, seconds in timings.items():
+            self.metrics.observe(f'localfiles.update_tables.{name}', seconds)
+        return summary
+
+
+    def _update_view(self, key, fields, full_rebuild=False, rebuild=False):
+        """Write brl_<key> and brv_<key> for {field: type} fields"""
+        latest_dir = os.path.join(self._directory, f'brl_{quote(key, safe="")}')
+        view_dir = os.path.join(self._directory, f'brv_{quote(key, safe="")}')
+        state_path = os.path.join(latest_dir, '_state.json')
+        created = not os.path.isdir(view_dir)
+
+        state = {'parts': [], 'fields': {}}
+        latest = {}
+        if not full_rebuild and os.path.exists(state_path):
+            with open(state_path, 'rb') as f:
+                state = json.load(f)
+            latest = self._read_latest(latest_dir)
+        # a field missing from the registry keeps its brv_<key> column
+        fields = dict(fields)
+        merge_fields(fields, state['fields'])
+        done = set(state['parts'])
+        parts = self._audit_parts(key)
+        new_parts = [path for path in parts if os.path.relpath(path, self.table_audit) not in done]
+
+        if not created and not new_parts and state['fields'] == fields and not rebuild and not full_rebuild:
+            return 'skipped'
+
+        for path in new_parts:
+            part = self._read(path, ('entity_href', 'entity_id', 'entity_data', 'event_moment'))
+            for entity_href, entity_id, entity_data, event_moment in zip(
+                    part['entity_href'], part['entity_id'], part['entity_data'], part['event_moment']):
+                event_moment = to_datetime(event_moment)
+                current = latest.get(entity_href)
+                # the later row wins a tie, as parts are read in write order
+                if current is None or event_moment >= current[2]:
+                    latest[entity_href] = (entity_id, entity_data, event_moment)
+
+        hrefs = sorted(latest)
+        rows = [latest[entity_href] for entity_href in hrefs]
+        columns = {
+            'entity_href': hrefs,
+            'entity_id': [row[0] for row in rows],
+            'entity_data': [row[1] for row in rows],
+            'event_moment': [row[2] for row in rows],
+        }
+        self._write(latest_dir, 'part-0', columns, replace=True)
+        _replace(state_path, json.dumps({
+            'parts': sorted(os.path.relpath(path, self.table_audit) for path in parts),
+            'fields': fields,
+        }).encode('utf-8'))
+
+        documents = [self.serializer.loads(entity_data) for entity_data in columns.pop('entity_data')]
+        types = {}
+        for field, field_type in sorted(fields.items()):
+            column = view_column(field)
+            path = split_field(field)
+            columns[column] = [_cast(_extract(document, path), field_type) for document in documents]
+            types[column] = field_type
+        self._write(view_dir, 'part-0', columns, replace=True, types=types)
+        return 'created' if created else 'updated'
+
+
+    def _read_latest(self, latest_dir):
+        paths = [os.path.join(latest_dir, name) for name in os.listdir(latest_dir) if name.startswith('part-')]
+        latest = {}
+        for path in paths:
+            part = self._read(path, self.LATEST_COLUMNS)
+            for entity_href, entity_id, entity_data, event_moment in zip(
+                    part['entity_href'], part['entity_id'], part['entity_data'], part['event_moment']):
+                latest[entity_href] = (entity_id, entity_data, to_datetime(event_moment))
+        return latest
+
+
+    def _audit_parts(self, entity_type):
+        """Return the brs_audit files of entity_type, in write order"""
+        directory = os.path.join(self.table_audit, f'entity_type={quote(entity_type, safe="")}')
+        paths = []
+        for root, dirs, names in os.walk(directory):
+            paths.extend(os.path.join(root, name) for name in names if name.startswith('part-'))
+        paths.sort(key=os.path.basename)
+        return paths
+
+
+    def _part_name(self):
+        # time first, so names sort in write order; pid and sequence keep
+        # concurrent writers apart
+        self._seq += 1
+        return f'part-{time.time_ns():020d}-{os.getpid()}-{self._seq:06d}'
+
+
+    def _write(self, directory, name, columns, replace=False, types=None):
+        """Write columns as directory/name plus extension; return the file size.
+
+        types maps columns to field types (cloudreports.schema); other columns
+        are strings, event_moment a timestamp.
+        """
+        os.makedirs(directory, exist_ok=True)
+        types = {'event_moment': 'timestamp', **(types or {})}
+        if self.file_format == 'parquet':
+            body = self._parquet_bytes(columns, types)
+            path = os.path.join(directory, f'{name}.parquet')
+        else:
+            names = list(columns)
+            rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+            timestamps = [column for column in names if types.get(column) == 'timestamp']
+            for row in rows:
+                for column in timestamps:
+                    if isinstance(row[column], datetime):
+                        row[column] = row[column].isoformat(sep=' ')
+            body = self.serializer.dumps_ndjson(rows) + b'\n' if rows else b''
+            path = os.path.join(directory, f'{name}.ndjson')
+            if self.compression == 'gzip':
+                body = gzip.compress(body, compresslevel=1)
+                path += '.gz'
+        if replace:
+            # a format change leaves a differently named file behind
+            for other in os.listdir(directory):
+                if other.startswith(f'{name}.') and os.path.join(directory, other) != path:
+                    os.remove(os.path.join(directory, other))
+        _replace(path, body)
+        return len(body)
+
+
+    def _parquet_bytes(self, columns, types):
+        pa, pq = import_pyarrow("file_format='parquet'")
+        arrow_types = {'int': pa.int64(), 'float': pa.float64(), 'bool': pa.bool_()}
+        arrays = {}
+        for name, values in columns.items():
+            field_type = types.get(name)
+            if field_type == 'timestamp':
+                arrays[name] = pa.array([None if value is None else to_datetime(value) for value in values],
+                                        pa.timestamp('us', tz='UTC'))
+            else:
+                arrays[name] = pa.array(values, arrow_types.get(field_type, pa.string()))
+        sink = pa.BufferOutputStream()
+        pq.write_table(pa.table(arrays), sink, compression=self.compression)
+        return sink.getvalue().to_pybytes()
+
+
+    def _read(self, path, names):
+        """Return {name: list of values} of a file written by _write"""
+        if path.endswith('.parquet'):
+            pa, pq = import_pyarrow("file_format='parquet'")
+            return pq.read_table(path, columns=list(names)).to_pydict()
+        columns = {name: [] for name in names}
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                row = self.serializer.loads(line)
+                for name in names:
+                    columns[name].append(row[name])
+        return columns
+
+
+    def delete_tables(self, full_delete = True):
+        try:
+            names = os.listdir(self._directory)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if name[:3] in ('brv', 'brl') or (name[:3] == 'brs' and full_delete):
+                path = os.path.join(self._directory, name)
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+        if full_delete:
+            self.tables_created = False
+
+
+    def run_sql(self, query):
+        """Raise ValueError: LocalFiles has no SQL engine.
+
+        Query the files with a tool that reads Parquet or NDJSON instead.
+        """
+        raise ValueError(
+            "LocalFiles cannot run SQL, query the files under directory with a tool that reads "
+            f"{self.file_format} instead")
+
+
+def _extract(document, path):
+    for key in path:
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def _cast(value, field_type):
+    # what the ClickHouse and BigQuery views extract: null when the value does not fit
+    if value is None:
+        return None
+    if field_type == 'json':
+        return json.dumps(value)
+    if isinstance(value, (dict, list)):
+        return None
+    if field_type is None or field_type == 'string':
+        # scalars as text, like JSON_VALUE
+        return value if isinstance(value, str) else json.dumps(value)
+    try:
+        if field_type == 'bool':
+            if isinstance(value, bool):
+                return value
+            return {'true': True, 'false': False}.get(str(value).lower())
+        if isinstance(value, bool):
+            return None
+        if field_type == 'int':
+            value = value if isinstance(value, int) else int(value)
+            return value if -2 ** 63 <= value < 2 ** 63 else None
+        if field_type == 'float':
+            return float(value)
+        if field_type == 'timestamp':
+            return to_datetime(value) if isinstance(value, str) else None
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return None
+
+
+def _replace(path, body):
+    # readers never see a half-written file
+    temp = f'{path}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with open(temp, 'wb') as f:
+        f.write(body)
+    os.replace(temp, path)
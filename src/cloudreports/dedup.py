@@ -0,0 +1,129 @@
+"""Drop superseded and unchanged rows from a buffer before it is sent."""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from cloudreports.buffer import ColumnBuffer, to_datetime, utf8_len
+
+
+class Deduplicator(object):
+    """Define Deduplicator.
+
+    Rows are of the same entity when they share (entity_type, entity_href),
+    the key the views use, so entity types sharing an href are kept apart.
+
+    mode:
+    latest - keep one row per entity, the one with the greatest
+        event_moment (the later row on ties). Superseded versions never
+        reach brs_audit, so they are lost to its history.
+    content - drop a row when its event_type and entity_data hash the same
+        as the last row kept for its entity. The last hash per entity is
+        remembered across flushes in an LRU cache of cache_size entities, so a source re-sending unchanged entities costs
+        nothing, while a change back to an earlier state is still kept.
+        The hashes of a buffer are only remembered once commit() is called
+        after it loaded, so rows of a failed load are not dropped on retry.
+
+    stats counts rows_in, rows_out, rows_saved and bytes_saved.
+    """
+
+    MODES = ('latest', 'content')
+
+    def __init__(self, mode='content', cache_size=100000, intern_strings=True):
+        if mode not in self.MODES:
+            raise ValueError(f"Pass one of {self.MODES} for mode")
+        if not isinstance(cache_size, int) or cache_size < 0:
+            raise ValueError("Pass a non-negative int for cache_size")
+        self.mode = mode
+        self.cache_size = cache_size
+        self._intern = intern_strings
+        # (entity_type, entity_href) -> digest of the last row loaded
+        self._hashes = OrderedDict()
+        # the flush worker commits while the next buffer is collapsed
+        self._lock = threading.Lock()
+        self.stats = {'rows_in': 0, 'rows_out': 0, 'rows_saved': 0, 'bytes_saved': 0}
+
+
+    def collapse(self, data):
+        """Return (buffer without the dropped rows, bytes saved, digests).
+
+        digests is {(entity_type, entity_href): digest} of the rows kept in content mode, to
+        pass to commit() once the buffer loaded, and None in latest mode.
+        """
+        digests = None
+        if self.mode == 'latest':
+            keep = self._latest(data)
+        else:
+            keep, digests = self._changed(data)
+
+        rows_in = len(data)
+        self.stats['rows_in'] += rows_in
+        self.stats['rows_out'] += len(keep)
+        if len(keep) == rows_in:
+            return data, 0, digests
+
+        result = ColumnBuffer(self._intern)
+        kept = set(keep)
+        saved_bytes = 0
+        for i, row in enumerate(zip(data.entity_href, data.entity_id, data.entity_type,
+                                    data.entity_data, data.event_moment, data.event_type)):
+            if i in kept:
+                result.append(*row)
+            else:
+                saved_bytes += sum(map(utf8_len, row))
+        self.stats['rows_saved'] += rows_in - len(keep)
+        self.stats['bytes_saved'] += saved_bytes
+        return result, saved_bytes, digests
+
+
+    def commit(self, digests):
+        """Remember the digests collapse() returned for a buffer that loaded"""
+        if not self.cache_size:
+            return
+        with self._lock:
+            hashes = self._hashes
+            for key, digest in digests.items():
+                hashes[key] = digest
+                hashes.move_to_end(key)
+            while len(hashes) > self.cache_size:
+                hashes.popitem(last=False)
+
+
+    def clear(self):
+        """Forget the hashes of rows sent so far"""
+        with self._lock:
+            self._hashes.clear()
+
+
+    def _latest(self, data):
+        moments = data.event_moment
+        latest = {}
+        for i, (key, event_moment) in enumerate(zip(zip(data.entity_type, data.entity_href), moments)):
+            j = latest.get(key)
+            # parse only when the strings differ
+            if j is not None and event_moment != moments[j] and to_datetime(event_moment) < to_datetime(moments[j]):
+                continue
+            latest[key] = i
+        return sorted(latest.values())
+
+
+    def _changed(self, data):
+        hashes = self._hashes
+        # digests of rows kept from this buffer, ahead of the loaded ones
+        digests = {}
+        keep = []
+        with self._lock:
+            for i, row in enumerate(zip(data.entity_type, data.entity_href, data.event_type, data.entity_data)):
+                key = row[:2]
+                digest = hashlib.blake2b('\0'.join(row[2:]).encode('utf-8'), digest_size=16).digest()
+                last = digests.get(key)
+                if last is None:
+                    last = hashes.get(key)
+                    if last == digest:
+                        hashes.move_to_end(key)
+                        continue
+                elif last == digest:
+                    continue
+                keep.append(i)
+                digests[key] = digest
+        return keep, digests
@@ -1,23 +1,114 @@
 import json
 import hashlib
+import hmac
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 """Hashing personal data."""
 
 
 def delete_personal_data(entity_response, fields):
-    """Delete personal data from entity_response dictionary."""
-    for field in fields:
-        field_value = entity_response.get(field) 
-        if field_value is not None:
-            if type(field_value) is str:
-                entity_response[field] = sha256_hash(field_value)
-            else: 
-                entity_response[field] = ''
+    """Delete personal data from entity_response dictionary.
 
-    return entity_response 
+    fields may be nested paths like 'customer.email'.
+    """
+    _hash_fields(entity_response, _compile_fields(fields), sha256_hash)
+    return entity_response
+
+
+def delete_personal_data_batch(entity_responses, fields, key=None, cache_size=100000, processes=None,
+                               chunk_size=10000):
+    """Delete personal data from a list of entity_response dictionaries.
+
+    Repeated values are hashed once thanks to a bounded LRU cache of
+    cache_size entries. With key (str or bytes) values are hashed with
+    HMAC-SHA256, so hashes cannot be reversed by hashing known values.
+    processes > 1 hashes chunks of chunk_size records in a process pool.
+    Records are changed in place, also when hashed in the pool, and
+    returned.
+    """
+    entity_responses = list(entity_responses)
+    if processes is None or processes <= 1 or len(entity_responses) <= chunk_size:
+        return _delete_personal_data_chunk(entity_responses, fields, key, cache_size)
+
+    chunks = [entity_responses[i:i + chunk_size] for i in range(0, len(entity_responses), chunk_size)]
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for records, hashed in zip(chunks, pool.map(_delete_personal_data_chunk, chunks, [fields] * len(chunks),
+                                                    [key] * len(chunks), [cache_size] * len(chunks))):
+            # the pool returns pickled copies, the callers' records must not keep plaintext
+            for record, copy in zip(records, hashed):
+                record.clear()
+                record.update(copy)
+    return entity_responses
 
 
 def sha256_hash(text: str) -> str:
     """Hashes a string using SHA-256 and returns the hex representation."""
     return hashlib.sha256(text.encode('utf-8')).hexdigest()
 
+
+def hmac_sha256_hash(text: str, key) -> str:
+    """Hashes a string using HMAC-SHA256 with key and returns the hex representation."""
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    return hmac.new(key, text.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _make_hasher(key=None, cache_size=100000):
+    if key is None:
+        hash_value = sha256_hash
+    else:
+        if isinstance(key, str):
+            key = key.encode('utf-8')
+        keyed = hmac.new(key, digestmod=hashlib.sha256)
+
+        def hash_value(text):
+            h = keyed.copy()
+            h.update(text.encode('utf-8'))
+            return h.hexdigest()
+
+    if cache_size:
+        hash_value = lru_cache(maxsize=cache_size)(hash_value)
+    return hash_value
+
+
+def _delete_personal_data_chunk(entity_responses, fields, key, cache_size):
+    hash_value = _make_hasher(key, cache_size)
+    fields = _compile_fields(fields)
+    for entity_response in entity_responses:
+        _hash_fields(entity_response, fields, hash_value)
+    return entity_responses
+
+
+def _compile_fields(fields):
+    return [(field, field.split('.')) for field in fields]
+
+
+def _hash_fields(entity_response, fields, hash_value):
+    for field, path in fields:
+        # an exact top-level key wins, so keys containing dots keep working
+        if field in entity_response:
+            _hash_key(entity_response, field, hash_value)
+        else:
+            _hash_path(entity_response, path, hash_value)
+
+
+def _hash_path(node, path, hash_value):
+    if isinstance(node, list):
+        for item in node:
+            _hash_path(item, path, hash_value)
+    elif isinstance(node, dict):
+        if len(path) == 1:
+            if path[0] in node:
+                _hash_key(node, path[0], hash_value)
+        elif path[0] in node:
+            _hash_path(node[path[0]], path[1:], hash_value)
+
+
+def _hash_key(node, key, hash_value):
+    field_value = node.get(key)
+    if field_value is not None:
+        if type(field_value) is str:
+            node[key] = hash_value(field_value)
+        else:
+            node[key] = ''
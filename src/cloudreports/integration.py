@@ -0,0 +1,125 @@
+"""HTTP access to the CloudReports integration API."""
+
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def make_session(retries=3, backoff_factor=0.5, pool_maxsize=4):
+    """Return a requests.Session that keeps connections open and retries.
+
+    GET and PUT are idempotent here, so both are retried on connection
+    errors, 429 and 5xx with exponential backoff (backoff_factor * 2 ** n
+    seconds), honouring Retry-After.
+    """
+    retry = Retry(total=retries, connect=retries, read=retries, status=retries,
+                  backoff_factor=backoff_factor, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=frozenset(['GET', 'PUT']), raise_on_status=False,
+                  respect_retry_after_header=True)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=pool_maxsize)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class ProgressReporter(object):
+    """Define ProgressReporter.
+
+    update() only merges fields into the pending report and returns at once.
+    A background thread calls send(**fields) with the merged fields at most
+    once per interval seconds, so frequent updates (for example after every
+    flush) cost one PUT per interval instead of one per call. flush() sends
+    the pending report right away, close() sends it and stops the thread.
+    Errors from send are kept in last_error and do
+    not stop loading.
+    """
+
+    def __init__(self, send, interval=5.0):
+        if not callable(send):
+            raise ValueError("Pass a callable for send")
+        if not isinstance(interval, (int, float)) or interval < 0:
+            raise ValueError("Pass a non-negative number for interval")
+        self.send = send
+        self.interval = interval
+        self.sent = 0
+        self.last_error = None
+        self._pending = {}
+        self._last_sent = None
+        self._closed = False
+        self._condition = threading.Condition()
+        # held while a report is taken and sent, so reports go out in order
+        self._send_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='cloudreports-progress', daemon=True)
+        self._thread.start()
+
+
+    def update(self, **fields):
+        """Merge fields into the next report; later values win"""
+        with self._condition:
+            if self._closed:
+                raise ValueError("ProgressReporter is closed")
+            self._pending.update(fields)
+            self._condition.notify()
+
+
+    def flush(self):
+        """Send the pending report now, in the calling thread"""
+        with self._send_lock:
+            with self._condition:
+                fields = self._pending
+                self._pending = {}
+            if fields:
+                self._send(fields)
+
+
+    def close(self, timeout=None):
+        """Send the pending report and stop the thread"""
+        with self._condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                # wait out the rest of the interval, unless closing
+                while not self._closed and self._last_sent is not None:
+                    remaining = self._last_sent + self.interval - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            with self._send_lock:
+                with self._condition:
+                    # flush() may have sent it meanwhile
+                    fields = self._pending
+                    self._pending = {}
+                    closed = self._closed
+                if fields:
+                    self._send(fields)
+            if closed:
+                return
+
+
+    def _send(self, fields):
+        self._last_sent = time.monotonic()
+        try:
+            self.send(**fields)
+            self.sent += 1
+        except Exception as e:
+            self.last_error = e
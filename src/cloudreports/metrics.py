@@ -0,0 +1,164 @@
+"""Timers and counters for the stages of a load."""
+
+import threading
+import time
+
+
+class Metrics(object):
+    """Define Metrics.
+
+    Collects timers (count, total and max seconds per stage) and counters,
+    for example:
+
+        metrics = Metrics()
+        client = Client(database, metrics=metrics)
+        ...
+        metrics.snapshot()['timers']['clickhouse.insert_audit']
+
+    Observers are called as observer(kind, name, value) for every timing
+    ('timer', seconds) and count ('counter', increment), after the metric
+    is recorded. Client, ClickHouse and BigQuery use NULL_METRICS when no
+    Metrics is passed, so uninstrumented loads only pay for no-op calls.
+    """
+
+    enabled = True
+
+    def __init__(self, observers=None):
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self._observers = list(observers or [])
+
+
+    def add_observer(self, observer):
+        """Call observer(kind, name, value) for every recorded metric"""
+        if not callable(observer):
+            raise ValueError("Pass a callable for observer")
+        self._observers.append(observer)
+
+
+    def remove_observer(self, observer):
+        self._observers.remove(observer)
+
+
+    def timer(self, name):
+        """Return a context manager that records the time spent in its block as name"""
+        return _Timer(self, name)
+
+
+    def observe(self, name, seconds):
+        """Record seconds spent in stage name"""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                self._timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+        for observer in self._observers:
+            observer('timer', name, seconds)
+
+
+    def count(self, name, value=1):
+        """Add value to counter name"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+        for observer in self._observers:
+            observer('counter', name, value)
+
+
+    def snapshot(self):
+        """Return {'timers': {name: {'count', 'total', 'max'}}, 'counters': {name: value}}"""
+        with self._lock:
+            return {
+                'timers': {name: {'count': count, 'total': total, 'max': maximum}
+                           for name, (count, total, maximum) in self._timers.items()},
+                'counters': dict(self._counters),
+            }
+
+
+    def reset(self):
+        with self._lock:
+            self._timers = {}
+            self._counters = {}
+
+
+    def to_prometheus(self, prefix='cloudreports'):
+        """Return the metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = [f'# HELP {prefix}_stage_seconds Time spent in a load stage.',
+                 f'# TYPE {prefix}_stage_seconds summary']
+        for name, timer in sorted(snapshot['timers'].items()):
+            label = _label(name)
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{label}"}} {timer["total"]!r}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{label}"}} {timer["count"]}')
+        lines += [f'# HELP {prefix}_stage_seconds_max Longest single run of a load stage.',
+                  f'# TYPE {prefix}_stage_seconds_max gauge']
+        for name, timer in sorted(snapshot['timers'].items()):
+            lines.append(f'{prefix}_stage_seconds_max{{stage="{_label(name)}"}} {timer["max"]!r}')
+        lines += [f'# HELP {prefix}_events_total Rows, bytes, batches and calls counted during loads.',
+                  f'# TYPE {prefix}_events_total counter']
+        for name, value in sorted(snapshot['counters'].items()):
+            lines.append(f'{prefix}_events_total{{name="{_label(name)}"}} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class _NullMetrics(object):
+    """Metrics that record nothing, used when instrumentation is off"""
+
+    enabled = False
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+
+    def observe(self, name, seconds):
+        pass
+
+
+    def count(self, name, value=1):
+        pass
+
+
+    def snapshot(self):
+        return {'timers': {}, 'counters': {}}
+
+
+class _Timer(object):
+
+    __slots__ = ('_metrics', '_name', '_start')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self._name = name
+
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.observe(self._name, time.perf_counter() - self._start)
+
+
+class _NullTimer(object):
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NULL_TIMER = _NullTimer()
+NULL_METRICS = _NullMetrics()
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
@@ -0,0 +1,81 @@
+"""Read ahead from slow iterables, such as paginated API clients."""
+
+import asyncio
+import queue
+import threading
+
+_DONE = object()
+
+
+def prefetch(iterable, size=2):
+    """Yield the items of iterable, pulling up to size items ahead in a thread.
+
+    Fetching the next page overlaps with the consumer's work on the current
+    one, while memory stays bounded by size items. An exception raised by
+    iterable is re-raised in the consumer; closing the generator early stops
+    the thread after its current item.
+    """
+    if not isinstance(size, int) or size < 1:
+        raise ValueError("Pass a positive int for size")
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put((item, None)):
+                    return
+        except Exception as e:
+            put((_DONE, e))
+            return
+        put((_DONE, None))
+
+    thread = threading.Thread(target=produce, name='cloudreports-prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
+async def aprefetch(aiterable, size=2):
+    """Async version of prefetch for async iterables, reading ahead in a task"""
+    if not isinstance(size, int) or size < 1:
+        raise ValueError("Pass a positive int for size")
+    items = asyncio.Queue(maxsize=size)
+
+    async def produce():
+        try:
+            async for item in aiterable:
+                await items.put((item, None))
+        except Exception as e:
+            await items.put((_DONE, e))
+            return
+        await items.put((_DONE, None))
+
+    task = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item, error = await items.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        task.cancel()
@@ -0,0 +1,117 @@
+"""Infer the fields and scalar types of entity_data documents.
+
+A field is a path of keys joined with '.', e.g. 'address.city' for a key
+of a nested object. Its type is one of TYPES, or None when unknown (the
+legacy registry had no types, and a null value tells nothing); views
+extract fields of unknown type as strings, as they always did.
+"""
+
+import re
+
+TYPES = ('bool', 'int', 'float', 'timestamp', 'string', 'json')
+
+_TIMESTAMP = re.compile(r'\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,9})?(Z|[+-]\d{2}:?\d{2})?$')
+# columns of every brv_* view, which fields must not shadow
+VIEW_BASE_COLUMNS = ('entity_href', 'entity_id', 'event_moment')
+_INT64 = 2 ** 63
+_MISSING = object()
+_SCALAR_TYPES = {bool: 'bool', float: 'float', type(None): None}
+
+
+def value_type(value):
+    """Return the type of a JSON value"""
+    kind = type(value)
+    if kind is str:
+        # cheap checks first, most strings are not timestamps
+        if 19 <= len(value) <= 35 and value[4] == '-' and _TIMESTAMP.match(value):
+            return 'timestamp'
+        return 'string'
+    if kind is int:
+        # larger ints do not fit INT64 columns
+        return 'int' if -_INT64 <= value < _INT64 else 'string'
+    if kind in _SCALAR_TYPES:
+        return _SCALAR_TYPES[kind]
+    return 'json'
+
+
+def infer_fields(document, depth=1, types=True):
+    """Return {field: type} of a document.
+
+    Objects are flattened into their keys down to depth levels (1: top-level
+    keys only); deeper objects, arrays and objects with '.' in a key are
+    fields of type 'json'. types=False leaves every type None.
+    """
+    fields = {}
+    _flatten(document, '', depth, types, fields)
+    return fields
+
+
+def _flatten(document, prefix, depth, types, fields):
+    for key, value in document.items():
+        field = prefix + str(key) if prefix else key
+        if depth > 1 and type(value) is dict and value and not any('.' in str(name) for name in value):
+            _flatten(value, f'{field}.', depth - 1, types, fields)
+        else:
+            fields[field] = value_type(value) if types else None
+
+
+def merge_types(a, b):
+    """Return the narrowest type holding values of types a and b"""
+    if a is None or a == b:
+        return b
+    if b is None:
+        return a
+    if {a, b} == {'int', 'float'}:
+        return 'float'
+    if 'json' in (a, b):
+        return 'json'
+    return 'string'
+
+
+def merge_fields(fields, new_fields):
+    """Widen {field: type} fields in place by new_fields; return {field: type} of the changes"""
+    changed = {}
+    for field, field_type in new_fields.items():
+        current = fields.get(field, _MISSING)
+        if current == field_type:
+            continue
+        if current is not _MISSING:
+            merged = merge_types(current, field_type)
+            if merged == current:
+                continue
+        else:
+            merged = field_type
+        fields[field] = merged
+        changed[field] = merged
+    return changed
+
+
+def typed_fields(names):
+    """Return {field: type} for a {field: type} dict or an iterable of fields of unknown type"""
+    if isinstance(names, dict):
+        return names
+    return dict.fromkeys(names)
+
+
+def split_field(field):
+    """Return the keys of a field path"""
+    return field.split('.')
+
+
+def view_column(field):
+    """Return the brv_* column of a field, the same for every backend.
+
+    '.' becomes '__', as BigQuery names cannot contain it, and fields named
+    like a VIEW_BASE_COLUMNS column get an entity_ prefix, as entity_id
+    always did (entity_entity_id).
+    """
+    if field in VIEW_BASE_COLUMNS:
+        return f'entity_{field}'
+    return field.replace('.', '__')
+
+
+def view_field(column):
+    """Return the field of a brv_* column, the inverse of view_column"""
+    if column.startswith('entity_') and column[len('entity_'):] in VIEW_BASE_COLUMNS:
+        return column[len('entity_'):]
+    return column.replace('__', '.')
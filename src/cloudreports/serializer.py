@@ -0,0 +1,151 @@
+"""JSON serializers for entity_data."""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def _fallback_dumps(obj):
+    # compact and unescaped like orjson, for what orjson and ujson reject
+    return json.dumps(obj, separators=(',', ':'), ensure_ascii=False)
+
+
+class JsonSerializer(object):
+    """Define JsonSerializer.
+
+    Standard library json, always available.
+    """
+
+    name = 'json'
+
+    def dumps(self, obj):
+        return json.dumps(obj)
+
+
+    def dumps_bytes(self, obj):
+        return self.dumps(obj).encode('utf-8')
+
+
+    def dumps_many(self, objs):
+        """Serialize a whole batch of objects to a list of strings"""
+        dumps = self.dumps
+        return [dumps(obj) for obj in objs]
+
+
+    def dumps_ndjson(self, rows):
+        """Serialize rows to newline-delimited JSON bytes"""
+        return '\n'.join(self.dumps_many(rows)).encode('utf-8')
+
+
+    def loads(self, s):
+        return json.loads(s)
+
+
+class OrjsonSerializer(JsonSerializer):
+    """Define OrjsonSerializer.
+
+    See
+    https://github.com/ijl/orjson
+    """
+
+    name = 'orjson'
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is not installed")
+        self._option = orjson.OPT_NON_STR_KEYS
+
+
+    def dumps(self, obj):
+        return self.dumps_bytes(obj).decode('utf-8')
+
+
+    def dumps_bytes(self, obj):
+        try:
+            return orjson.dumps(obj, option=self._option)
+        except TypeError:
+            # ints wider than 64 bits, which stdlib json writes as they are
+            return _fallback_dumps(obj).encode('utf-8')
+
+
+    def dumps_many(self, objs):
+        dumps = orjson.dumps
+        option = self._option
+        try:
+            return [dumps(obj, option=option).decode('utf-8') for obj in objs]
+        except TypeError:
+            # redo the batch object by object, falling back only where needed
+            return [self.dumps(obj) for obj in objs]
+
+
+    def dumps_ndjson(self, rows):
+        dumps = orjson.dumps
+        option = self._option
+        try:
+            return b'\n'.join([dumps(row, option=option) for row in rows])
+        except TypeError:
+            return b'\n'.join([self.dumps_bytes(row) for row in rows])
+
+
+    def loads(self, s):
+        return orjson.loads(s)
+
+
+class UjsonSerializer(JsonSerializer):
+    """Define UjsonSerializer.
+
+    See
+    https://github.com/ultrajson/ultrajson
+    """
+
+    name = 'ujson'
+
+    def __init__(self):
+        if ujson is None:
+            raise ImportError("ujson is not installed")
+
+
+    def dumps(self, obj):
+        try:
+            return ujson.dumps(obj)
+        except OverflowError:
+            # ints wider than 64 bits, which stdlib json writes as they are
+            return _fallback_dumps(obj)
+
+
+    def loads(self, s):
+        return ujson.loads(s)
+
+
+SERIALIZERS = {
+    'orjson': OrjsonSerializer,
+    'ujson': UjsonSerializer,
+    'json': JsonSerializer,
+}
+
+
+def get_serializer(serializer=None):
+    """Return a serializer instance.
+
+    serializer may be None (fastest installed), a name from SERIALIZERS
+    or an object with the JsonSerializer interface.
+    """
+    if serializer is None:
+        if orjson is not None:
+            return OrjsonSerializer()
+        if ujson is not None:
+            return UjsonSerializer()
+        return JsonSerializer()
+    if isinstance(serializer, str):
+        if serializer not in SERIALIZERS:
+            raise ValueError(f"Unknown serializer {serializer}, pass one of {list(SERIALIZERS)}")
+        return SERIALIZERS[serializer]()
+    return serializer
@@ -0,0 +1,173 @@
+"""Append-only on-disk spool for rows waiting to be sent to the database."""
+
+import gzip
+import os
+import threading
+import zlib
+
+from cloudreports.buffer import ColumnBuffer
+from cloudreports.serializer import get_serializer
+
+
+class Spool(object):
+    """Define Spool.
+
+    Every buffered row is appended as one JSON line to the current segment
+    file in directory. When Client flushes a buffer it seals the segments
+    holding those rows and deletes them once the database accepted the batch,
+    so the files left in directory are exactly the rows not yet loaded.
+    Client replays them on startup (at-least-once: a crash between the load
+    and the acknowledgement replays that batch again).
+
+    flush_every - rows between writes to the OS (1 survives a process crash)
+    fsync_every - rows between fsyncs (None: only when a segment is sealed)
+    segment_bytes - start a new segment after this many bytes
+    compress - gzip segments; raise flush_every, each flush ends a deflate block
+    """
+
+    def __init__(self, directory, flush_every=1, fsync_every=None, segment_bytes=64 * 1024 * 1024,
+                 compress=False, serializer=None):
+        if not isinstance(directory, str):
+            raise ValueError("Pass a string for directory")
+        if not isinstance(flush_every, int) or flush_every < 1:
+            raise ValueError("Pass a positive int for flush_every")
+        if fsync_every is not None and (not isinstance(fsync_every, int) or fsync_every < 1):
+            raise ValueError("Pass a positive int for fsync_every")
+
+        self.directory = directory
+        self.flush_every = flush_every
+        self.fsync_every = fsync_every
+        self.segment_bytes = segment_bytes
+        self.compress = compress
+        self.serializer = get_serializer(serializer)
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._raw = None
+        self._path = None
+        self._bytes = 0
+        self._unflushed = 0
+        self._unsynced = 0
+        # segments written since the last seal()
+        self._open_segments = []
+        pending = self.pending()
+        self._seq = self._segment_seq(pending[-1]) + 1 if pending else 0
+
+
+    def pending(self):
+        """Return paths of segments not acknowledged yet, oldest first"""
+        names = [name for name in os.listdir(self.directory) if name.startswith('segment-')]
+        names.sort(key=self._segment_seq)
+        return [os.path.join(self.directory, name) for name in names]
+
+
+    def append(self, row):
+        """Append a (entity_href, entity_id, entity_type, entity_data, event_moment, event_type) row.
+
+        Returns the path of the segment the row went to.
+        """
+        line = self.serializer.dumps_bytes(row) + b'\n'
+        with self._lock:
+            if self._file is None:
+                self._open()
+            path = self._path
+            self._file.write(line)
+            self._bytes += len(line)
+            self._unflushed += 1
+            self._unsynced += 1
+            if self._unflushed >= self.flush_every:
+                self._flush()
+            if self.fsync_every is not None and self._unsynced >= self.fsync_every:
+                self._fsync()
+            if self._bytes >= self.segment_bytes:
+                self._close()
+            return path
+
+
+    def seal(self):
+        """Close the current segment and return the segments written since the last call"""
+        with self._lock:
+            if self._file is not None:
+                self._close()
+            segments = self._open_segments
+            self._open_segments = []
+            return segments
+
+
+    def unseal(self, segments):
+        """Return segments of a batch the database did not accept to the next seal()"""
+        with self._lock:
+            self._open_segments = list(segments) + self._open_segments
+
+
+    def ack(self, segments):
+        """Delete segments whose rows the database accepted"""
+        for path in segments:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._close()
+
+
+    def read(self, path, intern_strings=True):
+        """Return the rows of a segment as a ColumnBuffer.
+
+        A torn last line, left by a crash in the middle of a write, is skipped.
+        """
+        data = ColumnBuffer(intern_strings)
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            try:
+                for line in f:
+                    try:
+                        row = self.serializer.loads(line)
+                    except ValueError:
+                        break
+                    data.append(*row)
+            except (EOFError, zlib.error):
+                pass
+        return data
+
+
+    def _open(self):
+        suffix = '.ndjson.gz' if self.compress else '.ndjson'
+        self._path = os.path.join(self.directory, f'segment-{self._seq:010d}{suffix}')
+        self._seq += 1
+        self._raw = open(self._path, 'ab')
+        self._file = gzip.GzipFile(fileobj=self._raw, mode='ab', compresslevel=1) if self.compress else self._raw
+        self._bytes = 0
+        self._open_segments.append(self._path)
+
+
+    def _flush(self):
+        if self.compress:
+            self._file.flush(zlib.Z_SYNC_FLUSH)
+        self._raw.flush()
+        self._unflushed = 0
+
+
+    def _fsync(self):
+        self._flush()
+        os.fsync(self._raw.fileno())
+        self._unsynced = 0
+
+
+    def _close(self):
+        self._fsync()
+        if self.compress:
+            self._file.close()
+        self._raw.close()
+        self._file = None
+        self._raw = None
+
+
+    @staticmethod
+    def _segment_seq(path):
+        return int(os.path.basename(path)[len('segment-'):].split('.')[0])
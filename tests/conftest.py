@@ -0,0 +1,42 @@
+"""Fixtures shared by the tests: a recording database and an integration API stub."""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tests.helpers import RecordingDatabase
+
+
+class _IntegrationHandler(BaseHTTPRequestHandler):
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.path, self.headers['Authorization'], json.loads(body)))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.end_headers()
+        self.wfile.write(b'{"result": "ok"}')
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def database():
+    return RecordingDatabase()
+
+
+@pytest.fixture
+def integration_api():
+    """Serve the integration API on localhost; requests holds (path, Authorization, body) of each PUT"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _IntegrationHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = f'http://127.0.0.1:{server.server_address[1]}/integrations'
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,162 @@
+"""Helpers shared by the tests: recording databases and clients, and row builders."""
+
+import threading
+import time
+
+import fakes
+from cloudreports.buffer import COLUMNS
+
+MOMENT = '2024-01-01 00:00:00'
+
+
+class LoadError(Exception):
+    """Raised by RecordingDatabase for a failing load"""
+
+
+class RecordingDatabase(object):
+    """Define RecordingDatabase.
+
+    Keeps the rows of every batch, the fields registered and the threads
+    that loaded, in the order Client sent them. The next failures loads
+    raise LoadError.
+    """
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.batches = []
+        self.fields = {}
+        self.calls = []
+        self.threads = []
+        self._lock = threading.Lock()
+
+
+    def update_schema(self, fields):
+        with self._lock:
+            self.calls.append('update_schema')
+            for entity_type, names in fields.items():
+                self.fields.setdefault(entity_type, {}).update(names)
+
+
+    def load_json_data(self, data):
+        with self._lock:
+            self.calls.append('load_json_data')
+            self.threads.append(threading.current_thread().name)
+            if self.failures:
+                self.failures -= 1
+                raise LoadError("load failed")
+            self.batches.append(list(zip(*(getattr(data, name) for name in COLUMNS))))
+
+
+    @property
+    def rows(self):
+        return [row for batch in self.batches for row in batch]
+
+
+    @property
+    def hrefs(self):
+        return [row[0] for row in self.rows]
+
+
+def load(client, *hrefs, entity_type='order', entity_data=None):
+    """Send one row per href through client.load_json_data"""
+    for href in hrefs:
+        client.load_json_data(href, href, entity_type, entity_data or {'href': href}, MOMENT, 'update')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class RecordingClickHouseClient(fakes.FakeClickHouseClient):
+    """FakeClickHouseClient that keeps every query, whitespace collapsed.
+
+    A query containing a key of responses returns its rows.
+    """
+
+    def __init__(self, responses=None):
+        super().__init__()
+        self.queries = []
+        self.responses = dict(responses or {})
+
+
+    def execute(self, query, params=None, **kwargs):
+        query = ' '.join(query.split())
+        self.queries.append(query)
+        for text, rows in self.responses.items():
+            if text in query:
+                return rows
+        return super().execute(query, params, **kwargs)
+
+
+    def find(self, text):
+        """Return the queries containing text"""
+        return [query for query in self.queries if text in query]
+
+
+class RecordingBigQueryClient(fakes.FakeBigQueryClient):
+    """FakeBigQueryClient that keeps every query, load job and deleted table.
+
+    A query containing a key of responses returns its rows, one containing
+    a key of errors raises its exception, a load into a table named in
+    fail_loads raises LoadError. get_table of a table named in tables adds
+    its API properties, e.g. {'numRows': '10'}.
+    """
+
+    def __init__(self, responses=None, fail_loads=(), errors=None, tables=None):
+        super().__init__()
+        self.tables = dict(tables or {})
+        self.queries = []
+        self.loads = []
+        self.deleted = []
+        self.responses = dict(responses or {})
+        self.fail_loads = set(fail_loads)
+        self.errors = dict(errors or {})
+
+
+    def query(self, query, job_config=None, **kwargs):
+        query = ' '.join(query.split())
+        self.queries.append(query)
+        for text, error in self.errors.items():
+            if text in query:
+                raise error
+        for text, rows in self.responses.items():
+            if text in query:
+                return _Job(rows)
+        return super().query(query, job_config, **kwargs)
+
+
+    def load_table_from_file(self, file_obj, destination, size=None, job_config=None, **kwargs):
+        if destination.table_id in self.fail_loads:
+            raise LoadError(f"load into {destination.table_id} failed")
+        self.loads.append((destination.table_id, job_config))
+        return super().load_table_from_file(file_obj, destination, size, job_config, **kwargs)
+
+
+    def get_table(self, table):
+        table = super().get_table(table)
+        table._properties.update(self.tables.get(table.table_id, {}))
+        return table
+
+
+    def delete_table(self, table, not_found_ok=False, **kwargs):
+        self.deleted.append(getattr(table, 'table_id', table))
+        return super().delete_table(table, not_found_ok, **kwargs)
+
+
+    def find(self, text):
+        """Return the queries containing text"""
+        return [query for query in self.queries if text in query]
+
+
+class _Job(object):
+
+    def __init__(self, rows):
+        self._rows = rows
+
+
+    def result(self):
+        return self._rows
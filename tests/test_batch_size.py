@@ -0,0 +1,69 @@
+from cloudreports.client import Client, _AdaptiveBatchSize
+from tests.helpers import load
+
+
+def test_buffer_bytes_counts_utf8(database):
+    client = Client(database, buffer_bytes=10 ** 6)
+    client.load_json_data('h', '1', 't', 'é', 'm', 'u')
+    # '"é"' is 4 bytes in UTF-8
+    assert client._data_bytes == 9
+
+
+def test_buffer_bytes_flushes_before_buffer_size(database):
+    client = Client(database, buffer_bytes=100)
+    load(client, *(str(i) for i in range(10)))
+
+    assert database.batches
+    assert all(len(batch) < 10 for batch in database.batches)
+
+
+def test_tuner_grows_while_throughput_improves():
+    tuner = _AdaptiveBatchSize(1000, 100, 100000)
+    assert tuner.update(1000, 1.0) == 1500
+    assert tuner.update(1500, 1.0) == 2250
+    assert not tuner.settled
+
+
+def test_tuner_settles_within_tolerance():
+    tuner = _AdaptiveBatchSize(1000, 100, 100000)
+    assert tuner.update(1000, 1.0) == 1500
+    # the same rows per second: the smaller size is kept for good
+    assert tuner.update(1500, 1.5) == 1000
+    assert tuner.settled
+    assert tuner.update(1000, 0.1) == 1000
+
+
+def test_tuner_settles_on_better_size_after_second_drop():
+    tuner = _AdaptiveBatchSize(1000, 100, 100000)
+    assert tuner.update(1000, 1.0) == 1500
+    assert tuner.update(1500, 3.0) == 1000
+    assert tuner.update(1000, 1.0) == 666
+    assert tuner.update(666, 2.0) == 1000
+    assert tuner.settled
+
+
+def test_tuner_is_capped_by_buffer_bytes():
+    tuner = _AdaptiveBatchSize(1000, 10, 100000, max_bytes=100000)
+    # 2 kB rows: 50 fit in the byte budget
+    assert tuner.update(50, 1.0, data_bytes=100000) == 50
+    assert tuner.settled
+
+
+def test_tuner_ignores_partial_batches():
+    tuner = _AdaptiveBatchSize(1000, 100, 100000)
+    assert tuner.update(10, 1.0) == 1000
+    assert tuner._last_throughput is None
+
+
+def test_client_starts_at_clamped_size(database):
+    client = Client(database, buffer_size=10, adaptive_batch=True, min_buffer_size=100)
+    assert client._buffer_size == 100
+
+
+def test_tuner_sees_batch_before_dedup(database):
+    client = Client(database, buffer_size=100, adaptive_batch=True, dedup='latest')
+    # 101 rows of 2 entities collapse to 2 rows per batch
+    load(client, *(str(i % 2) for i in range(101)))
+
+    assert len(database.batches) == 1
+    assert client._buffer_size == 150
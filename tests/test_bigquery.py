@@ -0,0 +1,189 @@
+import pytest
+
+from cloudreports.client import Client
+from tests.helpers import LoadError, RecordingBigQueryClient, load
+
+pytest.importorskip('google.cloud.bigquery')
+from cloudreports.database.bigquery import BigQuery  # noqa: E402
+
+
+def make_bigquery(client=None, **options):
+    return BigQuery('project', 'dataset', client=client or RecordingBigQueryClient(), **options)
+
+
+def test_parquet_serializes_batch_once():
+    pytest.importorskip('pyarrow')
+    bq = make_bigquery(load_format='parquet')
+    client = Client(bq)
+    load(client, 'a', 'b')
+    client.flush()
+
+    assert bq.client.rows['brs_audit'] == 2
+    assert bq.client.rows['brs_audit_partition'] == 2
+    # the same Parquet file, brs_audit skips partition_entity_type
+    assert bq.client.bytes['brs_audit'] == bq.client.bytes['brs_audit_partition']
+    jobs = dict(bq.client.loads)
+    assert jobs['brs_audit'].ignore_unknown_values
+    assert not jobs['brs_audit_partition'].ignore_unknown_values
+    assert not bq.client.find('brs_audit_temp')
+    # created with its own columns, not by the first load with the extra ones
+    ddl = bq.client.find('CREATE TABLE IF NOT EXISTS `project.dataset.brs_audit` (')[0]
+    assert 'event_moment TIMESTAMP)' in ddl and 'partition_entity_type' not in ddl
+
+
+def test_parquet_partition_load_error_keeps_table():
+    pytest.importorskip('pyarrow')
+    bq = make_bigquery(RecordingBigQueryClient(fail_loads=['brs_audit_partition']), load_format='parquet')
+    client = Client(bq)
+    load(client, 'a')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    assert not bq.sandbox_mode
+    assert 'brs_audit_partition' not in bq.client.deleted
+
+
+def test_parquet_detects_sandbox_view():
+    pytest.importorskip('pyarrow')
+
+    class SandboxClient(RecordingBigQueryClient):
+
+        def get_table(self, table):
+            table = super().get_table(table)
+            if table.table_id == 'brs_audit_partition':
+                table._properties['type'] = 'VIEW'
+            return table
+
+    bq = make_bigquery(SandboxClient(), load_format='parquet')
+    client = Client(bq)
+    load(client, 'a')
+    client.flush()
+
+    assert bq.sandbox_mode
+    assert bq.client.rows['brs_audit'] == 1
+    assert 'brs_audit_partition' not in bq.client.rows
+
+
+def test_unknown_load_format():
+    with pytest.raises(ValueError):
+        make_bigquery(load_format='avro')
+
+
+def test_merge_latest_state_follows_load_time():
+    bq = make_bigquery(latest_state=True)
+    bq.update_schema({'order': {'href': None}})
+    bq.update_tables()
+
+    merge = bq.client.find('MERGE `project.dataset.brl_order`')[0]
+    assert 'SELECT MAX(load_moment)' in merge
+    assert 'load_moment > TIMESTAMP_SUB(watermark, INTERVAL 3600 SECOND)' in merge
+    assert bq.client.find('ADD COLUMN IF NOT EXISTS load_moment TIMESTAMP')
+
+
+def test_latest_state_off_keeps_tables_and_switches_views():
+    bq = make_bigquery(RecordingBigQueryClient({
+        'INFORMATION_SCHEMA.VIEWS': [{'table_name': 'brv_order'}],
+        'INFORMATION_SCHEMA.COLUMNS': [
+            {'table_name': 'brv_order', 'columns': [{'column_name': 'href', 'data_type': 'STRING'}]},
+            {'table_name': 'brl_order', 'columns': [{'column_name': 'entity_href', 'data_type': 'STRING'}]}],
+    }))
+    bq.update_schema({'order': {'href': None}})
+
+    assert bq.update_tables()['updated'] == ['brv_order']
+    assert 'brl_order' not in bq.client.deleted
+    assert not bq.client.find('MERGE')
+
+    bq.drop_latest_state('order')
+    assert 'brl_order' in bq.client.deleted
+
+
+def test_sync_error_is_raised_without_sandbox():
+    from google.api_core import exceptions
+
+    bq = make_bigquery(RecordingBigQueryClient(errors={'DECLARE watermark': exceptions.Forbidden('quota exceeded')}))
+    with pytest.raises(exceptions.Forbidden):
+        bq.update_tables()
+
+    assert not bq.sandbox_mode
+    assert 'brs_audit_partition' not in bq.client.deleted
+
+
+def test_sync_dml_error_switches_to_sandbox():
+    from google.api_core import exceptions
+
+    error = exceptions.Forbidden('Billing has not been enabled for this project. '
+                                 'DML queries are not allowed in the free tier.')
+    bq = make_bigquery(RecordingBigQueryClient(errors={'DECLARE watermark': error}))
+    bq.update_tables()
+
+    assert bq.sandbox_mode
+    assert 'brs_audit_partition' in bq.client.deleted
+
+
+def test_time_partition_clusters_by_bucket_first():
+    bq = make_bigquery(time_partition='day', cluster_by=('entity_type', 'entity_href', 'event_moment'))
+    bq.update_tables()
+
+    ddl = bq.client.find('CREATE TABLE IF NOT EXISTS `project.dataset.brs_audit_partition`')[0]
+    assert 'PARTITION BY TIMESTAMP_TRUNC(event_moment, DAY)' in ddl
+    assert 'CLUSTER BY partition_entity_type, entity_type, entity_href, event_moment' in ddl
+    assert bq.get_layout() == {'partition_buckets': 4000, 'time_partition': 'day',
+                               'cluster_by': ['partition_entity_type', 'entity_type', 'entity_href', 'event_moment']}
+
+
+def test_cluster_by_is_checked():
+    with pytest.raises(ValueError):
+        make_bigquery(cluster_by=('a', 'b', 'c', 'd', 'e'))
+    # partition_entity_type takes one of the 4 clustering columns
+    with pytest.raises(ValueError):
+        make_bigquery(time_partition='day', cluster_by=('a', 'b', 'c', 'd'))
+    make_bigquery(time_partition='day', cluster_by=('partition_entity_type', 'a', 'b', 'c'))
+
+
+def test_filled_table_without_layout_keeps_default_layout():
+    bq = make_bigquery(RecordingBigQueryClient(tables={'brs_audit_partition': {'numRows': '10'}}))
+    bq.update_tables()
+    assert bq.get_layout() == bq.LEGACY_LAYOUT == bq.partition_layout()
+
+
+def test_filled_table_without_layout_needs_migration():
+    bq = make_bigquery(RecordingBigQueryClient(tables={'brs_audit_partition': {'numRows': '10'}}),
+                       partition_buckets=64)
+    with pytest.raises(ValueError, match='migrate_partitioning'):
+        bq.update_tables()
+    assert bq.get_layout() == bq.LEGACY_LAYOUT
+
+    bq.migrate_partitioning()
+
+    migration = bq.client.find('CREATE TABLE `project.dataset.brs_audit_partition_shadow`')[0]
+    assert 'RANGE_BUCKET(partition_entity_type, GENERATE_ARRAY(0, 64, 1))' in migration
+    assert migration.index('DROP TABLE `project.dataset.brs_audit_partition`;') < migration.index(
+        'ALTER TABLE `project.dataset.brs_audit_partition_shadow` RENAME TO brs_audit_partition')
+    assert not bq.client.find('CREATE OR REPLACE TABLE')
+    assert bq.get_layout() == bq.partition_layout()
+    bq.update_tables()
+
+
+def test_migration_error_is_raised_without_sandbox():
+    from google.api_core import exceptions
+
+    error = exceptions.Forbidden('Billing has not been enabled for this project. '
+                                 'DML queries are not allowed in the free tier.')
+    bq = make_bigquery(RecordingBigQueryClient(errors={'brs_audit_partition_shadow': error}))
+    with pytest.raises(exceptions.Forbidden):
+        bq.migrate_partitioning()
+
+    assert not bq.sandbox_mode
+    assert 'brs_audit_partition' not in bq.client.deleted
+
+
+def test_registry_is_seeded_from_loaded_rows_once():
+    bq = make_bigquery()
+    bq.update_tables()
+    assert len(bq.client.find('ROW_NUMBER()')) == 1
+    assert 'brs_schema_discovery' in bq.client.watermarks
+
+    bq.update_tables()
+    assert len(bq.client.find('ROW_NUMBER()')) == 1
+    bq.update_tables(rediscover=True)
+    assert len(bq.client.find('ROW_NUMBER()')) == 2
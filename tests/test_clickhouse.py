@@ -0,0 +1,299 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from cloudreports.client import Client
+from tests.helpers import RecordingClickHouseClient, load
+
+clickhouse = pytest.importorskip('cloudreports.database.clickhouse')
+
+
+def make_clickhouse(**options):
+    return clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient(), **options)
+
+
+def test_temp_table_mode_copies_through_temp_table():
+    ch = make_clickhouse()
+    client = Client(ch)
+    load(client, 'a', 'b')
+    client.flush()
+
+    assert ch.client.rows['db.brs_audit'] == 2
+    assert ch.client.rows['db.brs_audit_temp'] == 2
+    assert ch.client.find('INSERT INTO db.brs_audit_partition SELECT')
+    assert ch.client.find('drop table if exists brs_audit_temp')
+
+
+def test_direct_mode_inserts_batch_without_temp_table():
+    ch = make_clickhouse(partition_mode='direct')
+    client = Client(ch)
+    load(client, 'a', 'b')
+    client.flush()
+
+    assert ch.client.rows['db.brs_audit'] == 2
+    assert ch.client.rows['db.brs_audit_partition'] == 2
+    assert not ch.client.find('brs_audit_temp')
+    assert not ch.client.find('CREATE MATERIALIZED VIEW')
+
+
+def test_materialized_view_mode_inserts_once():
+    ch = make_clickhouse(partition_mode='materialized_view')
+    client = Client(ch)
+    load(client, 'a', 'b')
+    client.flush()
+
+    assert ch.client.find('CREATE MATERIALIZED VIEW IF NOT EXISTS db.brs_audit_partition_mv TO db.brs_audit_partition')
+    # the layout row is the one brs_watermark insert
+    assert dict(ch.client.rows) == {'db.brs_audit': 2, 'db.brs_schema': 1, 'db.brs_watermark': 1}
+    assert not ch.client.find('brs_audit_temp')
+
+
+def test_batch_is_inserted_as_columns():
+    ch = make_clickhouse()
+    client = Client(ch)
+    load(client, 'a', 'b')
+    client.flush()
+
+    assert ch.client.find('INSERT INTO db.brs_audit (entity_href, entity_id, entity_type, entity_data, '
+                          'event_type, event_moment, event_moment2) VALUES')
+    assert ch.client.rows['db.brs_audit'] == 2
+    assert not hasattr(ch.client, 'insert_dataframe')
+
+
+def test_naive_moments_are_in_server_timezone():
+    pytz = pytest.importorskip('pytz')
+    ch = make_clickhouse()
+    rows = [{'entity_href': 'h', 'entity_id': '1', 'entity_type': 'order', 'entity_data': '{}',
+             'event_type': 'update', 'event_moment': moment}
+            for moment in ('2024-01-01 03:00:00', '2024-01-01T00:00:00+00:00')]
+    columns = ch._insert_columns(rows, pytz.timezone('Europe/Moscow'))
+
+    midnight_utc = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp())
+    assert columns[5] == [midnight_utc, midnight_utc]
+    assert columns[6] is columns[5]
+    # an injected client has no connection to ask
+    assert ch.server_timezone() is pytz.utc
+
+
+def test_other_modes_drop_leftover_view():
+    ch = make_clickhouse(partition_mode='direct')
+    ch.create_tables()
+    assert ch.client.find('DROP VIEW IF EXISTS db.brs_audit_partition_mv')
+
+
+def test_unknown_partition_mode():
+    with pytest.raises(ValueError):
+        make_clickhouse(partition_mode='copy')
+
+
+def test_update_tables_reads_entity_types_from_registry():
+    ch = make_clickhouse()
+    client = Client(ch)
+    load(client, 'a', 'b')
+    client.load_json_data('c', 'c', 'raw', 'text', '2024-01-01 00:00:00')
+    client.flush()
+
+    assert ch.get_schema() == {'order': {'href': None}, 'raw': {}}
+    assert ch.update_tables()['created'] == ['brv_order', 'brv_raw']
+    assert not ch.client.find('DISTINCT entity_type')
+    # the registry is seeded from the loaded rows once
+    assert len(ch.client.find('ROW_NUMBER()')) == 1
+    ch.update_tables()
+    assert len(ch.client.find('ROW_NUMBER()')) == 1
+
+
+def test_update_tables_scans_with_rediscover():
+    ch = make_clickhouse()
+    client = Client(ch)
+    load(client, 'a')
+    client.flush()
+    ch.update_tables()
+    ch.client.queries.clear()
+    ch.update_tables()
+    assert not ch.client.find('ROW_NUMBER()')
+
+    ch.update_tables(rediscover=True)
+    assert ch.client.find('ROW_NUMBER()')
+
+
+def test_first_update_tables_discovers_fields_loaded_before_the_registry():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'SELECT distinct(entity_type)': [('order', '{"c": 1}')],
+    }))
+    client = Client(ch)
+    load(client, 'a')
+    client.flush()
+
+    ch.update_tables()
+    assert ch.get_schema() == {'order': {'href': None, 'c': None}}
+    assert '`c`' in ch.client.find('create or replace view db.brv_order')[0]
+
+
+def test_view_keeps_columns_missing_from_registry():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'FROM system.columns': [
+            ('brv_order', ['entity_href', 'entity_id', 'event_moment', 'a', 'b', 'c'],
+             ['String', 'String', 'DateTime', 'String', 'String', 'Nullable(Int64)'])],
+    }))
+    ch.set_schema_discovered()
+    client = Client(ch)
+    client.load_json_data('x', 'x', 'order', {'a': 1, 'b': 2, 'd': 3}, '2024-01-01 00:00:00')
+    client.flush()
+
+    assert ch.update_tables()['updated'] == ['brv_order']
+    view = ch.client.find('create or replace view db.brv_order')[0]
+    for column in ('`a`', '`b`', '`d`'):
+        assert column in view
+    # the column keeps its type
+    assert "JSONExtract(entity_data, 'c', 'Nullable(Int64)') as `c`" in view
+
+
+def test_latest_state_uses_one_view_into_one_table():
+    ch = make_clickhouse(latest_state=True)
+    client = Client(ch)
+    load(client, 'a')
+    load(client, 'b', entity_type='item')
+    client.flush()
+    ch.update_tables()
+
+    assert len(ch.client.find('CREATE MATERIALIZED VIEW IF NOT EXISTS db.brs_latest_mv TO db.brs_latest')) == 1
+    assert ch.client.find('ReplacingMergeTree(event_moment2) order by (entity_type, entity_href)')
+    # a new brs_latest is filled from brs_audit
+    assert ch.client.find('INSERT INTO db.brs_latest SELECT')
+    assert ch.client.find("FROM db.brs_latest FINAL WHERE entity_type = 'item'")
+
+
+def test_latest_state_off_keeps_tables_and_switches_views():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        "startsWith(name, 'brv_')": [('brv_order',)],
+        'FROM system.columns': [('brv_order', ['entity_href', 'entity_id', 'event_moment', 'href'],
+                                 ['String', 'String', 'DateTime', 'String'])],
+    }))
+    ch.update_schema({'order': {'href': None}})
+
+    assert ch.update_tables()['updated'] == ['brv_order']
+    assert not ch.client.find('DROP TABLE IF EXISTS db.brs_latest')
+    assert ch.client.find('FROM db.brs_audit_partition WHERE partition_entity_type')
+
+    ch.drop_latest_state()
+    assert ch.client.find('DROP VIEW IF EXISTS db.brs_latest_mv')
+    assert ch.client.find('DROP TABLE IF EXISTS db.brs_latest')
+
+
+def test_sync_copies_rows_after_watermark():
+    ch = make_clickhouse()
+    ch.update_tables()
+
+    sync = ch.client.find('INSERT INTO db.brs_audit_partition SELECT')[0]
+    assert 'WHERE event_moment > (SELECT max(watermark)' in sync
+    assert 'NOT IN' in sync
+    assert ch.client.find("INSERT INTO db.brs_watermark (table_name, watermark) SELECT 'brs_audit_partition'")
+    assert not ch.client.find('EXCHANGE TABLES')
+
+
+@pytest.mark.parametrize('watermarks, full_rebuild', [([(0,)], False), ([(1,)], True)])
+def test_rebuild_swaps_in_shadow_table(watermarks, full_rebuild):
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'SELECT count() FROM db.brs_watermark': watermarks}))
+    ch.update_tables(full_rebuild=full_rebuild)
+
+    assert ch.client.find('CREATE TABLE IF NOT EXISTS db.brs_audit_partition_shadow')
+    assert ch.client.find('INSERT INTO db.brs_audit_partition_shadow SELECT')
+    assert ch.client.find('EXCHANGE TABLES db.brs_audit_partition AND db.brs_audit_partition_shadow')
+
+
+def test_update_tables_summary():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'FROM system.columns': [
+            ('brv_item', ['entity_href', 'entity_id', 'event_moment', 'href'], ['String', 'String', 'DateTime', 'String']),
+            ('brv_order', ['entity_href', 'entity_id', 'event_moment'], ['String', 'String', 'DateTime'])],
+    }))
+    ch.update_schema({'item': {'href': None}, 'order': {'href': None}, 'user': {'href': None}})
+    summary = ch.update_tables()
+
+    assert (summary['created'], summary['updated'], summary['skipped']) == (['brv_user'], ['brv_order'], ['brv_item'])
+    assert {'audit_partition', 'schema', 'catalog', 'views', 'total', 'brv_user'} <= summary['timings'].keys()
+    # the catalog is one query, not one per view
+    assert len(ch.client.find("startsWith(table, 'brv_') GROUP BY table")) == 1
+    assert len(ch.client.find('create or replace view')) == 2
+
+    # the catalog still lacks brv_user
+    assert ch.update_tables(rebuild_views=True)['updated'] == ['brv_item', 'brv_order']
+
+
+def test_layout_options_shape_audit_partition():
+    ch = make_clickhouse(partition_buckets=16, time_partition='month', order_by=('entity_type', 'entity_href'))
+    ch.update_schema({'order': {'href': None}})
+    ch.update_tables()
+
+    assert ch.client.find('PARTITION BY (partition_entity_type, toYYYYMM(event_moment)) '
+                          'order by (entity_type, entity_href)')
+    assert 'abs(farmFingerprint64(entity_type) % 16)' in ch.client.find('INSERT INTO db.brs_audit_partition SELECT')[0]
+    assert "abs(farmFingerprint64('order') % 16)" in ch.client.find('create or replace view db.brv_order')[0]
+    assert ch.get_layout() == {'partition_buckets': 16, 'time_partition': 'month',
+                               'order_by': ['entity_type', 'entity_href']}
+
+
+def test_layout_options_are_checked():
+    with pytest.raises(ValueError):
+        make_clickhouse(partition_buckets=0)
+    with pytest.raises(ValueError):
+        make_clickhouse(time_partition='hour')
+    with pytest.raises(ValueError):
+        make_clickhouse(order_by='entity_type')
+
+
+def test_filled_table_without_layout_keeps_default_layout():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'SELECT count() FROM db.brs_audit_partition': [(10,)]}))
+    ch.update_tables()
+    assert ch.get_layout() == ch.LEGACY_LAYOUT == ch.partition_layout()
+
+
+def test_filled_table_without_layout_needs_migration():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'SELECT count() FROM db.brs_audit_partition': [(10,)]}), order_by=('entity_type', 'entity_href'))
+    with pytest.raises(ValueError, match='migrate_partitioning'):
+        ch.update_tables()
+    assert ch.get_layout() == ch.LEGACY_LAYOUT
+    client = Client(ch)
+    load(client, 'a')
+    with pytest.raises(ValueError, match='migrate_partitioning'):
+        client.flush()
+
+    ch.migrate_partitioning()
+
+    assert ch.client.find('INSERT INTO db.brs_audit_partition_shadow SELECT')
+    assert ch.client.find('EXCHANGE TABLES db.brs_audit_partition AND db.brs_audit_partition_shadow')
+    assert ch.get_layout() == ch.partition_layout()
+    ch.update_schema({'order': {'href': None}})
+    assert ch.update_tables()['created'] == ['brv_order']
+
+
+def test_typed_views_extract_fields_by_type():
+    ch = make_clickhouse()
+    ch.update_schema({'order': {'total': 'int', 'address.city': 'string', 'paid': 'bool', 'at': 'timestamp',
+                                'meta': 'json', 'note': None}})
+    ch.update_tables()
+
+    view = ch.client.find('create or replace view db.brv_order')[0]
+    assert "JSONExtract(entity_data, 'total', 'Nullable(Int64)') as `total`" in view
+    assert "JSONExtract(entity_data, 'paid', 'Nullable(Bool)') as `paid`" in view
+    assert "JSON_VALUE(entity_data, '$.address.city') as `address__city`" in view
+    assert "parseDateTime64BestEffortOrNull(JSONExtractString(entity_data, 'at'), 3, 'UTC') as `at`" in view
+    assert "JSONExtractRaw(entity_data, 'meta') as `meta`" in view
+    assert "JSON_VALUE(entity_data, '$.note') as `note`" in view
+
+
+def test_widened_field_updates_view():
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient({
+        'FROM system.columns': [
+            ('brv_order', ['entity_href', 'entity_id', 'event_moment', 'total'],
+             ['String', 'String', 'DateTime', 'Nullable(Int64)'])],
+    }))
+    ch.update_schema({'order': {'total': 'int'}})
+    assert ch.update_tables()['skipped'] == ['brv_order']
+
+    ch.update_schema({'order': {'total': 'float'}})
+    assert ch.get_schema() == {'order': {'total': 'float'}}
+    assert ch.update_tables()['updated'] == ['brv_order']
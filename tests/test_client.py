@@ -0,0 +1,118 @@
+import pytest
+
+from cloudreports.client import Client
+from tests.helpers import LoadError, load, wait_for
+
+
+def test_failed_sync_load_keeps_buffer(database):
+    client = Client(database)
+    database.failures = 1
+    load(client, 'a', 'b', 'c')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    client.flush()
+    assert database.hrefs == ['a', 'b', 'c']
+    assert database.fields == {'order': {'href': None}}
+
+
+@pytest.mark.parametrize('dedup', ['latest', 'content'])
+def test_failed_sync_load_keeps_deduplicated_buffer(database, dedup):
+    client = Client(database, dedup=dedup)
+    database.failures = 1
+    load(client, 'a', 'b', 'a')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    client.flush()
+    assert sorted(database.hrefs) == ['a', 'b']
+
+
+def test_failed_sync_load_keeps_rows_buffered_after_it(database):
+    client = Client(database)
+    database.failures = 1
+    load(client, 'a')
+    with pytest.raises(LoadError):
+        client.flush()
+    load(client, 'b', entity_data={'href': 'b', 'new': 1})
+
+    client.flush()
+    assert database.hrefs == ['a', 'b']
+    assert database.fields == {'order': {'href': None, 'new': None}}
+
+
+def test_async_flush_loads_on_worker_thread(database):
+    client = Client(database, async_flush=True, buffer_size=1)
+    load(client, 'a', 'b', 'c')
+    client.flush()
+
+    assert database.hrefs == ['a', 'b', 'c']
+    assert set(database.threads) == {'cloudreports-flush'}
+    client.close()
+    assert client._flush_thread is None
+
+
+def test_async_error_is_raised_by_next_flush(database):
+    client = Client(database, async_flush=True, buffer_size=1)
+    database.failures = 1
+    load(client, 'a', 'b')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    # raised once, later batches load
+    load(client, 'c')
+    client.flush()
+    assert database.hrefs == ['c']
+    client.close()
+
+
+def test_async_error_is_raised_by_next_load(database):
+    client = Client(database, async_flush=True, buffer_size=1)
+    database.failures = 1
+    load(client, 'a', 'b')
+    wait_for(lambda: database.calls)
+    wait_for(lambda: client._flush_queue.unfinished_tasks == 0)
+    with pytest.raises(LoadError):
+        load(client, 'c')
+    client.close()
+
+
+def test_tracks_fields_and_entity_types(database):
+    client = Client(database)
+    client.load_json_data('a', 'a', 'order', {'x': 1}, '2024-01-01 00:00:00')
+    client.load_json_data('b', 'b', 'order', {'y': 1}, '2024-01-01 00:00:00')
+    client.load_json_data('c', 'c', 'raw', 'text', '2024-01-01 00:00:00')
+    client.flush()
+
+    # an entity type without fields is registered all the same
+    assert database.fields == {'order': {'x': None, 'y': None}, 'raw': {}}
+    assert database.calls == ['update_schema', 'load_json_data']
+
+
+def test_content_dedup_drops_unchanged_rows(database):
+    client = Client(database, dedup='content')
+    load(client, 'a', 'b')
+    client.flush()
+    load(client, 'a')
+    load(client, 'b', entity_data={'href': 'b', 'changed': True})
+    client.flush()
+
+    assert database.hrefs == ['a', 'b', 'b']
+    assert client.dedup_stats['rows_saved'] == 1
+
+
+def test_content_dedup_resends_rows_of_failed_async_load(database):
+    client = Client(database, dedup='content', async_flush=True)
+    database.failures = 1
+    load(client, 'a', 'b')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    load(client, 'a', 'b')
+    client.flush()
+    assert database.hrefs == ['a', 'b']
+
+    load(client, 'a', 'b')
+    client.flush()
+    assert database.hrefs == ['a', 'b']
+    client.close()
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+
+import pytest
+
+from cloudreports import database
+
+
+def test_backends_import_on_first_access():
+    code = ("import sys; from cloudreports import database; "
+            "print('clickhouse_driver' in sys.modules, 'google.cloud.bigquery' in sys.modules)")
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                            env={'PYTHONPATH': ':'.join(sys.path)})
+    assert result.stdout.split() == ['False', 'False']
+
+
+def test_unknown_backend():
+    with pytest.raises(AttributeError):
+        database.Oracle
+    assert {'ClickHouse', 'BigQuery', 'LocalFiles'} <= set(dir(database))
@@ -0,0 +1,85 @@
+import pytest
+
+from cloudreports.buffer import ColumnBuffer
+from cloudreports.dedup import Deduplicator
+
+
+def buffer(*rows):
+    data = ColumnBuffer()
+    for entity_href, entity_data, event_moment in rows:
+        data.append(entity_href, entity_href, 'order', entity_data, event_moment, 'update')
+    return data
+
+
+def test_latest_keeps_latest_row_per_href():
+    dedup = Deduplicator('latest')
+    data, saved_bytes, digests = dedup.collapse(buffer(
+        ('a', '{"v":2}', '2024-01-02 00:00:00'),
+        ('a', '{"v":1}', '2024-01-01 00:00:00'),
+        ('b', '{"v":1}', '2024-01-01 00:00:00'),
+        ('b', '{"v":2}', '2024-01-01 00:00:00')))
+
+    assert list(zip(data.entity_href, data.entity_data)) == [('a', '{"v":2}'), ('b', '{"v":2}')]
+    assert saved_bytes > 0
+    assert digests is None
+
+
+def test_content_remembers_rows_only_once_committed():
+    dedup = Deduplicator('content')
+    rows = (('a', '{"v":1}', '2024-01-01 00:00:00'),)
+    data, _, digests = dedup.collapse(buffer(*rows))
+    assert len(data) == 1
+
+    # not committed: the load failed, the row is kept again
+    data, _, digests = dedup.collapse(buffer(*rows))
+    assert len(data) == 1
+
+    dedup.commit(digests)
+    data, _, _ = dedup.collapse(buffer(*rows))
+    assert len(data) == 0
+
+
+def test_content_drops_repeats_within_a_buffer():
+    dedup = Deduplicator('content')
+    data, _, _ = dedup.collapse(buffer(
+        ('a', '{"v":1}', '2024-01-01 00:00:00'),
+        ('a', '{"v":1}', '2024-01-02 00:00:00'),
+        ('a', '{"v":2}', '2024-01-03 00:00:00'),
+        ('a', '{"v":1}', '2024-01-04 00:00:00')))
+
+    assert data.entity_data == ['{"v":1}', '{"v":2}', '{"v":1}']
+
+
+def test_content_cache_evicts_least_recent():
+    dedup = Deduplicator('content', cache_size=1)
+    _, _, digests = dedup.collapse(buffer(('a', '{}', 'm'), ('b', '{}', 'm')))
+    dedup.commit(digests)
+
+    data, _, _ = dedup.collapse(buffer(('a', '{}', 'm'), ('b', '{}', 'm')))
+    assert data.entity_href == ['a']
+
+
+def test_bytes_saved_counts_utf8():
+    dedup = Deduplicator('latest')
+    dedup.collapse(buffer(('a', 'é', '2024-01-01 00:00:00'), ('a', 'é', '2024-01-02 00:00:00')))
+
+    assert dedup.stats == {'rows_in': 2, 'rows_out': 1, 'rows_saved': 1,
+                           'bytes_saved': len('aaorderé2024-01-01 00:00:00update'.encode('utf-8'))}
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        Deduplicator('newest')
+
+
+@pytest.mark.parametrize('mode', Deduplicator.MODES)
+def test_entity_types_sharing_an_href_are_kept_apart(mode):
+    dedup = Deduplicator(mode)
+    data = ColumnBuffer()
+    data.append('42', '42', 'invoice', '{"v":1}', '2024-01-01 00:00:00', 'update')
+    data.append('42', '42', 'payment', '{"v":1}', '2024-01-01 00:00:00', 'update')
+    data, _, digests = dedup.collapse(data)
+
+    assert data.entity_type == ['invoice', 'payment']
+    if digests is not None:
+        assert set(digests) == {('invoice', '42'), ('payment', '42')}
@@ -0,0 +1,43 @@
+from cloudreports.functions import (delete_personal_data, delete_personal_data_batch, hmac_sha256_hash,
+                                    sha256_hash)
+
+
+def records():
+    return [{'email': 'a@example.com', 'phone': 79990000000, 'name': 'A'},
+            {'email': 'a@example.com', 'phone': None, 'name': 'B'}]
+
+
+def test_batch_hashes_like_single_records():
+    expected = [delete_personal_data(record, ['email', 'phone']) for record in records()]
+
+    assert delete_personal_data_batch(records(), ['email', 'phone']) == expected
+    assert expected[0] == {'email': sha256_hash('a@example.com'), 'phone': '', 'name': 'A'}
+    assert expected[1]['phone'] is None
+
+
+def test_batch_with_key_uses_hmac():
+    result = delete_personal_data_batch(records(), ['email'], key='secret')
+
+    assert result[0]['email'] == hmac_sha256_hash('a@example.com', 'secret')
+    assert result[0]['email'] != sha256_hash('a@example.com')
+    assert delete_personal_data_batch(records(), ['email'], key=b'secret', cache_size=0) == result
+
+
+def test_nested_paths_and_lists():
+    record = {'customer': {'email': 'x'}, 'contacts': [{'phone': '1'}, {'phone': '2'}], 'a.b': 'dotted'}
+    delete_personal_data(record, ['customer.email', 'contacts.phone', 'a.b', 'missing.key'])
+
+    assert record == {'customer': {'email': sha256_hash('x')},
+                      'contacts': [{'phone': sha256_hash('1')}, {'phone': sha256_hash('2')}],
+                      # an exact top-level key wins over the path
+                      'a.b': sha256_hash('dotted')}
+
+
+def test_batch_in_processes_changes_records_in_place():
+    batch = [dict(record) for record in records() * 3]
+    result = delete_personal_data_batch(batch, ['email'], processes=2, chunk_size=2)
+
+    assert [record['email'] for record in result] == [sha256_hash('a@example.com')] * 6
+    # no plaintext left in the caller's records, whatever the batch size
+    assert all(record is original for record, original in zip(result, batch))
+    assert batch[0]['email'] == sha256_hash('a@example.com')
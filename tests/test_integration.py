@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.integration import ProgressReporter, make_session
+
+
+class Recorder(object):
+
+    def __init__(self, error=None):
+        self.reports = []
+        self.error = error
+        self.sent = threading.Event()
+
+
+    def __call__(self, **fields):
+        self.reports.append(fields)
+        self.sent.set()
+        if self.error is not None:
+            raise self.error
+
+
+def test_updates_within_interval_merge_into_one_report():
+    send = Recorder()
+    reporter = ProgressReporter(send, interval=60)
+    reporter.update(load_rows=1)
+    assert send.sent.wait(5)
+
+    reporter.update(load_rows=2)
+    reporter.update(load_rows=3, load_percent=50)
+    reporter.close()
+    assert send.reports == [{'load_rows': 1}, {'load_rows': 3, 'load_percent': 50}]
+
+
+def test_flush_sends_pending_report_now():
+    send = Recorder()
+    reporter = ProgressReporter(send, interval=60)
+    reporter.update(load_rows=1)
+    assert send.sent.wait(5)
+
+    reporter.update(load_rows=2)
+    reporter.flush()
+    assert send.reports == [{'load_rows': 1}, {'load_rows': 2}]
+    reporter.close()
+    assert reporter.sent == 2
+
+
+def test_send_errors_are_kept():
+    error = RuntimeError("api down")
+    reporter = ProgressReporter(Recorder(error), interval=0)
+    reporter.update(load_rows=1)
+    reporter.close()
+
+    assert reporter.last_error is error
+    with pytest.raises(ValueError):
+        reporter.update(load_rows=2)
+
+
+def test_client_flush_reports_progress(database, integration_api):
+    client = Client(database, cr_api_url=integration_api.url, cr_api_token='token',
+                    cr_integration_id=7, progress_interval=60)
+    for href in ('a', 'b', 'c'):
+        client.load_json_data(href, href, 'order', {}, '2024-01-01 00:00:00')
+    client.flush()
+
+    assert integration_api.requests[-1] == ('/integrations/7', 'cr_api_token token', {'load_rows': 3})
+    client.close()
+
+
+def test_session_reuses_connection_and_retries(integration_api):
+    session = make_session(retries=2)
+    adapter = session.get_adapter(integration_api.url)
+    assert adapter.max_retries.total == 2
+    assert 'PUT' in adapter.max_retries.allowed_methods
+
+    client = Client(None, cr_api_url=integration_api.url, cr_api_token='token', cr_integration_id=7)
+    client.set_integration(load_rows=1)
+    client.set_integration(load_rows=2)
+    assert client._session is client._http()
+    assert [body for _, _, body in integration_api.requests] == [{'load_rows': 1}, {'load_rows': 2}]
+    client.close()
@@ -0,0 +1,119 @@
+import os
+
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.database.common import SchemaRegistry
+from cloudreports.database.localfiles import LocalFiles
+
+
+def make_files(tmp_path, **options):
+    options.setdefault('file_format', 'ndjson')
+    return LocalFiles(str(tmp_path), **options)
+
+
+def view_rows(files, entity_type):
+    directory = os.path.join(str(files._directory), f'brv_{entity_type}')
+    path = os.path.join(directory, os.listdir(directory)[0])
+    columns = files._read(path, ('entity_href', 'total', 'paid'))
+    return list(zip(columns['entity_href'], columns['total'], columns['paid']))
+
+
+def test_update_tables_writes_latest_typed_rows(tmp_path):
+    files = make_files(tmp_path)
+    client = Client(files, infer_types=True)
+    client.load_json_data('a', 1, 'order', {'total': 1, 'paid': False}, '2024-01-01 00:00:00')
+    client.load_json_data('a', 1, 'order', {'total': 2, 'paid': True}, '2024-01-02 00:00:00')
+    client.load_json_data('b', 2, 'order', {'total': None, 'paid': False}, '2024-01-01 00:00:00')
+    client.flush()
+
+    assert files.update_tables()['created'] == ['brv_order']
+    assert view_rows(files, 'order') == [('a', 2, True), ('b', None, False)]
+    assert sorted(os.listdir(tmp_path / 'brs_audit' / 'entity_type=order')) == ['date=2024-01-01', 'date=2024-01-02']
+
+
+def test_update_tables_reads_only_new_parts(tmp_path):
+    files = make_files(tmp_path)
+    client = Client(files)
+    client.load_json_data('a', 1, 'order', {'total': 1, 'paid': False}, '2024-01-01 00:00:00')
+    client.flush()
+    files.update_tables()
+
+    assert files.update_tables()['skipped'] == ['brv_order']
+    client.load_json_data('a', 1, 'order', {'total': 3, 'paid': True}, '2024-01-03 00:00:00')
+    client.flush()
+    assert files.update_tables()['updated'] == ['brv_order']
+    assert view_rows(files, 'order') == [('a', '3', 'true')]
+
+
+def test_entity_type_directories_are_encoded(tmp_path):
+    files = make_files(tmp_path, compression='gzip')
+    client = Client(files)
+    client.load_json_data('a', 1, 'sales/order', {'total': 1}, '2024-01-01 00:00:00')
+    client.flush()
+
+    assert os.listdir(tmp_path / 'brs_audit') == ['entity_type=sales%2Forder']
+    assert files.get_entity_types() == ['sales/order']
+    assert files.update_tables()['created'] == ['brv_sales/order']
+
+
+def test_parquet_files(tmp_path):
+    pytest.importorskip('pyarrow')
+    files = make_files(tmp_path, file_format='parquet')
+    client = Client(files, infer_types=True)
+    client.load_json_data('a', 1, 'order', {'total': 1, 'paid': True}, '2024-01-01 00:00:00')
+    client.flush()
+    files.update_tables()
+
+    assert view_rows(files, 'order') == [('a', 1, True)]
+
+
+def test_delete_tables(tmp_path):
+    files = make_files(tmp_path)
+    client = Client(files)
+    client.load_json_data('a', 1, 'order', {'total': 1}, '2024-01-01 00:00:00')
+    client.flush()
+    files.update_tables()
+
+    files.delete_tables(full_delete=False)
+    assert sorted(os.listdir(tmp_path)) == ['brs_audit', 'brs_schema.json', 'brs_schema_discovery']
+    files.delete_tables()
+    assert os.listdir(tmp_path) == []
+
+
+def test_options_are_checked(tmp_path):
+    with pytest.raises(ValueError):
+        make_files(tmp_path, file_format='csv')
+    with pytest.raises(ValueError):
+        make_files(tmp_path, compression='zstd')
+
+
+def test_run_sql_raises(tmp_path):
+    with pytest.raises(ValueError, match='cannot run SQL'):
+        make_files(tmp_path).run_sql('SELECT 1')
+
+
+def test_schema_registry_is_abstract():
+    class Partial(SchemaRegistry):
+
+        def get_schema(self):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_view_keeps_columns_missing_from_registry(tmp_path):
+    files = make_files(tmp_path)
+    client = Client(files, infer_types=True)
+    client.load_json_data('a', 1, 'order', {'total': 1, 'paid': True}, '2024-01-01 00:00:00')
+    client.flush()
+    files.update_tables()
+
+    # a registry that lacks a field the view has
+    os.remove(files.table_schema)
+    files.update_schema({'order': {'total': 'int'}})
+    client.load_json_data('a', 1, 'order', {'total': 2, 'paid': False}, '2024-01-02 00:00:00')
+    client.flush()
+    files.update_tables()
+    assert view_rows(files, 'order') == [('a', 2, False)]
@@ -0,0 +1,66 @@
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.metrics import NULL_METRICS, Metrics
+from tests.helpers import RecordingClickHouseClient, load
+
+
+def test_timers_and_counters():
+    metrics = Metrics()
+    metrics.observe('stage', 1.0)
+    metrics.observe('stage', 3.0)
+    with metrics.timer('block'):
+        pass
+    metrics.count('rows', 5)
+    metrics.count('rows')
+
+    snapshot = metrics.snapshot()
+    assert snapshot['timers']['stage'] == {'count': 2, 'total': 4.0, 'max': 3.0}
+    assert snapshot['timers']['block']['count'] == 1
+    assert snapshot['counters'] == {'rows': 6}
+
+    metrics.reset()
+    assert metrics.snapshot() == {'timers': {}, 'counters': {}}
+
+
+def test_observers_see_every_metric():
+    seen = []
+    metrics = Metrics(observers=[lambda *event: seen.append(event)])
+    metrics.observe('stage', 0.5)
+    metrics.count('rows', 2)
+
+    assert seen == [('timer', 'stage', 0.5), ('counter', 'rows', 2)]
+    with pytest.raises(ValueError):
+        metrics.add_observer('not callable')
+
+
+def test_to_prometheus():
+    metrics = Metrics()
+    metrics.observe('clickhouse.insert_audit', 0.25)
+    metrics.count('client.rows', 3)
+    metrics.count('say "hi"')
+
+    text = metrics.to_prometheus()
+    assert 'cloudreports_stage_seconds_sum{stage="clickhouse.insert_audit"} 0.25\n' in text
+    assert 'cloudreports_stage_seconds_count{stage="clickhouse.insert_audit"} 1\n' in text
+    assert 'cloudreports_stage_seconds_max{stage="clickhouse.insert_audit"} 0.25\n' in text
+    assert 'cloudreports_events_total{name="client.rows"} 3\n' in text
+    assert 'cloudreports_events_total{name="say \\"hi\\""} 1\n' in text
+    assert '# TYPE cloudreports_stage_seconds summary' in text
+
+
+def test_client_shares_metrics_with_database():
+    clickhouse = pytest.importorskip('cloudreports.database.clickhouse')
+    ch = clickhouse.ClickHouse('host', 'db', 'user', 'password', client=RecordingClickHouseClient())
+    assert ch.metrics is NULL_METRICS
+
+    metrics = Metrics()
+    client = Client(ch, metrics=metrics)
+    load(client, 'a', 'b')
+    client.flush()
+
+    snapshot = metrics.snapshot()
+    assert ch.metrics is metrics
+    assert snapshot['counters']['client.rows'] == 2
+    assert snapshot['counters']['clickhouse.rows'] == 2
+    assert {'client.load', 'client.serialize', 'clickhouse.insert_audit'} <= snapshot['timers'].keys()
@@ -0,0 +1,88 @@
+import asyncio
+import threading
+
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.prefetch import aprefetch, prefetch
+from tests.helpers import MOMENT, wait_for
+
+
+def prefetch_threads():
+    return [thread for thread in threading.enumerate() if thread.name == 'cloudreports-prefetch']
+
+
+def test_prefetch_yields_in_order():
+    assert list(prefetch(iter(range(10)), 3)) == list(range(10))
+
+
+def test_prefetch_reraises_error():
+    def pages():
+        yield 1
+        raise RuntimeError("page failed")
+
+    items = prefetch(pages())
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="page failed"):
+        next(items)
+
+
+def test_prefetch_close_stops_thread():
+    fetched = []
+
+    def pages():
+        for page in range(1000):
+            fetched.append(page)
+            yield page
+
+    items = prefetch(pages(), 2)
+    assert next(items) == 0
+    items.close()
+
+    wait_for(lambda: not prefetch_threads())
+    # read ahead by at most size items, plus the one blocked on a full queue
+    assert len(fetched) <= 4
+
+
+def test_prefetch_rejects_size():
+    with pytest.raises(ValueError):
+        list(prefetch([], 0))
+
+
+def test_aprefetch_close_cancels_task():
+    fetched = []
+
+    async def pages():
+        for page in range(1000):
+            fetched.append(page)
+            yield page
+
+    async def main():
+        items = aprefetch(pages(), 2)
+        assert await items.__anext__() == 0
+        await items.aclose()
+        await asyncio.sleep(0.01)
+        return [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    assert asyncio.run(main()) == []
+    assert len(fetched) <= 4
+
+
+def test_load_many_with_prefetch(database):
+    pages = [[('a', 1, 'order', {'x': 1}, MOMENT)], [], [('b', 2, 'order', {'x': 2}, MOMENT)]]
+    client = Client(database)
+
+    assert client.load_many(pages, mapper=lambda page: page, prefetch=2) == 2
+    client.flush()
+    assert database.hrefs == ['a', 'b']
+
+
+def test_aload_many_with_prefetch(database):
+    async def pages():
+        yield [('a', 1, 'order', {'x': 1}, MOMENT)]
+        yield [('b', 2, 'order', {'x': 2}, MOMENT)]
+
+    client = Client(database)
+    assert asyncio.run(client.aload_many(pages(), mapper=lambda page: page, prefetch=2)) == 2
+    client.flush()
+    assert database.hrefs == ['a', 'b']
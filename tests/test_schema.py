@@ -0,0 +1,74 @@
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.schema import infer_fields, merge_fields, merge_types, typed_fields, value_type, view_column
+from tests.helpers import MOMENT
+
+
+@pytest.mark.parametrize('value, expected', [
+    (True, 'bool'),
+    (1, 'int'),
+    (2 ** 63, 'string'),
+    (1.5, 'float'),
+    (None, None),
+    ('x', 'string'),
+    ('2024-01-01 00:00:00', 'timestamp'),
+    ('2024-01-01T00:00:00.123+03:00', 'timestamp'),
+    ('2024-01-01', 'string'),
+    ([1], 'json'),
+    ({'a': 1}, 'json'),
+])
+def test_value_type(value, expected):
+    assert value_type(value) == expected
+
+
+def test_infer_fields_flattens_to_depth():
+    document = {'total': 1, 'address': {'city': 'x', 'geo': {'lat': 1.5}}, 'tags': ['a'], 'odd': {'a.b': 1}}
+
+    assert infer_fields(document) == {'total': 'int', 'address': 'json', 'tags': 'json', 'odd': 'json'}
+    assert infer_fields(document, depth=2) == {
+        'total': 'int', 'address.city': 'string', 'address.geo': 'json', 'tags': 'json', 'odd': 'json'}
+    assert infer_fields(document, depth=3)['address.geo.lat'] == 'float'
+    assert infer_fields(document, types=False) == dict.fromkeys(document)
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    (None, 'int', 'int'),
+    ('int', None, 'int'),
+    ('int', 'int', 'int'),
+    ('int', 'float', 'float'),
+    ('int', 'json', 'json'),
+    ('bool', 'int', 'string'),
+    ('timestamp', 'string', 'string'),
+])
+def test_merge_types(a, b, expected):
+    assert merge_types(a, b) == expected
+    assert merge_types(b, a) == expected
+
+
+def test_merge_fields_returns_widened_fields():
+    fields = {'total': 'int', 'name': 'string'}
+
+    assert merge_fields(fields, {'total': 'float', 'name': None, 'paid': 'bool'}) == {'total': 'float', 'paid': 'bool'}
+    assert fields == {'total': 'float', 'name': 'string', 'paid': 'bool'}
+    assert merge_fields(fields, {'total': 'int'}) == {}
+
+
+def test_typed_fields():
+    assert typed_fields(['a', 'b']) == {'a': None, 'b': None}
+    assert typed_fields({'a': 'int'}) == {'a': 'int'}
+
+
+def test_view_column_is_shared():
+    assert view_column('entity_id') == 'entity_entity_id'
+    assert view_column('address.city') == 'address__city'
+    assert view_column('total') == 'total'
+
+
+def test_client_registers_typed_nested_fields(database):
+    client = Client(database, schema_depth=2, infer_types=True)
+    client.load_json_data('a', 1, 'order', {'total': 1, 'address': {'city': 'x'}}, MOMENT)
+    client.load_json_data('b', 2, 'order', {'total': 1.5}, MOMENT)
+    client.flush()
+
+    assert database.fields == {'order': {'total': 'float', 'address.city': 'string'}}
@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from cloudreports.serializer import SERIALIZERS, get_serializer
+
+WIDE = {'id': 2 ** 70, 'name': 'é'}
+
+
+@pytest.mark.parametrize('name', list(SERIALIZERS))
+def test_wide_ints_fall_back_to_stdlib(name):
+    try:
+        serializer = get_serializer(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+
+    assert json.loads(serializer.dumps(WIDE)) == WIDE
+    assert json.loads(serializer.dumps_bytes(WIDE)) == WIDE
+    assert [json.loads(s) for s in serializer.dumps_many([{'id': 1}, WIDE])] == [{'id': 1}, WIDE]
+    assert [json.loads(line) for line in serializer.dumps_ndjson([{'id': 1}, WIDE]).splitlines()] == [{'id': 1}, WIDE]
+
+
+def test_unknown_serializer():
+    with pytest.raises(ValueError):
+        get_serializer('yaml')
+
+
+@pytest.mark.parametrize('name', list(SERIALIZERS))
+def test_dumps_matches_stdlib_json(name):
+    try:
+        serializer = get_serializer(name)
+    except ImportError:
+        pytest.skip(f"{name} is not installed")
+
+    document = {'a': [1, 2.5, None, True], 'b': {'c': 'é'}}
+    assert json.loads(serializer.dumps(document)) == document
+    assert serializer.loads(serializer.dumps(document)) == document
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.spool import Spool
+from tests.helpers import MOMENT, LoadError, load, wait_for
+
+
+def test_shard_timer_flushes_on_worker_thread(database):
+    client = Client(database, async_flush=True, shard_by_entity_type=True, shard_max_age=0.05)
+    load(client, 'a')
+
+    wait_for(lambda: database.hrefs == ['a'])
+    assert database.threads == ['cloudreports-flush']
+    client.close()
+
+
+def test_shard_max_age_needs_async_flush(database):
+    with pytest.raises(ValueError, match='async_flush'):
+        Client(database, shard_by_entity_type=True, shard_max_age=0.05)
+
+
+def test_shards_release_shared_spool_segment_once(database, tmp_path):
+    spool = Spool(str(tmp_path))
+    client = Client(database, spool=spool, shard_by_entity_type=True, shard_buffer_sizes={'order': 1})
+    load(client, 'item-1', entity_type='item')
+    load(client, 'order-1', 'order-2')
+
+    # the order shard loaded, the item row still needs the segment
+    assert database.hrefs == ['order-1', 'order-2']
+    assert len(spool.pending()) == 1
+
+    client.flush()
+    assert database.hrefs == ['order-1', 'order-2', 'item-1']
+    assert spool.pending() == []
+    client.close()
+
+
+def test_failed_shard_load_keeps_shard(database, tmp_path):
+    spool = Spool(str(tmp_path))
+    client = Client(database, spool=spool, shard_by_entity_type=True)
+    database.failures = 1
+    load(client, 'a', 'b', 'c')
+    with pytest.raises(LoadError):
+        client.flush()
+
+    client.flush()
+    assert sorted(database.hrefs) == ['a', 'b', 'c']
+    assert database.fields == {'order': {'href': None}}
+    assert spool.pending() == []
+    client.close()
+
+
+def test_aload_many_submits_shards_in_executor(database):
+    async def pages():
+        yield [('a', 1, 'order', {'x': 1}, MOMENT), ('b', 2, 'order', {'x': 2}, MOMENT)]
+
+    client = Client(database, shard_by_entity_type=True, shard_buffer_sizes={'order': 0})
+    assert asyncio.run(client.aload_many(pages(), mapper=lambda page: page)) == 2
+
+    assert database.hrefs == ['a', 'b']
+    assert 'MainThread' not in database.threads
+    client.close()
+
+
+def test_load_many_raises_error_of_async_shard_load(database):
+    client = Client(database, shard_by_entity_type=True, shard_buffer_sizes={'order': 0}, async_flush=True)
+    database.failures = 1
+
+    def mapper(href):
+        if href == 'c':
+            wait_for(lambda: client._flush_error is not None)
+        return (href, href, 'order', {'href': href}, MOMENT)
+
+    with pytest.raises(LoadError):
+        client.load_many(['a', 'b', 'c', 'd'], mapper=mapper)
+    client.close()
@@ -0,0 +1,53 @@
+import pytest
+
+from cloudreports.client import Client
+from cloudreports.spool import Spool
+from tests.helpers import LoadError, RecordingDatabase, load
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_segments_hold_rows_until_acknowledged(tmp_path, compress):
+    spool = Spool(str(tmp_path), compress=compress)
+    spool.append(('a', '1', 'order', '{}', 'm', 'update'))
+    spool.append(('b', '2', 'order', '{}', 'm', 'update'))
+    segments = spool.seal()
+
+    assert spool.pending() == segments
+    data = spool.read(segments[0])
+    assert data.entity_href == ['a', 'b']
+
+    spool.ack(segments)
+    assert spool.pending() == []
+    spool.close()
+
+
+def test_failed_load_keeps_rows_in_spool(database, tmp_path):
+    spool = Spool(str(tmp_path))
+    client = Client(database, spool=spool)
+    database.failures = 1
+    load(client, 'a', 'b')
+    with pytest.raises(LoadError):
+        client.flush()
+    assert len(spool.pending()) == 1
+
+    client.flush()
+    assert database.hrefs == ['a', 'b']
+    assert spool.pending() == []
+    client.close()
+
+
+def test_spool_replays_rows_of_failed_run(tmp_path):
+    failing = RecordingDatabase(failures=1)
+    client = Client(failing, spool=Spool(str(tmp_path)), async_flush=True)
+    load(client, 'a', 'b')
+    with pytest.raises(LoadError):
+        client.close()
+
+    database = RecordingDatabase()
+    spool = Spool(str(tmp_path))
+    Client(database, spool=spool).close()
+    assert database.hrefs == ['a', 'b']
+    # fields of replayed rows are registered before they load
+    assert database.fields == {'order': {'href': None}}
+    assert database.calls == ['update_schema', 'load_json_data']
+    assert spool.pending() == []